@@ -0,0 +1,250 @@
+"""Columnar ballot analytics with pandas.
+
+``BallotFrame`` keeps the ballots as a DataFrame (``vote_id``, ``candidate``,
+``timestamp``) and refreshes it incrementally: each refresh parses only the
+ballots committed since the previous one. For the append-only log that is
+a single bulk ``read_json`` over the new byte range, and for the compact
+store a column-by-column conversion of the mapped records, so no Python
+code runs per ballot. The statistics below are plain groupby/resample calls on
+that frame.
+
+``BallotTally`` feeds the same new ballots, with their rankings, to a
+``tabulation.StreamingTally`` per method.
+"""
+import io
+import json
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from storage import CompactStore, VoteLog
+from storage.compact import NO_CHOICE, READ_CHUNK
+from tabulation import StreamingTally, ballot_rankings
+
+try:
+    import pyarrow  # noqa: F401
+    JSON_ENGINE = "pyarrow"
+except ImportError:
+    JSON_ENGINE = "ujson"
+
+COLUMNS = ["vote_id", "candidate", "timestamp"]
+
+
+def read_ndjson(data):
+    """Parse NDJSON bytes into a DataFrame in one bulk call, leaving strings as stored"""
+    if JSON_ENGINE == "pyarrow":
+        return pd.read_json(io.BytesIO(data), lines=True, engine="pyarrow")
+    return pd.read_json(io.BytesIO(data), lines=True, convert_dates=False, dtype=False)
+
+
+def _prepare(frame):
+    frame = frame[COLUMNS].copy()
+    frame["timestamp"] = pd.to_datetime(frame["timestamp"], format="ISO8601")
+    return frame
+
+
+OFFSET_BUCKET_MS = 15 * 60 * 1000  # time zones change offset on quarter-hour boundaries
+
+
+def local_times(timestamp_ms):
+    """Epoch-ms as naive local times, like the other backends store them
+
+    The UTC offset is looked up once per quarter hour present rather than
+    per ballot.
+    """
+    buckets, inverse = np.unique(timestamp_ms // OFFSET_BUCKET_MS, return_inverse=True)
+    offsets = np.array([datetime.fromtimestamp(bucket * OFFSET_BUCKET_MS / 1000).astimezone().utcoffset()
+                        .total_seconds() * 1000 for bucket in buckets.tolist()], dtype=np.int64)
+    return pd.to_datetime(timestamp_ms + offsets[inverse.reshape(-1)], unit="ms")
+
+
+def records_frame(records, candidates):
+    """Compact-store records as a ballot frame"""
+    return pd.DataFrame({
+        "vote_id": records["vote_id"].astype("int64"),
+        "candidate": np.array(candidates, dtype=object)[records["candidate"]],
+        "timestamp": local_times(records["timestamp_ms"]),
+    })
+
+
+def empty_frame():
+    return _prepare(pd.DataFrame({"vote_id": pd.Series(dtype="int64"),
+                                  "candidate": pd.Series(dtype="str"),
+                                  "timestamp": pd.Series(dtype="str")}))
+
+
+class BallotFrame:
+    """The store's ballots as a DataFrame, loaded once and then incrementally"""
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._chunks = []
+        self._cursor = None
+        self._last_vote_id = 0
+
+    def refresh(self):
+        """Load ballots committed since the last refresh and return the whole frame"""
+        with self._lock:
+            if isinstance(self.store, VoteLog):
+                chunk, reset = self._read_log()
+            elif isinstance(self.store, CompactStore):
+                chunk, reset = self._read_records()
+            else:
+                chunk, reset = self._read_rows()
+            if reset:
+                self._chunks = []
+            if len(chunk):
+                self._chunks.append(chunk)
+                self._last_vote_id = int(chunk["vote_id"].iloc[-1])
+            elif reset:
+                self._last_vote_id = 0
+            return self._frame()
+
+    def reset(self):
+        """Forget everything loaded; the next refresh reads the store from the start"""
+        with self._lock:
+            self._chunks = []
+            self._cursor = None
+            self._last_vote_id = 0
+
+    def _frame(self):
+        if not self._chunks:
+            return empty_frame()
+        if len(self._chunks) > 1:
+            self._chunks = [pd.concat(self._chunks, ignore_index=True)]
+        return self._chunks[0]
+
+    def _read_log(self):
+        start, end, self._cursor = self.store.committed_span(self._cursor)
+        if start == end:
+            return empty_frame(), start == 0
+        with open(self.store.votes_path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
+        return _prepare(read_ndjson(data)), start == 0
+
+    def _read_records(self):
+        start, end, self._cursor = self.store.committed_span(self._cursor)
+        if start == end:
+            return empty_frame(), start == 0
+        return records_frame(self.store.records(start, end), self.store.candidates()), start == 0
+
+    def _read_rows(self):
+        # Ballot numbers restart after a clear
+        reset = self.store.vote_count() < self._last_vote_id
+        after = 0 if reset else self._last_vote_id
+        rows = list(self.store.ballots_after(after))
+        return _prepare(pd.DataFrame(rows, columns=COLUMNS)), reset
+
+
+class BallotTally:
+    """A ``StreamingTally`` per method over the store's ballots, fed incrementally
+
+    Like ``BallotFrame``, each tabulation reads only the ballots committed
+    since the previous one, and starts over only when the store was cleared
+    or replaced. IRV keeps every ballot and reruns its rounds on request,
+    still without rereading the store.
+    """
+
+    def __init__(self, store, candidates, chunk_size=100000):
+        self.store = store
+        self.candidates = list(candidates)
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def result(self, method):
+        """Tabulate every committed ballot with ``method``"""
+        with self._lock:
+            state = self._states.pop(method, None) or {"tally": None, "cursor": None, "last_vote_id": 0}
+            if isinstance(self.store, VoteLog):
+                rankings, reset = self._read_log(state)
+            elif isinstance(self.store, CompactStore):
+                rankings, reset = self._read_records(state)
+            else:
+                rankings, reset = self._read_rows(state)
+            if reset or state["tally"] is None:
+                state["tally"] = StreamingTally(self.candidates, method)
+            while True:
+                chunk = [ranking for _, ranking in zip(range(self.chunk_size), rankings)]
+                if not chunk:
+                    break
+                state["tally"].add_rankings(chunk)
+            # Only kept once fully read: a failed read starts over next time
+            self._states[method] = state
+            return state["tally"].result()
+
+    def reset(self):
+        """Forget every tally; the next tabulation reads the store from the start"""
+        with self._lock:
+            self._states = {}
+
+    def _read_log(self, state):
+        start, end, state["cursor"] = self.store.committed_span(state["cursor"])
+        if start == end:
+            return iter(()), start == 0
+        with open(self.store.votes_path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
+        return ballot_rankings(json.loads(line) for line in data.splitlines()), start == 0
+
+    def _read_records(self, state):
+        start, end, state["cursor"] = self.store.committed_span(state["cursor"])
+        return self._record_rankings(self.store.records(start, end), self.store.candidates()), start == 0
+
+    def _record_rankings(self, records, names):
+        ranked = "ranking" in records.dtype.names
+        for start in range(0, len(records), READ_CHUNK):
+            chunk = records[start:start + READ_CHUNK]
+            rankings = chunk["ranking"].tolist() if ranked else None
+            for i, candidate in enumerate(chunk["candidate"].tolist()):
+                if rankings is not None and rankings[i][0] != NO_CHOICE:
+                    yield [names[index] for index in rankings[i] if index != NO_CHOICE]
+                else:
+                    yield [names[candidate]]
+
+    def _read_rows(self, state):
+        # Ballot numbers restart after a clear
+        reset = self.store.vote_count() < state["last_vote_id"]
+        after = 0 if reset or state["tally"] is None else state["last_vote_id"]
+        state["last_vote_id"] = after
+
+        def rankings():
+            for vote in self.store.votes_after(after):
+                state["last_vote_id"] = vote["vote_id"]
+                yield vote.get("ranking") or [vote["candidate"]]
+        return rankings(), reset
+
+
+def tally(frame, candidates):
+    """Ballots per candidate, in ``candidates`` order"""
+    return frame["candidate"].value_counts().reindex(candidates, fill_value=0)
+
+
+def votes_per_interval(frame, freq="1min"):
+    """Ballots cast in each ``freq`` interval, empty intervals included"""
+    return frame.resample(freq, on="timestamp").size()
+
+
+def turnout_over_time(frame, eligible, freq="1min"):
+    """Cumulative ballots and turnout (% of ``eligible``) at the end of each interval"""
+    cumulative = votes_per_interval(frame, freq).cumsum()
+    return pd.DataFrame({"votes": cumulative, "turnout_pct": cumulative / max(eligible, 1) * 100})
+
+
+def candidate_series(frame, candidates, freq="1min", cumulative=True):
+    """Ballots per candidate per interval, one column per candidate"""
+    counts = (frame.groupby([pd.Grouper(key="timestamp", freq=freq), "candidate"])
+              .size().unstack("candidate", fill_value=0)
+              .reindex(columns=candidates, fill_value=0))
+    if len(counts):
+        counts = counts.resample(freq).sum()
+    return counts.cumsum() if cumulative else counts
+
+
+def participation(frame, eligible):
+    voted = len(frame)
+    return {"voted": voted, "eligible": eligible, "rate": voted / eligible * 100 if eligible else 0.0}
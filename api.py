@@ -0,0 +1,421 @@
+"""Headless HTTP API for kiosks and integrations.
+
+Serves the same voting rules as the Streamlit app through ``core``:
+
+    GET  /api/health
+    GET  /api/elections                            elections hosted here
+    GET  /api/candidates
+    POST /api/login    {"user_id": ...}               eligibility check
+    POST /api/votes    {"user_id": ..., "candidate": ...} or {"user_id": ..., "ranking": [...]}
+    GET  /api/results?method=irv  (header X-Admin-Id: <admin id>)
+    GET  /api/results/stream?admin_id=<admin id>   server-sent tally updates
+    GET  /api/export?dataset=ballots&format=csv     streamed export (admin)
+    GET  /live?admin_id=<admin id>&election=<id>   live results page
+    GET  /metrics                                  Prometheus metrics of this process
+    GET  /api/admin/profiling                      profiler state and report (admin)
+    POST /api/admin/profiling {"mode": "cprofile" | "tracemalloc" | null}   switch it (admin)
+
+Every /api route but health and elections also exists per election, under
+/api/elections/<id>/ (for example POST /api/elections/consejo/votes); the
+plain routes are the default election's.
+
+Run it next to the Streamlit app, from the same data directory:
+
+    python api.py --port 8080
+"""
+import argparse
+import json
+import logging
+import math
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import core
+import export
+import metrics
+from elections import ElectionNotFoundError
+from storage import AlreadyVotedError
+from tabulation import METHODS
+
+MAX_BODY_BYTES = 4096
+# Comment line sent to idle live watchers so proxies keep the stream open
+SSE_HEARTBEAT_SECONDS = 15
+
+LIVE_PAGE = """<!doctype html>
+<html lang="es"><head><meta charset="utf-8"><title>Resultados en vivo</title></head>
+<body style="font-family: sans-serif; max-width: 40rem; margin: 2rem auto;">
+<h1>📊 Resultados en vivo</h1>
+<ul id="results"></ul>
+<p id="total"></p>
+<script>
+const params = new URLSearchParams(location.search);
+const base = params.get("election") ? "/api/elections/" + encodeURIComponent(params.get("election")) : "/api";
+const source = new EventSource(base + "/results/stream?admin_id=" + encodeURIComponent(params.get("admin_id") || ""));
+source.addEventListener("tally", (e) => {
+  const data = JSON.parse(e.data);
+  const list = document.getElementById("results");
+  list.replaceChildren(...Object.entries(data.results).map(([name, votes]) => {
+    const item = document.createElement("li");
+    item.textContent = `${name}: ${votes} votos`;
+    return item;
+  }));
+  document.getElementById("total").textContent = `Total: ${data.total_votes} votos`;
+});
+</script>
+</body></html>
+""".encode("utf-8")
+
+logger = logging.getLogger(__name__)
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+def content_length(headers):
+    """The request's Content-Length (0 when absent), or None when it is not a number of bytes"""
+    value = (headers.get("Content-Length") or "0").strip()
+    return int(value) if value.isascii() and value.isdigit() else None
+
+
+def split_election(path):
+    """``/api/elections/<id>/votes`` -> ``("<id>", "/api/votes")``; other paths are the default election's"""
+    prefix = "/api/elections/"
+    if path.startswith(prefix):
+        election_id, _, rest = path[len(prefix):].partition("/")
+        return election_id, "/api/" + rest
+    return None, path
+
+
+def find_election(election_id):
+    try:
+        return core.get_election(election_id)
+    except ElectionNotFoundError:
+        raise ApiError(404, "Elección no encontrada") from None
+
+
+def handle_elections(election, handler):
+    elections = []
+    for election_id in core.list_elections():
+        try:
+            elections.append(core.get_election(election_id).describe())
+        except ElectionNotFoundError:
+            pass  # archived meanwhile
+    return 200, {"elections": elections}
+
+
+def reject(status, message, reason, stage, election):
+    metrics.REJECTIONS.inc(reason=reason, stage=stage, election=election.id)
+    return ApiError(status, message)
+
+
+def throttle(address, stage, election, cost=1):
+    """Turn an ID check from ``address`` away, before any storage access, while it must wait
+
+    ``cost=0`` only applies the lockout that follows repeated failures.
+    """
+    wait = core.get_login_guard().retry_after(address=address, cost=cost)
+    if wait:
+        metrics.REJECTIONS.inc(reason="rate_limited", stage=stage, election=election.id)
+        raise ApiError(429, "Demasiados intentos", retry_after=math.ceil(wait))
+
+
+def handle_login(election, body, address=None):
+    throttle(address, "login", election)
+    user_id = body.get("user_id")
+    with metrics.timer("login", election=election.id):
+        eligible = user_id in election.valid_users
+        already_voted = eligible and election.has_user_voted(user_id)
+    if not eligible:
+        core.get_login_guard().failed(address=address)
+        raise reject(404, "ID no válido", "invalid_id", "login", election)
+    if already_voted:
+        raise reject(409, "Ya has votado en la segunda vuelta", "already_voted", "login", election)
+    core.get_login_guard().succeeded(address=address)
+    return 200, {"eligible": True, "name": election.valid_users[user_id]}
+
+
+def read_ranking(election, body):
+    """Validate an optional ranked ballot; returns the ranking or None"""
+    ranking = body.get("ranking")
+    if ranking is None:
+        return None
+    if election.method == "plurality":
+        raise reject(400, "Esta elección no admite orden de preferencia", "invalid_ranking", "vote", election)
+    if (not isinstance(ranking, list) or not ranking or len(set(ranking)) != len(ranking)
+            or any(candidate not in election.candidates for candidate in ranking)):
+        raise reject(400, "Orden de preferencia no válido", "invalid_ranking", "vote", election)
+    if body.get("candidate", ranking[0]) != ranking[0]:
+        raise reject(400, "El candidato debe ser la primera preferencia", "invalid_ranking", "vote", election)
+    return ranking
+
+
+def handle_vote(election, body, address=None):
+    throttle(address, "vote", election, cost=0)
+    user_id = body.get("user_id")
+    ranking = read_ranking(election, body)
+    candidate = ranking[0] if ranking else body.get("candidate")
+    if user_id not in election.valid_users:
+        core.get_login_guard().failed(address=address)
+        raise reject(404, "ID no válido", "invalid_id", "vote", election)
+    if candidate not in election.candidates:
+        raise reject(400, "Candidato no válido", "invalid_candidate", "vote", election)
+    try:
+        election.save_vote(user_id, candidate, ranking)
+    except AlreadyVotedError:
+        raise ApiError(409, "Ya has votado en la segunda vuelta") from None
+    except ValueError:
+        # A ballot the store cannot hold (a ranking wider than its records)
+        raise reject(400, "Voto no válido para esta elección", "invalid_ballot", "vote", election) from None
+    return 201, {"status": "recorded"}
+
+
+def require_admin(handler, election):
+    address = handler.client_address[0]
+    throttle(address, "admin", election, cost=0)
+    admin_id = handler.headers.get("X-Admin-Id")
+    if admin_id is None:
+        # EventSource cannot set headers, so live watchers pass it in the query
+        admin_id = parse_qs(urlsplit(handler.path).query).get("admin_id", [None])[0]
+    if election.admin_id is None or admin_id != election.admin_id:
+        core.get_login_guard().failed(address=address)
+        raise ApiError(403, "Sin permisos para ver resultados")
+
+
+def handle_results(election, handler):
+    require_admin(handler, election)
+    results = election.get_results()
+    payload = {"results": results, "total_votes": sum(results.values())}
+    method = parse_qs(urlsplit(handler.path).query).get("method", [None])[0]
+    if method is not None or election.method != "plurality":
+        if method is not None and method not in METHODS:
+            raise ApiError(400, "Método de recuento no válido")
+        payload["tabulation"] = election.tabulate_results(method)
+    chain_head = election.store().chain_head()
+    if chain_head is not None:
+        payload["chain_head"] = chain_head
+    return 200, payload
+
+
+def handle_profiling(election, handler, body=None):
+    """Read the profiler report, or switch it with ``{"mode": ...}``"""
+    require_admin(handler, election)
+    profiler = metrics.REGISTRY.profiler
+    if body is not None:
+        mode = body.get("mode")
+        if mode is None:
+            profiler.disable()
+        elif mode in metrics.PROFILE_MODES:
+            profiler.enable(mode)
+        else:
+            raise ApiError(400, "Modo de perfilado no válido")
+    return 200, {"mode": profiler.mode, "report": profiler.report()}
+
+
+GET_ROUTES = {
+    "/api/health": lambda election, handler: (200, {"status": "ok"}),
+    "/api/elections": handle_elections,
+    "/api/candidates": lambda election, handler: (200, {"candidates": election.candidates,
+                                                        "method": election.method}),
+    "/api/results": handle_results,
+    "/api/admin/profiling": handle_profiling,
+}
+
+POST_ROUTES = {
+    "/api/login": handle_login,
+    "/api/votes": handle_vote,
+}
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so load balancers and kiosks reuse connections
+    server_version = "VotingAPI/1.0"
+    # Headers and body are separate writes; with Nagle on, each response
+    # waits out the client's delayed ACK (~40 ms)
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        election_id, path = split_election(urlsplit(self.path).path)
+        if path == "/api/results/stream":
+            self._stream_results(election_id)
+            return
+        if path == "/api/export":
+            self._stream_export(election_id)
+            return
+        if path == "/live":
+            self._send(200, LIVE_PAGE, "text/html; charset=utf-8")
+            return
+        if path == "/metrics":
+            self._send(200, metrics.REGISTRY.render(), metrics.CONTENT_TYPE)
+            return
+        route = GET_ROUTES.get(path)
+        self._dispatch(lambda: route(find_election(election_id), self) if route else _not_found(),
+                       path if route else "other")
+
+    def do_POST(self):
+        election_id, path = split_election(urlsplit(self.path).path)
+        self._body_read = False
+        if path == "/api/admin/profiling":
+            self._dispatch(lambda: handle_profiling(find_election(election_id), self, self._read_json()), path)
+        else:
+            route = POST_ROUTES.get(path)
+            self._dispatch(lambda: route(find_election(election_id), self._read_json(), self.client_address[0])
+                           if route else _not_found(), path if route else "other")
+        if not self._body_read:
+            # The unread body would be taken for the next request on this connection
+            self.close_connection = True
+
+    def _read_json(self):
+        length = content_length(self.headers)
+        if length is None:
+            raise ApiError(400, "Content-Length no válido")
+        if length > MAX_BODY_BYTES:
+            raise ApiError(413, "Cuerpo demasiado grande")
+        data = self.rfile.read(length)
+        self._body_read = True
+        try:
+            body = json.loads(data or b"{}")
+        except ValueError:
+            raise ApiError(400, "JSON no válido") from None
+        if not isinstance(body, dict):
+            raise ApiError(400, "Se esperaba un objeto JSON")
+        return body
+
+    def _dispatch(self, handle, route):
+        with metrics.timer("http", route=route, method=self.command):
+            error = None
+            try:
+                status, payload = handle()
+            except ApiError as e:
+                error = e
+            except Exception:
+                logger.exception("Unhandled error on %s %s", self.command, self.path)
+                metrics.ERRORS.inc(operation="http", route=route, method=self.command)
+                status, payload = 500, {"error": "Error interno"}
+        if error is not None:
+            self._send_error(error)
+        else:
+            self._send_json(status, payload)
+
+    def _send_error(self, e):
+        headers = {"Retry-After": str(e.retry_after)} if e.retry_after is not None else None
+        self._send_json(e.status, {"error": e.message}, headers)
+
+    def _send_json(self, status, payload, headers=None):
+        self._send(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+                   "application/json; charset=utf-8", headers)
+
+    def _send(self, status, data, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream_results(self, election_id):
+        """Hold the connection open and forward every published tally change"""
+        try:
+            election = find_election(election_id)
+            require_admin(self, election)
+        except ApiError as e:
+            self._send_error(e)
+            return
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        broadcaster = election.broadcaster()
+        version = broadcaster.subscribe()
+        try:
+            while True:
+                version, event = broadcaster.wait(version, timeout=SSE_HEARTBEAT_SECONDS)
+                self.wfile.write(event if event is not None else b": keep-alive\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            broadcaster.unsubscribe()
+
+    def _stream_export(self, election_id):
+        """Send an export with chunked transfer encoding, one chunk at a time"""
+        query = parse_qs(urlsplit(self.path).query)
+        dataset = query.get("dataset", ["ballots"])[0]
+        fmt = query.get("format", ["csv"])[0]
+        try:
+            election = find_election(election_id)
+            require_admin(self, election)
+            if dataset not in export.DATASETS or fmt not in export.FORMATS:
+                raise ApiError(400, "Exportación no válida")
+            chunks = export.export(election.store(), dataset, fmt, candidates=election.candidates)
+        except ApiError as e:
+            self._send_error(e)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", export.MIME_TYPES[fmt])
+        self.send_header("Content-Disposition",
+                         f'attachment; filename="{export.export_filename(dataset, fmt, datetime.now())}"')
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for chunk in chunks:
+                if chunk:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        except Exception:
+            # Too late for an error status; cut the stream so the client sees it incomplete
+            logger.exception("Export failed on %s", self.path)
+            self.close_connection = True
+
+    def log_request(self, code="-", size="-"):
+        # Per-request access logging costs more than the requests themselves
+        pass
+
+
+def _not_found():
+    raise ApiError(404, "Ruta no encontrada")
+
+
+class ApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 resets connections when a load balancer opens many at once
+    request_queue_size = 128
+
+
+def make_server(host="127.0.0.1", port=8080):
+    """Build the API server, opening the store before the first request arrives"""
+    core.get_store()
+    if core.STORAGE_BACKEND != "remote":  # the ledger keeps the voter index
+        core.get_voter_index()
+    core.get_broadcaster()
+    return ApiServer((host, port), ApiHandler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless HTTP API for the runoff vote")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args(argv)
+    server = make_server(args.host, args.port)
+    print(f"Serving the voting API on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
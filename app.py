@@ -1,295 +1,658 @@
 import streamlit as st
 import json
+import math
 import os
+import re
+import uuid
 from datetime import datetime, time
 import pandas as pd
 import pytz
-import time as time_module
-
-# Configuration
-VOTES_FILE = "votes_runoff.json"
-USERS_FILE = "users_runoff.json"
-
-# Valid users with their IDs and names
-VALID_USERS = {
-    "41607985L": "Ricky Ortiz", 
-    "23899839X": "Oscar Boado",
-    "39974093R": "Tillo",
-    "46151901D": "Miguel Ginot",
-    "21773570E": "Pablo Beaus",
-    "46152551S": "Carlos Oteiza",
-    "23929566K": "Ignacio Garcia",
-    "26271508B": "Pablo Corbat"
+import analytics
+import core
+import export
+import metrics
+from elections import DEFAULT_ELECTION, ElectionNotFoundError
+from storage import AlreadyVotedError
+
+# Suspense before the vote confirmation appears; a CSS delay in the browser,
+# so it never holds a server thread
+UI_DELAY_SECONDS = float(os.environ.get("UI_DELAY_SECONDS", "0"))
+
+# Styles for every page, kept as one compact block: full runs send it once and
+# fragment reruns not at all
+APP_CSS = """
+.main-header {
+    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+    padding: 2rem;
+    border-radius: 15px;
+    text-align: center;
+    color: white;
+    margin-bottom: 2rem;
+    box-shadow: 0 10px 25px rgba(0,0,0,0.1);
+    animation: slideInDown 0.8s ease-out;
+}
+
+.runoff-announcement {
+    background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%);
+    padding: 1.5rem;
+    border-radius: 12px;
+    text-align: center;
+    color: white;
+    margin: 1rem 0;
+    box-shadow: 0 8px 20px rgba(245, 87, 108, 0.3);
+    animation: pulse 2s infinite;
 }
 
-# RUNOFF CANDIDATES - Only the two finalists
-RUNOFF_CANDIDATES = [
-    "Gabriel Oliver",
-    "Gonzalo Ros"
-]
+.candidate-card {
+    background: white;
+    padding: 2rem;
+    border-radius: 15px;
+    text-align: center;
+    box-shadow: 0 8px 25px rgba(0,0,0,0.1);
+    margin: 1rem;
+    transition: transform 0.3s ease, box-shadow 0.3s ease;
+    border: 2px solid transparent;
+}
 
-# Admin user who can see results
-ADMIN_ID = "46151901D"  # Miguel Ginot
+.candidate-card:hover {
+    transform: translateY(-5px);
+    box-shadow: 0 15px 35px rgba(0,0,0,0.15);
+}
 
-def load_votes():
-    """Load votes from JSON file"""
-    if os.path.exists(VOTES_FILE):
-        try:
-            with open(VOTES_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
-
-def save_vote(user_id, candidate):
-    """Save a vote to the JSON file"""
+.login-container {
+    background: white;
+    padding: 2rem;
+    border-radius: 15px;
+    box-shadow: 0 10px 25px rgba(0,0,0,0.1);
+    margin: 2rem 0;
+}
+
+.vote-success {
+    background: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%);
+    padding: 2rem;
+    border-radius: 15px;
+    text-align: center;
+    color: white;
+    margin: 2rem 0;
+    box-shadow: 0 10px 25px rgba(79, 172, 254, 0.3);
+    animation: bounceIn 1s ease-out;
+}
+
+@keyframes slideInDown {
+    from { opacity: 0; transform: translateY(-30px); }
+    to { opacity: 1; transform: translateY(0); }
+}
+
+@keyframes pulse {
+    0% { transform: scale(1); }
+    50% { transform: scale(1.02); }
+    100% { transform: scale(1); }
+}
+
+@keyframes bounceIn {
+    0% { opacity: 0; transform: scale(0.3); }
+    50% { opacity: 1; transform: scale(1.05); }
+    70% { transform: scale(0.9); }
+    100% { opacity: 1; transform: scale(1); }
+}
+
+.stButton > button {
+    border-radius: 25px;
+    border: none;
+    padding: 0.5rem 2rem;
+    font-weight: 600;
+    transition: all 0.3s ease;
+}
+
+.stButton > button:hover {
+    transform: translateY(-2px);
+    box-shadow: 0 5px 15px rgba(0,0,0,0.2);
+}
+
+.results-header {
+    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+    padding: 2rem;
+    border-radius: 15px;
+    text-align: center;
+    color: white;
+    margin-bottom: 2rem;
+    box-shadow: 0 10px 25px rgba(0,0,0,0.1);
+}
+.results-card {
+    background: white;
+    padding: 1.5rem;
+    border-radius: 12px;
+    box-shadow: 0 5px 15px rgba(0,0,0,0.08);
+    margin: 1rem 0;
+    border-left: 4px solid #667eea;
+}
+.winner-card {
+    background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%);
+    color: white;
+    text-align: center;
+    padding: 2rem;
+    border-radius: 15px;
+    margin: 2rem 0;
+    box-shadow: 0 10px 25px rgba(245, 87, 108, 0.3);
+}
+"""
+if UI_DELAY_SECONDS > 0:
+    APP_CSS += f".vote-success {{ animation-delay: {UI_DELAY_SECONDS}s; animation-fill-mode: both; }}"
+APP_CSS = "<style>" + re.sub(r"\s+", " ", APP_CSS) + "</style>"
+
+# Largest ballot export prepared in the app; st.download_button keeps it all in memory
+APP_EXPORT_MAX_BALLOTS = int(os.environ.get("APP_EXPORT_MAX_BALLOTS", "100000"))
+
+# Admin results views redraw from the process's live tally (see live) at its rate
+LIVE_REFRESH_SECONDS = 1 / core.LIVE_RESULTS_HZ
+
+METHOD_LABELS = {
+    "plurality": "Mayoría simple",
+    "irv": "Voto preferencial (eliminación por rondas)",
+    "borda": "Recuento Borda",
+}
+# Accent colors for candidate cards, cycled when there are more candidates
+CANDIDATE_COLORS = ["#667eea", "#764ba2"]
+CANDIDATE_TAGLINES = {
+    "Gabriel Oliver": "Experiencia y liderazgo para el futuro",
+    "Gonzalo Ros": "Innovación y cambio organizacional",
+}
+
+def candidate_color(i):
+    return CANDIDATE_COLORS[i % len(CANDIDATE_COLORS)]
+
+def join_names(names):
+    """'A', 'A y B', 'A, B y C'"""
+    names = list(names)
+    return names[0] if len(names) == 1 else f"{', '.join(names[:-1])} y {names[-1]}"
+
+def candidate_columns(count, per_row=3):
+    """Columns for ``count`` candidate cards, wrapping after ``per_row``"""
+    columns = []
+    for start in range(0, count, per_row):
+        columns.extend(st.columns(min(per_row, count - start)))
+    return columns
+
+def current_election():
+    """Election picked with ?eleccion=<id>, the default election otherwise"""
     try:
-        votes = load_votes()
-        
-        # Create anonymous vote entry
-        vote_entry = {
-            "candidate": candidate,
-            "timestamp": datetime.now().isoformat(),
-            "vote_id": len(votes) + 1
-        }
-        
-        # Save vote with anonymous ID
-        votes[f"vote_{len(votes) + 1}"] = vote_entry
-        
-        # Also track which users have voted (separate from votes for anonymity)
-        voted_users = load_voted_users()
-        voted_users.append(user_id)
-        save_voted_users(voted_users)
-        
-        with open(VOTES_FILE, 'w') as f:
-            json.dump(votes, f, indent=2)
-            
-        return True
+        return core.get_election(st.query_params.get("eleccion"))
+    except ElectionNotFoundError:
+        st.error("❌ La elección solicitada no existe.")
+        st.stop()
+
+def save_vote(user_id, candidate, ranking=None):
+    """Save a vote, reporting any failure in the page"""
+    try:
+        return current_election().save_vote(user_id, candidate, ranking)
+    except AlreadyVotedError:
+        st.error("❌ Ya has votado en la segunda vuelta. Solo se permite un voto por persona.")
+        return False
     except Exception as e:
         st.error(f"Error saving vote: {str(e)}")
         return False
 
-def load_voted_users():
-    """Load list of users who have already voted"""
-    if os.path.exists(USERS_FILE):
-        try:
-            with open(USERS_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
-
-def save_voted_users(voted_users):
-    """Save list of users who have voted"""
-    with open(USERS_FILE, 'w') as f:
-        json.dump(voted_users, f, indent=2)
-
-def has_user_voted(user_id):
-    """Check if user has already voted"""
-    voted_users = load_voted_users()
-    return user_id in voted_users
-
 def clear_all_votes():
     """Clear all votes and reset the system (Admin only)"""
     try:
-        files_deleted = []
-        if os.path.exists(VOTES_FILE):
-            os.remove(VOTES_FILE)
-            files_deleted.append("votes_runoff.json")
-        if os.path.exists(USERS_FILE):
-            os.remove(USERS_FILE)
-            files_deleted.append("users_runoff.json")
-        
-        return len(files_deleted) > 0
+        return current_election().clear_all_votes()
     except Exception as e:
         st.error(f"Error deleting files: {str(e)}")
         return False
 
-def get_results():
-    """Get voting results"""
-    votes = load_votes()
-    results = {candidate: 0 for candidate in RUNOFF_CANDIDATES}
-    
-    for vote in votes.values():
-        candidate = vote.get("candidate")
-        if candidate in results:
-            results[candidate] += 1
-    
-    return results
+def client_keys():
+    """Rate-limit keys of this browser session and of its address (None when local)"""
+    if 'limiter_key' not in st.session_state:
+        st.session_state.limiter_key = uuid.uuid4().hex
+    address = getattr(st.context, "ip_address", None)
+    return st.session_state.limiter_key, address if isinstance(address, str) else None
 
-def show_results_page():
-    """Show the results page (separated for reuse)"""
-    # Custom CSS for results page
-    st.markdown("""
-    <style>
-    .results-header {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        padding: 2rem;
-        border-radius: 15px;
-        text-align: center;
-        color: white;
-        margin-bottom: 2rem;
-        box-shadow: 0 10px 25px rgba(0,0,0,0.1);
-    }
-    .results-card {
-        background: white;
-        padding: 1.5rem;
-        border-radius: 12px;
-        box-shadow: 0 5px 15px rgba(0,0,0,0.08);
-        margin: 1rem 0;
-        border-left: 4px solid #667eea;
-    }
-    .winner-card {
-        background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%);
-        color: white;
-        text-align: center;
-        padding: 2rem;
-        border-radius: 15px;
-        margin: 2rem 0;
-        box-shadow: 0 10px 25px rgba(245, 87, 108, 0.3);
-    }
-    </style>
-    """, unsafe_allow_html=True)
-    
-    st.markdown("""
-    <div class="results-header">
-        <h1>🔐 Panel de Administración</h1>
-        <h3>Segunda Vuelta Electoral</h3>
-    </div>
-    """, unsafe_allow_html=True)
-    
+def login_throttled(stage, election):
+    """Turn the ID check away, before any storage access, when this client must wait"""
+    wait = core.get_login_guard().retry_after(*client_keys())
+    if wait:
+        metrics.REJECTIONS.inc(reason="rate_limited", stage=stage, election=election.id)
+        st.error(f"⏳ Demasiados intentos. Espere {math.ceil(wait)} s antes de volver a intentarlo.")
+    return wait > 0
+
+def flash(kind, message):
+    """Queue a message (st.success, st.info, ...) to show after st.rerun()"""
+    st.session_state.flash = (kind, message)
+
+def show_flash():
+    """Show and clear the message queued by flash()"""
+    if st.session_state.get('flash'):
+        kind, message = st.session_state.pop('flash')
+        getattr(st, kind)(message)
+
+@st.fragment
+def login_box(election):
+    """Voter ID check; a rejected ID reruns only this box"""
+    user_id = st.text_input("🆔 ID de Usuario:", placeholder="Ej: 43483736M", key="user_login")
+
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col2:
+        if (st.button("🚀 INGRESAR AL SISTEMA", type="primary", use_container_width=True)
+                and not login_throttled("login", election)):
+            with metrics.timer("login", election=election.id):
+                eligible = user_id in election.valid_users
+                already_voted = eligible and election.has_user_voted(user_id)
+            if not eligible:
+                core.get_login_guard().failed(*client_keys())
+                metrics.REJECTIONS.inc(reason="invalid_id", stage="login", election=election.id)
+                st.error("❌ ID no válido. Por favor, verifique su ID.")
+            elif already_voted:
+                metrics.REJECTIONS.inc(reason="already_voted", stage="login", election=election.id)
+                st.error("❌ Ya has votado en la segunda vuelta. Solo se permite un voto por persona.")
+            else:
+                core.get_login_guard().succeeded(*client_keys())
+                st.session_state.authenticated = True
+                st.session_state.user_id = user_id
+                st.session_state.user_name = election.valid_users[user_id]
+                flash("success", f"✅ Bienvenido/a, {st.session_state.user_name}")
+                st.rerun()
+
+@st.fragment
+def voting_form(election):
+    """Ballot form; a rejected ballot reruns only the form"""
+    st.markdown("### 🗳️ Emite tu Voto")
+
+    with st.form("runoff_voting_form"):
+        if election.method != "plurality":
+            ranking = st.multiselect(
+                "**Ordena a los candidatos por preferencia:**",
+                election.candidates,
+                help="El orden en que los eliges es tu orden de preferencia"
+            )
+            selected_candidate = ranking[0] if ranking else None
+        else:
+            ranking = None
+            selected_candidate = st.radio(
+                "**Selecciona tu candidato para Presidente:**",
+                election.candidates,
+                index=None,
+                help="Elige cuidadosamente - esta es la votación definitiva"
+            )
+
+        st.markdown("---")
+
+        col1, col2, col3 = st.columns([1, 2, 1])
+
+        with col1:
+            logout_button = st.form_submit_button("🚪 Salir", type="secondary")
+
+        with col2:
+            vote_button = st.form_submit_button("✅ CONFIRMAR VOTO", type="primary", use_container_width=True)
+
+        with col3:
+            pass  # Empty column for spacing
+
+    if vote_button:
+        if selected_candidate:
+            with st.spinner("Procesando tu voto..."):
+                if save_vote(st.session_state.user_id, selected_candidate, ranking):
+                    st.session_state.vote_submitted = True
+                    st.session_state.voted_candidate = " › ".join(ranking) if ranking else selected_candidate
+                    st.rerun()
+                else:
+                    st.error("❌ Error al guardar el voto. Inténtelo de nuevo.")
+        else:
+            st.error("❌ Por favor, selecciona un candidato antes de votar.")
+
+    if logout_button:
+        st.session_state.authenticated = False
+        st.session_state.user_id = None
+        st.session_state.user_name = None
+        st.rerun()
+
+@st.fragment
+def admin_login_box(election):
+    """Admin ID check; a click reruns only this box until the login succeeds"""
     admin_id = st.text_input("🆔 Ingrese su ID para ver los resultados:", key="admin_login")
-    
-    if st.button("🚀 Acceder a Resultados", type="primary"):
-        if admin_id == ADMIN_ID:
+
+    if st.button("🚀 Acceder a Resultados", type="primary") and not login_throttled("admin", election):
+        if election.admin_id is not None and admin_id == election.admin_id:
+            core.get_login_guard().succeeded(*client_keys())
             st.session_state.admin_logged_in = True
             st.rerun()
         else:
+            core.get_login_guard().failed(*client_keys())
             st.error("❌ ID no válido o sin permisos para ver resultados.")
-    
-    # Only show results if admin is logged in
-    if st.session_state.get('admin_logged_in', False):
-        st.success(f"✅ Bienvenido, {VALID_USERS[ADMIN_ID]}")
-        
-        # Show results
-        st.markdown("## 📊 Resultados de la Segunda Vuelta")
-        
-        results = get_results()
-        total_votes = sum(results.values())
-        
-        if total_votes > 0:
-            # Create two columns for candidate results
-            col1, col2 = st.columns(2)
-            
-            gabriel_votes = results.get("Gabriel Oliver", 0)
-            gonzalo_votes = results.get("Gonzalo Ros", 0)
-            
-            with col1:
-                gabriel_pct = (gabriel_votes/total_votes)*100 if total_votes > 0 else 0
-                st.markdown(f"""
-                <div class="results-card">
-                    <h3>🏛️ Gabriel Oliver</h3>
-                    <h2 style="color: #667eea;">{gabriel_votes} votos</h2>
-                    <h4>{gabriel_pct:.1f}%</h4>
-                </div>
-                """, unsafe_allow_html=True)
-            
-            with col2:
-                gonzalo_pct = (gonzalo_votes/total_votes)*100 if total_votes > 0 else 0
-                st.markdown(f"""
-                <div class="results-card">
-                    <h3>🏛️ Gonzalo Ros</h3>
-                    <h2 style="color: #764ba2;">{gonzalo_votes} votos</h2>
-                    <h4>{gonzalo_pct:.1f}%</h4>
-                </div>
-                """, unsafe_allow_html=True)
-            
-            # Progress bars
-            st.markdown("### 📈 Progreso de Votación")
-            gabriel_progress = gabriel_votes / max(total_votes, 1)
-            gonzalo_progress = gonzalo_votes / max(total_votes, 1)
-            
-            st.write("**Gabriel Oliver**")
-            st.progress(gabriel_progress)
-            st.write(f"{gabriel_pct:.1f}% ({gabriel_votes} votos)")
-            
-            st.write("**Gonzalo Ros**")
-            st.progress(gonzalo_progress)
-            st.write(f"{gonzalo_pct:.1f}% ({gonzalo_votes} votos)")
-            
-            # Total votes metric
-            st.metric("📊 Total de Votos Emitidos", total_votes)
-            
-            # Show winner or tie
-            if gabriel_votes > gonzalo_votes:
-                st.markdown(f"""
-                <div class="winner-card">
-                    <h1>🏆 GANADOR</h1>
-                    <h2>Gabriel Oliver</h2>
-                    <h3>{gabriel_votes} votos ({gabriel_pct:.1f}%)</h3>
-                    <p>¡Felicidades al nuevo Presidente!</p>
-                </div>
-                """, unsafe_allow_html=True)
-                st.balloons()
-            elif gonzalo_votes > gabriel_votes:
+
+def live_results(election):
+    """The latest tally from the election's broadcaster, and what this session
+    derived from it (tabulation, turnout frame), recomputed only when it changes"""
+    broadcaster = election.broadcaster()
+    version, results = broadcaster.latest()
+    view = st.session_state.get("live_results")
+    if view is None or view["broadcaster"] is not broadcaster or view["version"] != version:
+        view = st.session_state.live_results = {"broadcaster": broadcaster, "version": version}
+    return results, view
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def results_panel(election):
+    """Tally, winner and turnout charts, redrawn on their own as the live tally changes"""
+    st.markdown("## 📊 Resultados de la Segunda Vuelta")
+
+    results, view = live_results(election)
+    total_votes = sum(results.values())
+
+    if total_votes > 0:
+        # One card per candidate
+        for i, (column, (candidate, votes)) in enumerate(zip(candidate_columns(len(results)), results.items())):
+            with column:
                 st.markdown(f"""
-                <div class="winner-card">
-                    <h1>🏆 GANADOR</h1>
-                    <h2>Gonzalo Ros</h2>
-                    <h3>{gonzalo_votes} votos ({gonzalo_pct:.1f}%)</h3>
-                    <p>¡Felicidades al nuevo Presidente!</p>
+                <div class="results-card" style="border-left-color: {candidate_color(i)};">
+                    <h3>🏛️ {candidate}</h3>
+                    <h2 style="color: {candidate_color(i)};">{votes} votos</h2>
+                    <h4>{votes / total_votes * 100:.1f}%</h4>
                 </div>
                 """, unsafe_allow_html=True)
+
+        # Progress bars
+        st.markdown("### 📈 Progreso de Votación")
+        for candidate, votes in results.items():
+            st.write(f"**{candidate}**")
+            st.progress(votes / total_votes)
+            st.write(f"{votes / total_votes * 100:.1f}% ({votes} votos)")
+
+        # Total votes metric
+        st.metric("📊 Total de Votos Emitidos", total_votes)
+
+        # Winner: the plurality leader, or the ranked tabulation's winner
+        st.caption(f"Método de recuento: {METHOD_LABELS[election.method]}")
+        if election.method != "plurality":
+            if "tabulation" not in view:
+                view["tabulation"] = election.tabulate_results()
+            tabulation = view["tabulation"]
+            final_counts = tabulation["counts"]
+            unit = "puntos" if election.method == "borda" else "votos"
+            rounds = pd.DataFrame([r["counts"] for r in tabulation["rounds"]],
+                                  columns=election.candidates).fillna(0).astype(int)
+            rounds.index = [f"Ronda {i}" for i in range(1, len(rounds) + 1)]
+            if election.method == "irv":
+                rounds["Eliminado"] = [r["eliminated"] or "—" for r in tabulation["rounds"]]
+            st.dataframe(rounds)
+            winner = tabulation["winner"]
+        else:
+            final_counts = results
+            unit = "votos"
+            leaders = [c for c, v in results.items() if v == max(results.values())]
+            winner = leaders[0] if len(leaders) == 1 else None
+
+        if winner:
+            winner_pct = final_counts[winner] / max(sum(final_counts.values()), 1) * 100
+            st.markdown(f"""
+            <div class="winner-card">
+                <h1>🏆 GANADOR</h1>
+                <h2>{winner}</h2>
+                <h3>{final_counts[winner]} {unit} ({winner_pct:.1f}%)</h3>
+                <p>¡Felicidades al nuevo Presidente!</p>
+            </div>
+            """, unsafe_allow_html=True)
+            if st.session_state.get("celebrated") != (election.id, winner):
+                st.session_state.celebrated = (election.id, winner)
                 st.balloons()
-            else:
-                st.warning("🤝 **EMPATE** - Se requiere más votación para decidir el ganador")
-            
-            # Voting participation
-            total_eligible = len(VALID_USERS)
-            participation_rate = (total_votes / total_eligible) * 100
-            st.metric("📊 Participación Electoral", f"{participation_rate:.1f}%", f"{total_votes}/{total_eligible} votantes")
-            
         else:
-            st.info("📭 No hay votos registrados en la segunda vuelta aún.")
-        
-        # Admin controls
-        st.markdown("---")
-        st.markdown("## 🛠️ Controles de Administración")
-        
+            st.warning("🤝 **EMPATE** - Se requiere más votación para decidir el ganador")
+
+        # Voting participation
+        total_eligible = len(election.valid_users)
+        participation_rate = (total_votes / total_eligible) * 100
+        st.metric("📊 Participación Electoral", f"{participation_rate:.1f}%", f"{total_votes}/{total_eligible} votantes")
+
+        # Voting activity over time
+        st.markdown("### ⏱️ Evolución de la Votación")
+        if "ballots" not in view:
+            view["ballots"] = election.analytics().refresh()
+        ballots = view["ballots"]
+        turnout = analytics.turnout_over_time(ballots, total_eligible)
         col1, col2 = st.columns(2)
-        
         with col1:
-            if not st.session_state.get('confirm_delete', False):
-                if st.button("🗑️ Resetear Segunda Vuelta", type="secondary"):
-                    st.session_state.confirm_delete = True
-                    st.rerun()
+            st.write("**Participación acumulada (%)**")
+            st.line_chart(turnout["turnout_pct"].rename("Participación (%)"))
+        with col2:
+            st.write("**Votos por minuto**")
+            st.bar_chart(analytics.votes_per_interval(ballots).rename("Votos"))
+        st.write("**Votos acumulados por candidato**")
+        st.line_chart(analytics.candidate_series(ballots, election.candidates))
+
+    else:
+        st.info("📭 No hay votos registrados en la segunda vuelta aún.")
+
+@st.fragment
+def audit_panel(election):
+    """Tally and hash-chain audits"""
+    # Tally audit
+    st.markdown("---")
+    st.markdown("## 🔍 Auditoría del Recuento")
+    if election.startup_audit():
+        st.warning("⚠️ Al arrancar, el recuento almacenado no coincidía con los votos registrados.")
+
+    if st.button("🔍 Auditar Recuento"):
+        st.session_state.tally_audit = election.store().verify_tally()
+
+    if 'tally_audit' in st.session_state:
+        mismatches = st.session_state.tally_audit
+        if mismatches:
+            st.error("❌ El recuento almacenado no coincide con los votos registrados.")
+            st.table(pd.DataFrame.from_dict(mismatches, orient="index").rename(
+                columns={"stored": "Almacenado", "recount": "Recuento"}))
+            if st.button("🛠️ Reconstruir Recuento"):
+                election.store().repair_tally()
+                del st.session_state.tally_audit
+                st.rerun()
+        else:
+            st.success("✅ El recuento almacenado coincide con los votos registrados.")
+
+    # Hash chain over the ballot log (append-only log backend only)
+    if election.store().chain_head() is not None:
+        if st.button("🔗 Verificar Cadena"):
+            with st.spinner("Verificando la cadena de votos..."):
+                st.session_state.chain_audit = election.store().verify_chain()
+
+        if 'chain_audit' in st.session_state:
+            report = st.session_state.chain_audit
+            if report["ok"]:
+                st.success(f"✅ La cadena de {report['records']} votos está intacta "
+                           f"({report['segments']} segmentos verificados).")
+            else:
+                st.error("❌ La cadena de votos no coincide: el registro fue alterado.")
+                st.table(pd.DataFrame(report["problems"]).rename(
+                    columns={"vote": "Voto", "segment": "Segmento", "problem": "Problema"}))
+        st.caption(f"Huella del registro (publíquela para que pueda auditarse): `{election.store().chain_head()}`")
+
+    cache_stats = election.read_cache().stats()
+    st.caption(f"Caché de lectura: {cache_stats['hits']} aciertos, {cache_stats['misses']} fallos")
+
+@st.fragment
+def performance_panel():
+    """Operation timings and the profiler switch"""
+    # Timings of this app process
+    st.markdown("---")
+    st.markdown("## 📈 Rendimiento")
+    timings = metrics.OPERATION_SECONDS.summary()
+    if timings:
+        st.dataframe(pd.DataFrame([
+            {"Operación": labels["operation"], "Elección": labels.get("election", "—"), "Llamadas": count,
+             "Media (ms)": mean * 1000, "p50 (ms)": p50 * 1000, "p95 (ms)": p95 * 1000, "p99 (ms)": p99 * 1000}
+            for labels, count, mean, p50, p95, p99 in timings
+        ]).round(2), hide_index=True)
+    st.download_button("📥 Descargar Métricas (Prometheus)", data=metrics.REGISTRY.render(),
+                       file_name="metrics.txt", mime="text/plain")
+    st.caption("Percentiles estimados a partir de histogramas; la API los publica en `/metrics`"
+               + (f" y esta aplicación en el puerto {core.METRICS_PORT}." if core.METRICS_PORT else "."))
+
+    profiler = metrics.REGISTRY.profiler
+    profile_modes = {"Desactivado": None, "cProfile (tiempo por función)": "cprofile",
+                     "tracemalloc (memoria por línea)": "tracemalloc"}
+    labels = list(profile_modes)
+    chosen = st.selectbox("🧪 Perfilado de operaciones", labels,
+                          index=list(profile_modes.values()).index(profiler.mode))
+    if profile_modes[chosen] != profiler.mode:
+        if profile_modes[chosen] is None:
+            profiler.disable()
+        else:
+            profiler.enable(profile_modes[chosen])
+    if profiler.mode:
+        st.code(profiler.report(), language=None)
+
+SNAPSHOT_REASONS = {"manual": "Manual", "reset": "Reseteo", "restore": "Antes de restaurar"}
+
+def snapshot_title(name):
+    """Readable title from a snapshot's name alone, without reading its metadata"""
+    stamp, _, reason = name.partition("-")
+    try:
+        taken_at = datetime.strptime(stamp, "%Y%m%d%H%M%S%f").strftime("%d/%m/%Y %H:%M:%S")
+    except ValueError:
+        taken_at = stamp
+    return f"📸 {taken_at} · {SNAPSHOT_REASONS.get(reason, reason)}"
+
+@st.fragment
+def history_panel(election):
+    """Snapshots and closed rounds; only the one picked for comparison is read"""
+    st.markdown("---")
+    st.markdown("## 🗂️ Instantáneas y Rondas Anteriores")
+
+    label = st.text_input("Descripción de la instantánea (opcional)", key="snapshot_label")
+    if st.button("📸 Crear Instantánea"):
+        try:
+            snapshot = election.take_snapshot(label)
+        except ValueError as e:
+            st.error(f"❌ No se pudo crear la instantánea: {e}")
+        else:
+            st.success(f"✅ Instantánea guardada con {snapshot.meta['ballots']} votos.")
+
+    rounds = {f"🏁 Ronda {closed['round']} (cerrada)": closed for closed in election.config.get("rounds", [])}
+    snapshots = {snapshot_title(snapshot.name): snapshot for snapshot in election.snapshots()}
+    if not rounds and not snapshots:
+        st.info("📭 Aún no hay instantáneas ni rondas cerradas.")
+        return
+    choice = st.selectbox("Comparar con la ronda actual", list(snapshots) + list(rounds))
+    snapshot = snapshots.get(choice)
+    archived = snapshot.meta if snapshot is not None else rounds[choice]
+    if archived.get("label"):
+        st.caption(f"📝 {archived['label']}")
+    current = election.get_results()
+    candidates = list(dict.fromkeys(list(current) + list(archived["candidates"])))
+    st.dataframe(pd.DataFrame({
+        "Actual": [current.get(name, 0) for name in candidates],
+        choice: [archived["results"].get(name, 0) for name in candidates],
+    }, index=candidates))
+
+    if snapshot is not None and archived["round"] == election.round and "ledger" not in archived:
+        if st.button("↩️ Restaurar esta Instantánea"):
+            try:
+                retired = election.restore_snapshot(snapshot.name)
+            except Exception as e:
+                st.error(f"❌ Error al restaurar: {str(e)}")
             else:
-                st.error("⚠️ ¿Confirma resetear TODOS los votos de la segunda vuelta?")
-                if st.button("✅ SÍ, RESETEAR", type="primary"):
-                    if clear_all_votes():
-                        st.session_state.confirm_delete = False
-                        st.success("🗑️ Segunda vuelta reseteada.")
-                        st.rerun()
-                    else:
-                        st.error("Error al resetear.")
-                if st.button("❌ Cancelar"):
+                replaced = retired.meta["ballots"]
+                flash("success", "↩️ Instantánea restaurada." + (
+                    f" Los {replaced} votos que reemplazó quedaron en otra instantánea." if replaced else ""))
+                st.rerun()
+
+@st.fragment
+def admin_controls(election):
+    """Reset and export"""
+    # Admin controls
+    st.markdown("---")
+    st.markdown("## 🛠️ Controles de Administración")
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        if not st.session_state.get('confirm_delete', False):
+            # Callbacks run before the rerun, so the next run already shows the new step
+            st.button("🗑️ Resetear Segunda Vuelta", type="secondary",
+                      on_click=lambda: st.session_state.update(confirm_delete=True))
+        else:
+            st.error("⚠️ ¿Confirma resetear TODOS los votos de la segunda vuelta? "
+                     "Se guardarán en una instantánea que podrá restaurar.")
+            if st.button("✅ SÍ, RESETEAR", type="primary"):
+                if clear_all_votes():
                     st.session_state.confirm_delete = False
+                    flash("success", "🗑️ Segunda vuelta reseteada. Los votos quedaron en una instantánea.")
                     st.rerun()
-        
-        with col2:
-            if st.button("📤 Exportar Resultados"):
-                results_data = {
-                    "timestamp": datetime.now().isoformat(),
-                    "total_votes": total_votes,
-                    "results": results,
-                    "participation_rate": f"{participation_rate:.1f}%"
-                }
+                else:
+                    st.error("Error al resetear.")
+            st.button("❌ Cancelar", on_click=lambda: st.session_state.update(confirm_delete=False))
+
+    with col2:
+        if st.button("📤 Exportar Resultados"):
+            results = election.get_results()
+            total_votes = sum(results.values())
+            participation_rate = total_votes / max(len(election.valid_users), 1) * 100
+            results_data = {
+                "timestamp": datetime.now().isoformat(),
+                "total_votes": total_votes,
+                "results": results,
+                "method": election.method,
+                "participation_rate": f"{participation_rate:.1f}%"
+            }
+            st.download_button(
+                label="💾 Descargar Resultados JSON",
+                data=json.dumps(results_data, indent=2, ensure_ascii=False),
+                file_name=f"resultados_segunda_vuelta_{datetime.now().strftime('%Y%m%d_%H%M')}.json",
+                mime="application/json"
+            )
+
+        # Anonymous ballots or tally for auditing
+        dataset = st.radio("📦 Datos a exportar", export.DATASETS,
+                           format_func={"ballots": "Votos anónimos", "tally": "Recuento"}.get,
+                           horizontal=True)
+        fmt = st.selectbox("Formato", export.FORMATS)
+        ballots = election.store().vote_count()
+        if dataset == "ballots" and ballots > APP_EXPORT_MAX_BALLOTS:
+            # The download button holds the whole file in server memory
+            st.info(f"📦 Con {ballots} votos la exportación no se prepara aquí: use `python export.py` "
+                    f"o `/api/export`, que la transmiten por partes.")
+        elif st.button("📦 Preparar Exportación"):
+            try:
+                data = b"".join(export.export(election.store(), dataset, fmt, candidates=election.candidates))
+            except Exception as e:
+                st.error(f"Error al exportar: {str(e)}")
+            else:
                 st.download_button(
-                    label="💾 Descargar Resultados JSON",
-                    data=json.dumps(results_data, indent=2),
-                    file_name=f"resultados_segunda_vuelta_{datetime.now().strftime('%Y%m%d_%H%M')}.json",
-                    mime="application/json"
+                    label=f"💾 Descargar {fmt.upper()}",
+                    data=data,
+                    file_name=export.export_filename(dataset, fmt, datetime.now()),
+                    mime=export.MIME_TYPES[fmt]
                 )
+        st.caption("Para elecciones grandes, `python export.py` o `/api/export` transmiten la exportación por partes.")
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def quick_results(election):
+    """Sidebar tally for the admin, redrawn as the live tally changes"""
+    st.markdown("### 📊 Vista Rápida")
+    results, _ = live_results(election)
+    total = sum(results.values())
+    if total > 0:
+        for candidate, votes in results.items():
+            pct = (votes/total)*100
+            st.metric(candidate, f"{votes} votos", f"{pct:.1f}%")
+
+def show_results_page():
+    """Show the results page (separated for reuse)"""
+    election = current_election()
+    
+    st.markdown("""
+    <div class="results-header">
+        <h1>🔐 Panel de Administración</h1>
+        <h3>Segunda Vuelta Electoral</h3>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    admin_login_box(election)
+    
+    # Only show results if admin is logged in; each section reruns on its own
+    if st.session_state.get('admin_logged_in', False):
+        st.success(f"✅ Bienvenido, {election.valid_users.get(election.admin_id, election.admin_id)}")
+        results_panel(election)
+        audit_panel(election)
+        performance_panel()
+        history_panel(election)
+        admin_controls(election)
     
     if st.button("🔙 Volver al Sistema de Votación"):
         st.session_state.show_results = False
@@ -304,107 +667,12 @@ def main():
         layout="wide",
         initial_sidebar_state="expanded"
     )
+    election = current_election()
+    election.startup_audit()
+    core.get_metrics_server()
     
-    # Custom CSS for outstanding design
-    st.markdown("""
-    <style>
-    .main-header {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        padding: 2rem;
-        border-radius: 15px;
-        text-align: center;
-        color: white;
-        margin-bottom: 2rem;
-        box-shadow: 0 10px 25px rgba(0,0,0,0.1);
-        animation: slideInDown 0.8s ease-out;
-    }
-    
-    .runoff-announcement {
-        background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%);
-        padding: 1.5rem;
-        border-radius: 12px;
-        text-align: center;
-        color: white;
-        margin: 1rem 0;
-        box-shadow: 0 8px 20px rgba(245, 87, 108, 0.3);
-        animation: pulse 2s infinite;
-    }
-    
-    .candidate-card {
-        background: white;
-        padding: 2rem;
-        border-radius: 15px;
-        text-align: center;
-        box-shadow: 0 8px 25px rgba(0,0,0,0.1);
-        margin: 1rem;
-        transition: transform 0.3s ease, box-shadow 0.3s ease;
-        border: 2px solid transparent;
-    }
-    
-    .candidate-card:hover {
-        transform: translateY(-5px);
-        box-shadow: 0 15px 35px rgba(0,0,0,0.15);
-    }
-    
-    .gabriel-card {
-        border-left: 5px solid #667eea;
-    }
-    
-    .gonzalo-card {
-        border-left: 5px solid #764ba2;
-    }
-    
-    .login-container {
-        background: white;
-        padding: 2rem;
-        border-radius: 15px;
-        box-shadow: 0 10px 25px rgba(0,0,0,0.1);
-        margin: 2rem 0;
-    }
-    
-    .vote-success {
-        background: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%);
-        padding: 2rem;
-        border-radius: 15px;
-        text-align: center;
-        color: white;
-        margin: 2rem 0;
-        box-shadow: 0 10px 25px rgba(79, 172, 254, 0.3);
-        animation: bounceIn 1s ease-out;
-    }
+    st.markdown(APP_CSS, unsafe_allow_html=True)
     
-    @keyframes slideInDown {
-        from { opacity: 0; transform: translateY(-30px); }
-        to { opacity: 1; transform: translateY(0); }
-    }
-    
-    @keyframes pulse {
-        0% { transform: scale(1); }
-        50% { transform: scale(1.02); }
-        100% { transform: scale(1); }
-    }
-    
-    @keyframes bounceIn {
-        0% { opacity: 0; transform: scale(0.3); }
-        50% { opacity: 1; transform: scale(1.05); }
-        70% { transform: scale(0.9); }
-        100% { opacity: 1; transform: scale(1); }
-    }
-    
-    .stButton > button {
-        border-radius: 25px;
-        border: none;
-        padding: 0.5rem 2rem;
-        font-weight: 600;
-        transition: all 0.3s ease;
-    }
-    
-    .stButton > button:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 5px 15px rgba(0,0,0,0.2);
-    }
-    </style>
-    """, unsafe_allow_html=True)
     
     # Initialize session state
     if 'authenticated' not in st.session_state:
@@ -423,54 +691,65 @@ def main():
         st.session_state.vote_submitted = False
     if 'voted_candidate' not in st.session_state:
         st.session_state.voted_candidate = None
+    # Logins and confirmations belong to one election; start over when it changes
+    if st.session_state.get('election_id') != election.id:
+        st.session_state.election_id = election.id
+        for key in ('authenticated', 'admin_logged_in', 'vote_submitted', 'confirm_delete'):
+            st.session_state[key] = False
+        st.session_state.user_id = st.session_state.user_name = st.session_state.voted_candidate = None
 
     # Header
-    st.markdown("""
+    subtitle = "Elección Definitiva de Presidente" if election.id == DEFAULT_ELECTION else election.title
+    st.markdown(f"""
     <div class="main-header">
         <h1>🗳️ SEGUNDA VUELTA ELECTORAL</h1>
-        <h2>Elección Definitiva de Presidente</h2>
+        <h2>{subtitle}</h2>
         <h3>Soluciones Digitales Oliver</h3>
         <p>La decisión final está en tus manos</p>
     </div>
     """, unsafe_allow_html=True)
     
     # Runoff announcement
-    st.markdown("""
+    st.markdown(f"""
     <div class="runoff-announcement">
         <h2>🔥 ¡SEGUNDA VUELTA!</h2>
-        <p>Tras un empate histórico, los dos candidatos finalistas compiten por la presidencia</p>
-        <h3>Gabriel Oliver 🆚 Gonzalo Ros</h3>
+        <p>Tras un empate histórico, los {len(election.candidates)} candidatos finalistas compiten por la presidencia</p>
+        <h3>{" 🆚 ".join(election.candidates)}</h3>
     </div>
     """, unsafe_allow_html=True)
 
     # Sidebar info
     with st.sidebar:
         st.markdown("## 📋 Información de la Segunda Vuelta")
-        st.info("""
-        **🎯 Solo quedan 2 candidatos:**
-        - Gabriel Oliver
-        - Gonzalo Ros
-        
-        **📊 Primera vuelta:** Empate
-        **🗳️ Ahora:** Votación decisiva
-        **🏆 Ganador:** Mayoría simple
-        """)
+        candidate_lines = "\n".join(f"- {candidate}" for candidate in election.candidates)
+        st.info(f"""
+**🎯 Solo quedan {len(election.candidates)} candidatos:**
+{candidate_lines}
+
+**📊 Primera vuelta:** Empate
+**🗳️ Ahora:** Votación decisiva
+**🏆 Ganador:** {METHOD_LABELS[election.method]}
+""")
         
         # Live results preview (if admin)
         if st.session_state.get('admin_logged_in'):
-            st.markdown("### 📊 Vista Rápida")
-            results = get_results()
-            total = sum(results.values())
-            if total > 0:
-                for candidate, votes in results.items():
-                    pct = (votes/total)*100
-                    st.metric(candidate, f"{votes} votos", f"{pct:.1f}%")
+            quick_results(election)
         
+        # Other elections hosted by this deployment
+        election_ids = core.list_elections()
+        if len(election_ids) > 1:
+            chosen = st.selectbox("🗳️ Elección", election_ids, index=election_ids.index(election.id))
+            if chosen != election.id:
+                st.query_params["eleccion"] = chosen
+                st.rerun()
+
         # Admin access
         if st.button("🔐 Panel Admin"):
             st.session_state.show_results = True
             st.session_state.authenticated = False
 
+    show_flash()
+
     # Results page (Admin only)
     if st.session_state.show_results:
         show_results_page()
@@ -485,26 +764,12 @@ def main():
         </div>
         """, unsafe_allow_html=True)
         
-        user_id = st.text_input("🆔 ID de Usuario:", placeholder="Ej: 43483736M", key="user_login")
-        
-        col1, col2, col3 = st.columns([1, 2, 1])
-        with col2:
-            if st.button("🚀 INGRESAR AL SISTEMA", type="primary", use_container_width=True):
-                if user_id in VALID_USERS:
-                    if has_user_voted(user_id):
-                        st.error("❌ Ya has votado en la segunda vuelta. Solo se permite un voto por persona.")
-                    else:
-                        st.session_state.authenticated = True
-                        st.session_state.user_id = user_id
-                        st.session_state.user_name = VALID_USERS[user_id]
-                        st.success(f"✅ Bienvenido/a, {VALID_USERS[user_id]}")
-                        time_module.sleep(1)
-                        st.rerun()
-                else:
-                    st.error("❌ ID no válido. Por favor, verifique su ID.")
+        login_box(election)
         
         st.markdown("---")
-        st.info("💡 **Instrucciones de la Segunda Vuelta:**\n- Solo Gabriel Oliver y Gonzalo Ros están en competencia\n- Debes elegir uno de los dos candidatos\n- Tu voto es completamente anónimo\n- Solo puedes votar una vez")
+        how_to_vote = ("Ordena a los candidatos de más a menos preferido" if election.method != "plurality"
+                       else "Debes elegir uno de los candidatos")
+        st.info(f"💡 **Instrucciones de la Segunda Vuelta:**\n- Solo {join_names(election.candidates)} están en competencia\n- {how_to_vote}\n- Tu voto es completamente anónimo\n- Solo puedes votar una vez")
         
     # Voting page
     else:
@@ -530,8 +795,7 @@ def main():
                     st.session_state.user_name = None
                     st.session_state.vote_submitted = False
                     st.session_state.voted_candidate = None
-                    st.success("✅ Sesión cerrada exitosamente.")
-                    time_module.sleep(1)
+                    flash("success", "✅ Sesión cerrada exitosamente.")
                     st.rerun()
             return
         
@@ -547,69 +811,18 @@ def main():
         
         st.markdown("## 🏛️ Selecciona tu Candidato para Presidente")
         
-        # Two-column layout for candidates
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.markdown("""
-            <div class="candidate-card gabriel-card">
-                <h2>🏛️ Gabriel Oliver</h2>
-                <p style="font-size: 1.2em; color: #667eea;">Candidato Finalista</p>
-                <p>Experiencia y liderazgo para el futuro</p>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        with col2:
-            st.markdown("""
-            <div class="candidate-card gonzalo-card">
-                <h2>🏛️ Gonzalo Ros</h2>
-                <p style="font-size: 1.2em; color: #764ba2;">Candidato Finalista</p>
-                <p>Innovación y cambio organizacional</p>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        # Voting form
-        st.markdown("### 🗳️ Emite tu Voto")
-        
-        with st.form("runoff_voting_form"):
-            selected_candidate = st.radio(
-                "**Selecciona tu candidato para Presidente:**",
-                RUNOFF_CANDIDATES,
-                index=None,
-                help="Elige cuidadosamente - esta es la votación definitiva"
-            )
-            
-            st.markdown("---")
-            
-            col1, col2, col3 = st.columns([1, 2, 1])
-            
-            with col1:
-                logout_button = st.form_submit_button("🚪 Salir", type="secondary")
-            
-            with col2:
-                vote_button = st.form_submit_button("✅ CONFIRMAR VOTO", type="primary", use_container_width=True)
-            
-            with col3:
-                pass  # Empty column for spacing
-        
-        if vote_button:
-            if selected_candidate:
-                with st.spinner("Procesando tu voto..."):
-                    time_module.sleep(1)  # Add suspense
-                    if save_vote(st.session_state.user_id, selected_candidate):
-                        st.session_state.vote_submitted = True
-                        st.session_state.voted_candidate = selected_candidate
-                        st.rerun()
-                    else:
-                        st.error("❌ Error al guardar el voto. Inténtelo de nuevo.")
-            else:
-                st.error("❌ Por favor, selecciona un candidato antes de votar.")
+        # One card per candidate
+        for i, (column, candidate) in enumerate(zip(candidate_columns(len(election.candidates)), election.candidates)):
+            with column:
+                st.markdown(f"""
+                <div class="candidate-card" style="border-left: 5px solid {candidate_color(i)};">
+                    <h2>🏛️ {candidate}</h2>
+                    <p style="font-size: 1.2em; color: {candidate_color(i)};">Candidato Finalista</p>
+                    <p>{CANDIDATE_TAGLINES.get(candidate, "")}</p>
+                </div>
+                """, unsafe_allow_html=True)
         
-        if logout_button:
-            st.session_state.authenticated = False
-            st.session_state.user_id = None
-            st.session_state.user_name = None
-            st.rerun()
+        voting_form(election)
         
         # Security notice
         st.markdown("---")
@@ -627,4 +840,5 @@ def main():
         """, unsafe_allow_html=True)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with metrics.timer("render"):
+        main()
\ No newline at end of file
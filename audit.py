@@ -0,0 +1,168 @@
+"""Auditor tools that read ballot archives without opening them as stores.
+
+Check the hash chain and the Merkle checkpoints of a ballot log, using
+every core by default:
+
+    python audit.py chain votes_runoff.ndjson
+    python audit.py chain votes_runoff.ndjson --from-segment 120 --processes 1
+
+Recount ballot archives in parallel and check each recount against the
+tally the store recorded (a snapshot's, a closed round's, a SQLite tally
+table, a ballot log's tally checkpoint) and against its voter marks. An
+archive is a ballot file (``votes*.ndjson``, ``votes*.bin``, ``votes*.db``),
+a directory of them, a snapshot, or an election directory (its current
+shard, the shards of its closed rounds and its snapshots):
+
+    python audit.py recount .
+    python audit.py recount elections/consejo elections/_archive/2025 --processes 8
+
+Nothing is written, so it is safe to run against a live log or a copy. A
+ballot still being appended when the audit starts is left out. Compare the
+reported head with the one published by the election administrator.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from elections import MANIFEST, SNAPSHOT_DIR
+from storage.chain import read_checkpoints, verify_log
+from storage.recount import CHUNK_BALLOTS, compact_archive, committed_end, log_archive, recount, sqlite_archive
+from storage.snapshot import SNAPSHOT_FILE, Snapshot, list_snapshots
+
+
+def audit_chain(votes_path, from_segment=0, processes=None):
+    end = committed_end(votes_path)
+    segments = [segment for segment in read_checkpoints(votes_path + ".merkle") if segment["end"] <= end]
+    return verify_log(votes_path, segments, end, min(from_segment, len(segments)), processes)
+
+
+def file_archive(path, lengths=None, stored=None):
+    """The archive whose ballot file is ``path``, or None for any other file"""
+    directory, name = os.path.split(path)
+    if not name.startswith("votes"):
+        return None
+    if name.endswith(".ndjson"):
+        users_path = os.path.join(directory, "users" + name[len("votes"):])
+        return log_archive(path, path, users_path, lengths, stored)
+    if name.endswith(".bin"):
+        return compact_archive(path, path, lengths, stored)
+    if name.endswith(".db"):
+        return sqlite_archive(path, path, stored)
+    return None
+
+
+def store_archives(directory, lengths=None, stored=None):
+    """Archives of the ballot files in ``directory``"""
+    archives = (file_archive(os.path.join(directory, name), lengths, stored) for name in sorted(os.listdir(directory)))
+    return [archive for archive in archives if archive is not None]
+
+
+def snapshot_archives(snapshot, skipped):
+    if "ledger" in snapshot.meta:
+        skipped.append((snapshot.path, f"only records the ledger shard {snapshot.meta['ledger']}"))
+        return []
+    return store_archives(snapshot.path, snapshot.meta["files"], snapshot.meta["results"])
+
+
+def find_archives(path, skipped):
+    """Archives under ``path``: a ballot file, a snapshot, an election or a directory of
+    ballot files (and its snapshots); what cannot be recounted goes to ``skipped``"""
+    if not os.path.exists(path):
+        skipped.append((path, "no such file or directory"))
+        return []
+    if not os.path.isdir(path):
+        archive = file_archive(path)
+        if archive is None:
+            skipped.append((path, "not a ballot file"))
+        return [archive] if archive else []
+    if os.path.exists(os.path.join(path, SNAPSHOT_FILE)):
+        return snapshot_archives(Snapshot(path), skipped)
+    archives = []
+    if os.path.exists(os.path.join(path, MANIFEST)):
+        with open(os.path.join(path, MANIFEST), 'r', encoding="utf-8") as f:
+            config = json.load(f)
+        shards = [(closed["shard"], closed["results"]) for closed in config.get("rounds", [])]
+        for shard, stored in shards + [(config["shard"], None)]:
+            if os.path.isdir(os.path.join(path, shard)):
+                archives += store_archives(os.path.join(path, shard), stored=stored)
+            else:
+                skipped.append((os.path.join(path, shard), "not on disk (remote backend?)"))
+    else:
+        archives += store_archives(path)
+    for snapshot in list_snapshots(os.path.join(path, SNAPSHOT_DIR)):
+        archives += snapshot_archives(snapshot, skipped)
+    if not archives:
+        skipped.append((path, "no ballot files"))
+    return archives
+
+
+def print_recount(report):
+    print(f"{'OK' if report['ok'] else 'FAILED'}: {report['label']} ({report['backend']}) "
+          f"{report['ballots']} ballots in {report['chunks']} chunks, {report['marks']} voter marks")
+    stored = report["stored"]
+    for candidate in sorted(set(report["tally"]) | set(stored or {}), key=lambda c: -report["tally"].get(c, 0)):
+        votes = report["tally"].get(candidate, 0)
+        line = f"  {candidate:30} {votes:12}"
+        if stored is not None:
+            kept = stored.get(candidate, 0)
+            line += f"  stored {kept:12}" + (f"  diff {votes - kept:+}" if votes != kept else "")
+        print(line)
+    for problem in report["problems"]:
+        print("  " + json.dumps(problem, ensure_ascii=False))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Audit ballot archives")
+    commands = parser.add_subparsers(dest="command", required=True)
+    chain_cmd = commands.add_parser("chain", help="verify the hash chain and Merkle checkpoints")
+    chain_cmd.add_argument("votes_path", nargs="?", default="votes_runoff.ndjson")
+    chain_cmd.add_argument("--from-segment", type=int, default=0,
+                           help="trust the checkpoints before this segment (already audited)")
+    chain_cmd.add_argument("--processes", type=int, default=None,
+                           help="worker processes (default: one per core, 1 for a single pass)")
+    recount_cmd = commands.add_parser("recount", help="recount ballot archives and check them against the stored tallies")
+    recount_cmd.add_argument("paths", nargs="*", default=["."],
+                             help="ballot files, snapshots, elections or directories of ballot files")
+    recount_cmd.add_argument("--processes", type=int, default=None,
+                             help="worker processes (default: one per core, 1 for a single pass)")
+    recount_cmd.add_argument("--chunk", type=int, default=CHUNK_BALLOTS, help="ballots per chunk")
+    args = parser.parse_args(argv)
+
+    if args.command == "chain":
+        if not os.path.isfile(args.votes_path):
+            reason = "is a directory" if os.path.isdir(args.votes_path) else "no such file"
+            print(f"error: {args.votes_path}: {reason}", file=sys.stderr)
+            return 2
+        start = time.perf_counter()
+        report = audit_chain(args.votes_path, args.from_segment, args.processes)
+        elapsed = time.perf_counter() - start
+        print(f"{'OK' if report['ok'] else 'FAILED'}: {report['records']} ballots, "
+              f"{report['segments']} segments in {elapsed:.2f}s")
+        print(f"head {report['head']}")
+        if report["unchained"]:
+            print(f"{report['unchained']} ballots predate chaining (covered by the chain, no stored value)")
+        for problem in report["problems"]:
+            print(json.dumps(problem, ensure_ascii=False))
+        return 0 if report["ok"] else 1
+    if args.command == "recount":
+        skipped = []
+        archives = [archive for path in args.paths for archive in find_archives(path, skipped)]
+        start = time.perf_counter()
+        reports = recount(archives, args.processes, args.chunk)
+        elapsed = time.perf_counter() - start
+        for report in reports:
+            print_recount(report)
+        for path, reason in skipped:
+            print(f"skipped {path}: {reason}")
+        ballots = sum(report["ballots"] for report in reports)
+        failed = sum(not report["ok"] for report in reports)
+        print(f"{len(reports)} archives, {ballots} ballots recounted in {elapsed:.2f}s "
+              f"({ballots / max(elapsed, 1e-9):.0f} ballots/s), {failed} with discrepancies")
+        return 1 if failed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+"""Headless benchmarks and stress tests for the voting core."""
@@ -0,0 +1,118 @@
+"""Loop-based results versus the columnar ``analytics`` module on large ballot logs.
+
+Writes a synthetic ballot log (timestamps spread over a voting day) and
+opens it as a ``VoteLog``. It then times:
+
+- the loop the app used to compute results: parse every ballot with
+  ``iter_votes`` and count in a dict, plus the same loop bucketing votes
+  per minute;
+- ``BallotFrame.refresh`` (full load), then ``tally``, ``votes_per_interval``,
+  ``turnout_over_time`` and ``candidate_series`` on the frame;
+- an incremental refresh after appending a batch of new ballots.
+
+    python -m benchmarks.bench_analytics --ballots 1000000 3000000
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CANDIDATES = ["Gabriel Oliver", "Gonzalo Ros"]
+
+
+def write_log(path, count):
+    """Ballot log with ``count`` ballots over 12 hours, and a checkpoint so opening it is quick"""
+    start = datetime(2026, 1, 1, 8)
+    step = 12 * 3600 / count
+    tally = {}
+    with open(path, 'wb') as f:
+        for i in range(1, count + 1):
+            candidate = CANDIDATES[(i * 7919) % 3 == 0]
+            tally[candidate] = tally.get(candidate, 0) + 1
+            timestamp = (start + timedelta(seconds=i * step)).isoformat()
+            f.write(json.dumps({"candidate": candidate, "timestamp": timestamp, "vote_id": i}).encode() + b"\n")
+        offset = f.tell()
+    with open(path + ".checkpoint", 'w') as f:
+        json.dump({"votes_offset": offset, "vote_count": count, "tally": tally}, f)
+
+
+def loop_results(store):
+    """Results the way the app computed them before the stored tally"""
+    votes = {f"vote_{vote['vote_id']}": vote for vote in store.iter_votes()}
+    results = {candidate: 0 for candidate in CANDIDATES}
+    for vote in votes.values():
+        if vote["candidate"] in results:
+            results[vote["candidate"]] += 1
+    return results
+
+
+def loop_per_minute(store):
+    per_minute = {}
+    for vote in store.iter_votes():
+        minute = vote["timestamp"][:16]
+        per_minute[minute] = per_minute.get(minute, 0) + 1
+    return per_minute
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def run(count, data_dir, append):
+    import analytics
+    from storage import VoteLog
+
+    votes_path = os.path.join(data_dir, f"votes_{count}.ndjson")
+    write_log(votes_path, count)
+    store = VoteLog(votes_path, os.path.join(data_dir, f"users_{count}.ndjson"))
+    print(f"ballots={count} log={os.path.getsize(votes_path) / 1e6:.0f}MB engine={analytics.JSON_ENGINE}")
+
+    looped, elapsed = _timed(loop_results, store)
+    print(f"  loop results          {elapsed:7.2f}s")
+    _, elapsed = _timed(loop_per_minute, store)
+    print(f"  loop votes per minute {elapsed:7.2f}s")
+
+    ballots = analytics.BallotFrame(store)
+    frame, elapsed = _timed(ballots.refresh)
+    print(f"  frame full load       {elapsed:7.2f}s  ({frame.memory_usage(deep=True).sum() / 1e6:.0f}MB)")
+    for label, fn, args in (
+        ("tally", analytics.tally, (frame, CANDIDATES)),
+        ("votes per minute", analytics.votes_per_interval, (frame,)),
+        ("turnout over time", analytics.turnout_over_time, (frame, count)),
+        ("candidate series", analytics.candidate_series, (frame, CANDIDATES)),
+    ):
+        result, elapsed = _timed(fn, *args)
+        print(f"  {label:21} {elapsed * 1000:7.1f}ms")
+    assert analytics.tally(frame, CANDIDATES).to_dict() == looped
+
+    store.record_votes([(f"new{i}", CANDIDATES[i % 2]) for i in range(append)])
+    frame, elapsed = _timed(ballots.refresh)
+    assert len(frame) == count + append
+    print(f"  incremental +{append:<7} {elapsed * 1000:7.1f}ms")
+    store.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ballots", type=int, nargs="+", default=[1000000])
+    parser.add_argument("--append", type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, REPO_DIR)
+    data_dir = tempfile.mkdtemp(prefix="bench_analytics_")
+    try:
+        for count in args.ballots:
+            run(count, data_dir, args.append)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
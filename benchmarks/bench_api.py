@@ -0,0 +1,138 @@
+"""Load test for the headless HTTP API.
+
+Starts ``api.py`` in a scratch data directory (or targets --url) and drives
+it from several client processes over keep-alive connections with a mix of
+eligibility checks, result reads and vote attempts. Reports requests per
+second and latency percentiles per endpoint.
+
+    python -m benchmarks.bench_api --clients 8 --connections 8 --seconds 10
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+from urllib.parse import urlsplit
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import core  # noqa: E402
+
+
+def _client(args):
+    url, connections, seconds, seed = args
+    parts = urlsplit(url)
+    rng = random.Random(seed)
+    conns = [http.client.HTTPConnection(parts.hostname, parts.port) for _ in range(connections)]
+    roll = list(core.VALID_USERS)
+    samples = {}
+    statuses = {}
+    deadline = time.perf_counter() + seconds
+    i = 0
+    while time.perf_counter() < deadline:
+        conn = conns[i % connections]
+        i += 1
+        pick = rng.random()
+        if pick < 0.80:
+            name, method, path = "login", "POST", "/api/login"
+            body = {"user_id": rng.choice(roll + ["00000000X"])}
+        elif pick < 0.95:
+            name, method, path, body = "results", "GET", "/api/results", None
+        else:
+            name, method, path = "vote", "POST", "/api/votes"
+            body = {"user_id": rng.choice(roll), "candidate": rng.choice(core.RUNOFF_CANDIDATES)}
+        headers = {"X-Admin-Id": core.ADMIN_ID}
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        start = time.perf_counter()
+        conn.request(method, path, body=data, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        samples.setdefault(name, []).append(time.perf_counter() - start)
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+    for conn in conns:
+        conn.close()
+    return samples, statuses
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(url, timeout=30):
+    parts = urlsplit(url)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=1)
+            conn.request("GET", "/api/health")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"API at {url} did not come up")
+
+
+def run(url, clients, connections, seconds):
+    with Pool(clients) as pool:
+        start = time.perf_counter()
+        outcomes = pool.map(_client, [(url, connections, seconds, n) for n in range(clients)])
+        elapsed = time.perf_counter() - start
+
+    samples = {}
+    statuses = {}
+    for client_samples, client_statuses in outcomes:
+        for name, values in client_samples.items():
+            samples.setdefault(name, []).extend(values)
+        for status, count in client_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+
+    total = sum(len(v) for v in samples.values())
+    print(f"url={url} clients={clients}x{connections} connections elapsed={elapsed:.1f}s")
+    print(f"requests={total} throughput={total / elapsed:.0f} req/s statuses={dict(sorted(statuses.items()))}")
+    for name, values in sorted(samples.items()):
+        values.sort()
+        p = lambda q: values[min(len(values) - 1, int(q * len(values)))] * 1000
+        print(f"  {name:8} n={len(values):7} p50={p(0.5):6.2f}ms p99={p(0.99):6.2f}ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="existing API to target instead of starting one")
+    parser.add_argument("--clients", type=int, default=4, help="client processes")
+    parser.add_argument("--connections", type=int, default=8, help="keep-alive connections per client")
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args(argv)
+
+    if args.url:
+        run(args.url, args.clients, args.connections, args.seconds)
+        return
+
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory(prefix="bench_api_") as data_dir:
+        server = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "api.py"), "--port", str(port)],
+                                  cwd=data_dir, stdout=subprocess.DEVNULL,
+                                  # every client shares 127.0.0.1; measure the API, not the login limit
+                                  env=dict(os.environ, LOGIN_RATE_PER_ADDRESS="0"))
+        try:
+            _wait_ready(url)
+            run(url, args.clients, args.connections, args.seconds)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Cost of the hash-chained ballot log: sealing, opening and verifying it.
+
+Writes a chained log with its Merkle checkpoints, then times a full
+verification in one pass and with a process pool, an incremental one after
+more ballots are cast (it should only depend on what was appended), and
+the per-ballot cost sealing adds to a commit.
+
+    python -m benchmarks.bench_chain --ballots 1000000
+    python -m benchmarks.bench_chain --ballots 1000000 --processes 8
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.bench_analytics import CANDIDATES
+from storage import VoteLog
+from storage.chain import GENESIS, checkpoint, leaf_hash, seal
+
+
+def write_chained_log(path, count, merkle_every):
+    """Chained ballot log with ``count`` ballots, its Merkle file and a compaction checkpoint"""
+    start = datetime(2026, 1, 1, 8)
+    step = 12 * 3600 / count
+    tally = {}
+    chain = GENESIS
+    leaves = []
+    segments = []
+    segment_start = 0
+    with open(path, 'wb') as f:
+        for i in range(1, count + 1):
+            candidate = CANDIDATES[(i * 7919) % 3 == 0]
+            tally[candidate] = tally.get(candidate, 0) + 1
+            timestamp = (start + timedelta(seconds=i * step)).isoformat()
+            payload = json.dumps({"candidate": candidate, "timestamp": timestamp, "vote_id": i}).encode()
+            line, chain = seal(payload, chain)
+            f.write(line)
+            leaves.append(leaf_hash(payload))
+            if len(leaves) >= merkle_every:
+                end = f.tell()
+                segments.append(checkpoint(len(segments), i - len(leaves) + 1, segment_start, end, leaves, chain))
+                leaves = []
+                segment_start = end
+        offset = f.tell()
+    with open(path + ".merkle", 'wb') as f:
+        f.write(b"".join(json.dumps(segment).encode() + b"\n" for segment in segments))
+    with open(path + ".checkpoint", 'w') as f:
+        json.dump({"votes_offset": offset, "vote_count": count, "tally": tally}, f)
+
+
+def seal_overhead(count):
+    """Seconds per ballot to encode a ballot, and to encode and seal it"""
+    entry = {"candidate": CANDIDATES[0], "timestamp": datetime(2026, 1, 1, 8).isoformat(), "vote_id": 1}
+    start = time.perf_counter()
+    for _ in range(count):
+        json.dumps(entry, ensure_ascii=False).encode("utf-8") + b"\n"
+    plain = (time.perf_counter() - start) / count
+    chain = GENESIS
+    start = time.perf_counter()
+    for _ in range(count):
+        line, chain = seal(json.dumps(entry, ensure_ascii=False).encode("utf-8"), chain)
+    sealed = (time.perf_counter() - start) / count
+    return plain, sealed
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    if isinstance(result, dict):
+        status = "ok" if result["ok"] else f"FAILED {result['problems'][:3]}"
+        print(f"  {label:34} {elapsed:7.2f}s  {result['records']} ballots read, "
+              f"{result['segments']} segments, {status}")
+    else:
+        print(f"  {label:34} {elapsed:7.2f}s")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ballots", type=int, default=1000000)
+    parser.add_argument("--merkle-every", type=int, default=4096)
+    parser.add_argument("--append", type=int, default=10000, help="ballots cast before the incremental check")
+    parser.add_argument("--processes", type=int, default=None, help="pool size (default: one per core)")
+    args = parser.parse_args(argv)
+
+    data_dir = tempfile.mkdtemp(prefix="bench_chain_")
+    try:
+        votes_path = os.path.join(data_dir, "votes.ndjson")
+        start = time.perf_counter()
+        write_chained_log(votes_path, args.ballots, args.merkle_every)
+        print(f"ballots={args.ballots} log={os.path.getsize(votes_path) / 1e6:.0f}MB "
+              f"merkle_every={args.merkle_every} cores={os.cpu_count()} "
+              f"(written in {time.perf_counter() - start:.0f}s)")
+
+        store = timed("open (replay from checkpoints)", lambda: VoteLog(
+            votes_path, votes_path + ".users", merkle_every=args.merkle_every))
+        timed("full verify, one pass", lambda: store.verify_chain(processes=1))
+        timed("full verify, process pool", lambda: store.verify_chain(processes=args.processes))
+        timed("incremental verify, nothing new", lambda: store.verify_chain(incremental=True))
+        timed(f"cast {args.append} ballots (batches of 500)", lambda: [
+            store.record_votes([(f"bench-{i + j}", CANDIDATES[j % 2]) for j in range(500)])
+            for i in range(0, args.append, 500)])
+        timed(f"incremental verify, +{args.append} ballots", lambda: store.verify_chain(incremental=True))
+        store.close()
+
+        plain, sealed = seal_overhead(200000)
+        print(f"  encode {plain * 1e6:.2f}us/ballot, encode+seal {sealed * 1e6:.2f}us/ballot "
+              f"(+{(sealed - plain) * 1e6:.2f}us per committed ballot)")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Disk, memory and time of the compact binary ballot store against the JSON formats.
+
+Casts --ballots ballots into an append-only log (``VoteLog``), writes the
+same ballots as an old pretty-printed whole-file JSON store and migrates
+the log to a ``CompactStore`` with ``migrate.py``. For each format it
+reports:
+
+- bytes on disk per ballot (ballots, then with the voter marks);
+- loading every ballot: wall time and Python heap (tracemalloc peak),
+  as a ``{"vote_N": ballot}`` dict for the JSON formats and as the
+  mapped record array for the compact store;
+- opening the store from scratch (replaying the log, no checkpoint);
+- a full recount and a full ``BallotFrame`` load for the charts.
+
+    python -m benchmarks.bench_compact --ballots 100000 1000000
+    python -m benchmarks.bench_compact --ranked
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CANDIDATES = ["Gabriel Oliver", "Gonzalo Ros", "Ana Martín"]
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def _heap(fn, *args):
+    """Peak Python heap while ``fn`` runs, with its result still held"""
+    tracemalloc.start()
+    try:
+        result = fn(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak
+
+
+def _size(*paths):
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def seed(votes_path, users_path, count, ranked):
+    from storage import VoteLog
+
+    log = VoteLog(votes_path, users_path, compact_every=0)
+    for start in range(0, count, 10000):
+        log.record_votes([(f"{i:08d}V", CANDIDATES[i % 3], CANDIDATES[i % 3:] + CANDIDATES[:i % 3] if ranked else None)
+                          for i in range(start, min(start + 10000, count))])
+    log.close()
+
+
+def write_legacy(path, log):
+    """The whole-file store the app used before the log: one pretty-printed dict"""
+    votes = {}
+    for vote in log.iter_votes():
+        vote.pop("chain", None)
+        votes[f"vote_{vote['vote_id']}"] = vote
+    with open(path, 'w') as f:
+        json.dump(votes, f, indent=2)
+
+
+def load_legacy(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_log(log):
+    return {f"vote_{vote['vote_id']}": vote for vote in log.iter_votes()}
+
+
+def report(label, ballot_bytes, total_bytes, count, load, heap):
+    print(f"  {label:8} {ballot_bytes / count:7.1f} B/ballot ({total_bytes / count:6.1f} with voters) "
+          f"{ballot_bytes / 1e6:8.1f}MB  load {load:6.2f}s {heap / 1e6:8.1f}MB heap")
+
+
+def run(count, data_dir, ranked):
+    import analytics
+    import migrate
+    from storage import CompactStore, VoteLog
+
+    votes_path = os.path.join(data_dir, f"votes_{count}.ndjson")
+    users_path = os.path.join(data_dir, f"users_{count}.ndjson")
+    legacy_path = os.path.join(data_dir, f"votes_{count}.json")
+    compact_path = os.path.join(data_dir, f"votes_{count}.bin")
+    seed(votes_path, users_path, count, ranked)
+    log = VoteLog(votes_path, users_path, compact_every=0)
+    write_legacy(legacy_path, log)
+    compact = CompactStore(compact_path)
+    _, elapsed = _timed(migrate.migrate, log, compact)
+    print(f"ballots={count} ranked={ranked} migrated in {elapsed:.2f}s ({compact.rank_slots} ranking slots)")
+
+    _, load = _timed(load_legacy, legacy_path)
+    report("json", _size(legacy_path), _size(legacy_path, users_path), count, load, _heap(load_legacy, legacy_path))
+    _, load = _timed(load_log, log)
+    report("ndjson", _size(votes_path), _size(votes_path, users_path), count, load, _heap(load_log, log))
+    records, load = _timed(compact.records)
+    compact_bytes = _size(compact_path, compact.candidates_path)
+    report("compact", compact_bytes, compact_bytes + _size(compact.voters_path), count, load,
+           _heap(compact.records))
+    print(f"           compact records are {records.nbytes / 1e6:.1f}MB mapped from the page cache, not copied")
+
+    for label, open_store in (("ndjson", lambda: VoteLog(votes_path, users_path, compact_every=0)),
+                              ("compact", lambda: CompactStore(compact_path))):
+        store, elapsed = _timed(open_store)
+        _, recount = _timed(store.recount)
+        frame, load = _timed(analytics.BallotFrame(store).refresh)
+        print(f"  {label:8} open {elapsed:6.2f}s  recount {recount * 1000:8.1f}ms  "
+              f"frame {load * 1000:8.1f}ms ({frame.memory_usage(deep=True).sum() / 1e6:.0f}MB)")
+        store.close()
+    assert compact.recount() == log.recount()
+    log.close()
+    compact.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ballots", type=int, nargs="+", default=[200000])
+    parser.add_argument("--ranked", action="store_true", help="ballots rank all three candidates")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, REPO_DIR)
+    data_dir = tempfile.mkdtemp(prefix="bench_compact_")
+    try:
+        for count in args.ballots:
+            run(count, data_dir, args.ranked)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
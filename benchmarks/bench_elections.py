@@ -0,0 +1,120 @@
+"""Many elections on one node: concurrent voting, and O(1) reset and archive.
+
+Creates ``--elections`` elections, each with its own roll and shard, and
+has every one of them voted at once through the normal save path (group
+commit, durable before the acknowledgment). For comparison, the same
+number of ballots is then cast into a single election by as many voter
+threads: one shard lets group commit fold everyone into a few large syncs,
+many shards sync separately but never wait on each other. Finally a large
+election is reset and archived while the others keep voting: both should
+take milliseconds whatever its size, and every other election must keep
+exactly its ballots.
+
+    python -m benchmarks.bench_elections --elections 100 --voters 200
+    python -m benchmarks.bench_elections --backend sqlite
+"""
+import argparse
+import shutil
+import tempfile
+import threading
+import time
+
+from elections import ElectionRegistry
+
+CANDIDATES = ["Ana", "Beto", "Carla"]
+
+
+def roll(prefix, voters):
+    return {f"{prefix}-{i:07d}": f"Votante {i}" for i in range(voters)}
+
+
+def cast_all(elections, threads_per_election):
+    """Vote every roll entry once, ``threads_per_election`` voters at a time; returns (elapsed, latencies)"""
+    latencies = []
+    lock = threading.Lock()
+
+    def voter(election, user_ids):
+        samples = []
+        for i, user_id in enumerate(user_ids):
+            start = time.perf_counter()
+            election.save_vote(user_id, CANDIDATES[i % len(CANDIDATES)])
+            samples.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(samples)
+
+    threads = []
+    for election in elections:
+        user_ids = list(election.valid_users)
+        for n in range(threads_per_election):
+            threads.append(threading.Thread(target=voter, args=(election, user_ids[n::threads_per_election])))
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start, sorted(latencies)
+
+
+def report(label, ballots, elapsed, latencies):
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    print(f"  {label:28} ballots={ballots:7d} {elapsed:6.1f}s {ballots / elapsed:8.0f}/s "
+          f"p50={p(0.5):6.2f}ms p99={p(0.99):7.2f}ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--elections", type=int, default=100)
+    parser.add_argument("--voters", type=int, default=200, help="voters per election")
+    parser.add_argument("--threads", type=int, default=2, help="concurrent voters per election")
+    parser.add_argument("--big", type=int, default=200000, help="ballots in the election that is reset and archived")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    args = parser.parse_args(argv)
+
+    root = tempfile.mkdtemp(prefix="bench_elections_")
+    registry = ElectionRegistry(root, {"backend": args.backend, "verify_tally_on_start": False})
+    try:
+        elections = [registry.create(f"e{n:03d}", f"Elección {n}", CANDIDATES, roll(f"e{n:03d}", args.voters))
+                     for n in range(args.elections)]
+        total = args.elections * args.voters
+        print(f"backend={args.backend} elections={args.elections} voters/election={args.voters} "
+              f"threads/election={args.threads}")
+
+        elapsed, latencies = cast_all(elections, args.threads)
+        report(f"{args.elections} elections at once", total, elapsed, latencies)
+        counts = [sum(election.get_results().values()) for election in elections]
+        assert counts == [args.voters] * args.elections, "an election lost or duplicated ballots"
+
+        single = registry.create("single", "Una sola", CANDIDATES, roll("single", total))
+        elapsed, latencies = cast_all([single], args.elections * args.threads)
+        report("same load, one election", total, elapsed, latencies)
+
+        # A large election, reset then archived while the others vote
+        big = registry.create("big", "Grande", CANDIDATES, roll("big", 1))
+        store = big.store()
+        for start in range(0, args.big, 10000):
+            store.record_votes([(f"big-{i}", CANDIDATES[i % 3]) for i in range(start, min(start + 10000, args.big))])
+        for election in elections:
+            election.clear_all_votes()
+        background = threading.Thread(target=cast_all, args=(elections, args.threads))
+        background.start()
+        start = time.perf_counter()
+        big.reset()
+        reset_ms = (time.perf_counter() - start) * 1000
+        for start in range(0, args.big, 10000):
+            big.store().record_votes([(f"big-{i}", CANDIDATES[i % 3]) for i in range(start, min(start + 10000, args.big))])
+        start = time.perf_counter()
+        registry.archive("big")
+        archive_ms = (time.perf_counter() - start) * 1000
+        background.join()
+        counts = [sum(election.get_results().values()) for election in elections]
+        assert counts == [args.voters] * args.elections, "reset/archive disturbed another election"
+        print(f"  reset of a {args.big}-ballot election   {reset_ms:7.1f}ms")
+        print(f"  archive of a {args.big}-ballot election {archive_ms:7.1f}ms")
+        print(f"  other elections intact: {args.elections} x {args.voters} ballots")
+    finally:
+        registry.close()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Throughput and memory ceiling of the streaming export at election scale.
+
+Writes a synthetic ballot log (see ``bench_analytics.write_log``), then
+exports it in every format from a fresh child process, so the reported
+peak RSS covers one export only. Memory should stay flat as the number of
+ballots grows; only ``--chunk-size`` should move it.
+
+    python -m benchmarks.bench_export --ballots 10000000
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_analytics import write_log
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _measure(votes_path, fmt, chunk_size, out_path):
+    """Runs in a child process: export once and report time and peak RSS"""
+    sys.path.insert(0, REPO_DIR)
+    import export
+    from storage import VoteLog
+
+    store = VoteLog(votes_path, votes_path + ".users")
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    written = 0
+    with open(out_path, 'wb') as out:
+        for chunk in export.export(store, "ballots", fmt, chunk_size):
+            out.write(chunk)
+            written += len(chunk)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"elapsed": elapsed, "bytes": written, "baseline_rss_kb": baseline_rss,
+                      "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ballots", type=int, default=10000000)
+    parser.add_argument("--chunk-size", type=int, default=100000)
+    parser.add_argument("--formats", nargs="+", default=["ndjson", "csv", "parquet", "arrow"])
+    parser.add_argument("--measure", nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.measure:
+        votes_path, fmt, chunk_size, out_path = args.measure
+        _measure(votes_path, fmt, int(chunk_size), out_path)
+        return
+
+    data_dir = tempfile.mkdtemp(prefix="bench_export_")
+    try:
+        votes_path = os.path.join(data_dir, "votes.ndjson")
+        start = time.perf_counter()
+        write_log(votes_path, args.ballots)
+        print(f"ballots={args.ballots} log={os.path.getsize(votes_path) / 1e6:.0f}MB "
+              f"(written in {time.perf_counter() - start:.0f}s) chunk_size={args.chunk_size}")
+        for fmt in args.formats:
+            out_path = os.path.join(data_dir, f"export.{fmt}")
+            out = subprocess.run([sys.executable, "-m", "benchmarks.bench_export", "--measure",
+                                  votes_path, fmt, str(args.chunk_size), out_path],
+                                 cwd=REPO_DIR, capture_output=True, text=True, check=True)
+            r = json.loads(out.stdout)
+            print(f"  {fmt:8} {r['elapsed']:7.1f}s {args.ballots / r['elapsed']:10.0f} ballots/s "
+                  f"{r['bytes'] / 1e6 / r['elapsed']:6.1f}MB/s out={r['bytes'] / 1e6:6.0f}MB "
+                  f"peak_rss={r['peak_rss_kb'] / 1024:6.0f}MB "
+                  f"(+{(r['peak_rss_kb'] - r['baseline_rss_kb']) / 1024:.0f}MB over imports)")
+            os.remove(out_path)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
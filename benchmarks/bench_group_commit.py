@@ -0,0 +1,81 @@
+"""Durable vote throughput: one sync per ballot vs. group commit.
+
+N simulated voters (threads) cast ballots at once, either straight into the
+store with a sync per ballot, or through ``VoteIngestor``, which commits
+whatever has queued up as one batch with a single sync. Both modes only
+acknowledge a ballot once it is on stable storage.
+
+    python -m benchmarks.bench_group_commit --voters 64 --ballots 4000
+    python -m benchmarks.bench_group_commit --backend sqlite
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from storage import SqliteStore, VoteIngestor, VoteLog
+
+
+def open_store(backend, data_dir):
+    """Store that syncs every commit"""
+    if backend == "sqlite":
+        return SqliteStore(os.path.join(data_dir, "votes.db"), synchronous="FULL")
+    return VoteLog(os.path.join(data_dir, "votes.ndjson"), os.path.join(data_dir, "users.ndjson"),
+                   fsync_every=1)
+
+
+def run(backend, mode, voters, ballots, max_batch):
+    data_dir = tempfile.mkdtemp(prefix="bench_group_commit_")
+    store = open_store(backend, data_dir)
+    ingestor = VoteIngestor(store, max_batch=max_batch) if mode == "group" else None
+    cast = ingestor.record_vote if ingestor else store.record_vote
+    latencies = []
+    per_voter = ballots // voters
+
+    def voter(n):
+        samples = []
+        for i in range(per_voter):
+            start = time.perf_counter()
+            cast(f"{n:04d}-{i:06d}", "Gabriel Oliver" if i % 2 else "Gonzalo Ros")
+            samples.append(time.perf_counter() - start)
+        latencies.extend(samples)
+
+    threads = [threading.Thread(target=voter, args=(n,)) for n in range(voters)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    if ingestor:
+        ingestor.close()
+    committed = store.vote_count()
+    store.close()
+    shutil.rmtree(data_dir, ignore_errors=True)
+
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    line = (f"{backend:6} {mode:9} voters={voters:4} ballots={committed:6} "
+            f"throughput={committed / elapsed:8.0f}/s p50={p(0.5):7.2f}ms p99={p(0.99):7.2f}ms")
+    if ingestor:
+        line += f" avg_batch={ingestor.ballots / max(ingestor.batches, 1):.1f}"
+    print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--voters", type=int, nargs="+", default=[1, 16, 64, 256])
+    parser.add_argument("--ballots", type=int, default=4000)
+    parser.add_argument("--max-batch", type=int, default=256)
+    args = parser.parse_args(argv)
+    for voters in args.voters:
+        for mode in ("per-vote", "group"):
+            run(args.backend, mode, voters, args.ballots, args.max_batch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Durable vote throughput with and without the write-ahead journal, under fault injection.
+
+For each backend (--backends), with the journal off and on, and with each
+durability mode ("vote": every ballot committed and fsynced on its own,
+"group": queued ballots share one commit through ``VoteIngestor``),
+--voters threads cast ballots for --seconds. Reports ballots per second
+and commit latency.
+
+Meanwhile crashes are injected: with probability --fault-rate, right
+after any append to a data file or to the journal (inside a commit, with
+its locks held), the store's files are copied as a power loss would leave
+them. Each file keeps what was fsynced and a random part of what was not,
+so the page cache may drop or reorder writes across files. Every copy is
+then reopened, which runs recovery, and checked:
+
+- consistent: as many voter marks as ballots, and a tally that matches;
+- no acknowledged ballot lost: every voter whose commit returned has voted.
+
+Time spent copying and recovering is not counted in the throughput.
+
+    python -m benchmarks.bench_journal --voters 32 --seconds 5 --fault-rate 0.01
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from storage import CompactStore, VoteIngestor, VoteLog
+
+CANDIDATES = ["Gabriel Oliver", "Gonzalo Ros"]
+
+# Size of each inode at its last fsync, updated by the os.fsync wrapper
+_durable = {}
+_real_fsync = os.fsync
+
+
+def _tracking_fsync(fd):
+    _real_fsync(fd)
+    st = os.fstat(fd)
+    _durable[(st.st_dev, st.st_ino)] = st.st_size
+
+
+def open_store(backend, data_dir, journal):
+    if backend == "compact":
+        return CompactStore(os.path.join(data_dir, "votes.bin"), journal=journal)
+    return VoteLog(os.path.join(data_dir, "votes.ndjson"), os.path.join(data_dir, "users.ndjson"),
+                   fsync_every=1, journal=journal)
+
+
+def crash_image(data_dir, image_dir, rng):
+    """Copy of ``data_dir`` as a power loss now could leave it"""
+    os.makedirs(image_dir)
+    for name in os.listdir(data_dir):
+        path = os.path.join(data_dir, name)
+        if name.endswith(".lock") or not os.path.isfile(path):
+            continue
+        st = os.stat(path)
+        durable = min(_durable.get((st.st_dev, st.st_ino), 0), st.st_size)
+        shutil.copyfile(path, os.path.join(image_dir, name))
+        with open(os.path.join(image_dir, name), 'r+b') as f:
+            f.truncate(rng.randint(durable, st.st_size))
+
+
+class FaultInjector:
+    """Takes crash images of the store's files at random appends, and checks them"""
+
+    def __init__(self, backend, data_dir, journal, rate, seed):
+        self.backend = backend
+        self.data_dir = data_dir
+        self.journal = journal
+        self.rate = rate
+        self.rng = random.Random(seed)
+        self.acked = []
+        self.images = 0
+        self.inconsistent = 0
+        self.lost = 0
+        self.recovery = []
+        self.paused = 0.0
+
+    def maybe_crash(self):
+        if self.rng.random() >= self.rate:
+            return
+        start = time.perf_counter()
+        acked = list(self.acked)
+        image_dir = os.path.join(os.path.dirname(self.data_dir), f"image-{self.images}")
+        crash_image(self.data_dir, image_dir, self.rng)
+        opened = time.perf_counter()
+        store = open_store(self.backend, image_dir, self.journal)
+        self.recovery.append(time.perf_counter() - opened)
+        marks = len(store.voted_users())
+        if not marks == store.vote_count() == sum(store.tally().values()):
+            self.inconsistent += 1
+        self.lost += sum(not store.has_voted(user_id) for user_id in acked)
+        store.close()
+        shutil.rmtree(image_dir)
+        self.images += 1
+        self.paused += time.perf_counter() - start
+
+    def wrap(self, obj):
+        """Inject a crash after every append ``obj`` makes"""
+        for attr in ("_append", "_write"):
+            method = getattr(obj, attr, None)
+            if method is None:
+                continue
+
+            def injected(*args, _method=method):
+                result = _method(*args)
+                self.maybe_crash()
+                return result
+            setattr(obj, attr, injected)
+
+
+def run(backend, journal, durability, args, root):
+    data_dir = os.path.join(root, f"{backend}-{journal}-{durability}", "data")
+    os.makedirs(data_dir)
+    store = open_store(backend, data_dir, journal)
+    faults = FaultInjector(backend, data_dir, journal, args.fault_rate, args.seed)
+    faults.wrap(store)
+    if store._journal is not None:
+        faults.wrap(store._journal)
+    ingestor = VoteIngestor(store, max_batch=1 if durability == "vote" else 256)
+    latencies = []
+    deadline = time.perf_counter() + args.seconds
+
+    def voter(n):
+        i = 0
+        while time.perf_counter() < deadline:
+            user_id = f"{n:03d}-{i:07d}"
+            i += 1
+            start = time.perf_counter()
+            ingestor.submit(user_id, CANDIDATES[i % 2]).result()
+            latencies.append(time.perf_counter() - start)
+            faults.acked.append(user_id)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=voter, args=(n,)) for n in range(args.voters)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start - faults.paused
+    ingestor.close()
+    store.close()
+
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    recovery = sorted(faults.recovery)
+    print(f"  {backend:8} journal={'on ' if journal else 'off'} durability={durability:5} "
+          f"{len(latencies) / elapsed:8.0f} ballots/s  p50={p(0.5):6.2f}ms p99={p(0.99):7.2f}ms  "
+          f"crashes={faults.images:4} inconsistent={faults.inconsistent:3} acked lost={faults.lost:4}  "
+          f"recovery p50={recovery[len(recovery) // 2] * 1000 if recovery else 0:6.1f}ms "
+          f"max={recovery[-1] * 1000 if recovery else 0:6.1f}ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", nargs="+", choices=("json", "compact"), default=["json", "compact"])
+    parser.add_argument("--voters", type=int, default=32, help="threads casting ballots")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--fault-rate", type=float, default=0.01, help="chance of a crash image after an append")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    os.fsync = _tracking_fsync
+    root = tempfile.mkdtemp(prefix="bench_journal_")
+    try:
+        print(f"voters={args.voters} seconds={args.seconds} fault_rate={args.fault_rate}")
+        for backend in args.backends:
+            for journal in (False, True):
+                for durability in ("vote", "group"):
+                    run(backend, journal, durability, args, root)
+    finally:
+        os.fsync = _real_fsync
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
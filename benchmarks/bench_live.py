@@ -0,0 +1,104 @@
+"""Server cost of live results watchers as their number grows.
+
+Starts ``api.py`` with a synthetic roll, connects W server-sent-event
+watchers and casts votes through the API at a steady rate. Reports the
+server's CPU time and how many tally events each watcher received. With
+coalesced broadcasting the CPU cost should track the vote rate and the
+publish rate, not W.
+
+    python -m benchmarks.bench_live --watchers 10 100 1000 --votes-per-second 50
+"""
+import argparse
+import http.client
+import json
+import os
+import selectors
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_api import REPO_DIR, _free_port, _wait_ready
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def _cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def _open_watchers(port, count, admin_id):
+    sel = selectors.DefaultSelector()
+    request = (f"GET /api/results/stream?admin_id={admin_id} HTTP/1.1\r\n"
+               f"Host: 127.0.0.1\r\n\r\n").encode()
+    for _ in range(count):
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.sendall(request)
+        sock.setblocking(False)
+        sel.register(sock, selectors.EVENT_READ, data={"events": 0})
+    return sel
+
+
+def _drain(sel, timeout):
+    for key, _ in sel.select(timeout):
+        try:
+            chunk = key.fileobj.recv(65536)
+        except BlockingIOError:
+            continue
+        key.data["events"] += chunk.count(b"event: tally")
+
+
+def run(watchers, votes_per_second, seconds, rate_hz):
+    port = _free_port()
+    with tempfile.TemporaryDirectory(prefix="bench_live_") as data_dir:
+        roll_path = os.path.join(data_dir, "roll.json")
+        voters = [f"{i:08d}L" for i in range(int(votes_per_second * seconds) + 10)]
+        with open(roll_path, 'w') as f:
+            json.dump({voter: f"Votante {i}" for i, voter in enumerate(voters)}, f)
+        env = dict(os.environ, VOTER_ROLL=roll_path, ADMIN_ID=voters[-1], LIVE_RESULTS_HZ=str(rate_hz))
+        server = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "api.py"), "--port", str(port)],
+                                  cwd=data_dir, env=env, stdout=subprocess.DEVNULL)
+        try:
+            _wait_ready(f"http://127.0.0.1:{port}")
+            sel = _open_watchers(port, watchers, voters[-1])
+            conn = http.client.HTTPConnection("127.0.0.1", port)
+            cpu_start = _cpu_seconds(server.pid)
+            start = time.perf_counter()
+            cast = 0
+            while time.perf_counter() - start < seconds:
+                due = int((time.perf_counter() - start) * votes_per_second)
+                while cast < due:
+                    conn.request("POST", "/api/votes", body=json.dumps(
+                        {"user_id": voters[cast], "candidate": "Gabriel Oliver" if cast % 2 else "Gonzalo Ros"}))
+                    conn.getresponse().read()
+                    cast += 1
+                _drain(sel, 0.01)
+            _drain(sel, 1.0)
+            cpu = _cpu_seconds(server.pid) - cpu_start
+            events = [key.data["events"] for key in sel.get_map().values()]
+            for key in list(sel.get_map().values()):
+                key.fileobj.close()
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"watchers={watchers:5} votes={cast:5} server_cpu={cpu:5.2f}s "
+          f"events/watcher min={min(events)} max={max(events)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--watchers", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--votes-per-second", type=float, default=50)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--rate-hz", type=float, default=2)
+    args = parser.parse_args(argv)
+    for watchers in args.watchers:
+        run(watchers, args.votes_per_second, args.seconds, args.rate_hz)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Login latency of the has-voted check as the electorate grows.
+
+For each electorate size every voter has already voted, and the check is
+timed for a mix of voters who have and have not voted, against:
+
+- ``list scan``: the original ``user_id in load_voted_users()`` list scan,
+  with the file parse left out (only run up to 100k voters)
+- ``store``: ``VoteStore.has_voted`` on the chosen backend
+- ``index (set)``: ``VoterIndex`` as used by the app
+- ``index (bloom)``: ``VoterIndex`` with a Bloom prefilter and no set
+
+    python -m benchmarks.bench_login --sizes 10000 100000 1000000 --backend sqlite
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from storage import SqliteStore, VoteLog, VoterIndex
+
+
+def _voter_id(i):
+    return f"{i:08d}V"
+
+
+def populate(backend, data_dir, size):
+    """Open a store holding ``size`` voter marks and ballots"""
+    votes_file = os.path.join(data_dir, "legacy_votes.json")
+    users_file = os.path.join(data_dir, "legacy_users.json")
+    with open(votes_file, 'w') as f:
+        json.dump({f"vote_{i}": {"candidate": "A", "timestamp": "", "vote_id": i}
+                   for i in range(1, size + 1)}, f)
+    with open(users_file, 'w') as f:
+        json.dump([_voter_id(i) for i in range(size)], f)
+    if backend == "sqlite":
+        store = SqliteStore(os.path.join(data_dir, "votes.db"))
+    else:
+        store = VoteLog(os.path.join(data_dir, "votes.ndjson"), os.path.join(data_dir, "users.ndjson"))
+    store.import_legacy(votes_file, users_file)
+    return store
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+    return statistics.fmean(samples), pick(0.50), pick(0.99)
+
+
+def time_checks(check, probes):
+    samples = []
+    for user_id in probes:
+        start = time.perf_counter_ns()
+        check(user_id)
+        samples.append((time.perf_counter_ns() - start) / 1000)
+    return percentiles(samples)
+
+
+def run(backend, size, lookups):
+    data_dir = tempfile.mkdtemp(prefix="bench_login_")
+    try:
+        store = populate(backend, data_dir, size)
+        rng = random.Random(size)
+        # Half the probes have voted, half are unknown IDs
+        probes = [_voter_id(rng.randrange(size)) if i % 2 else _voter_id(size + rng.randrange(size))
+                  for i in range(lookups)]
+
+        rows = []
+        if size <= 100000:
+            voted_list = store.voted_users()
+            rows.append(("list scan", time_checks(voted_list.__contains__, probes[:200]), None))
+        rows.append(("store", time_checks(store.has_voted, probes), None))
+
+        start = time.perf_counter()
+        index = VoterIndex(store)
+        warm = time.perf_counter() - start
+        rows.append(("index (set)", time_checks(index.has_voted, probes), (warm, index.nbytes())))
+
+        start = time.perf_counter()
+        bloom = VoterIndex(store, bloom_capacity=size, keep_set=False)
+        warm = time.perf_counter() - start
+        rows.append(("index (bloom)", time_checks(bloom.has_voted, probes), (warm, bloom.nbytes())))
+        store.close()
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    for name, (mean, p50, p99), extra in rows:
+        line = f"{backend:6} {size:>9} {name:14} mean={mean:9.2f}us p50={p50:9.2f}us p99={p99:9.2f}us"
+        if extra:
+            line += f"  warm={extra[0]:.2f}s mem={extra[1] / 1e6:.1f}MB"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="sqlite")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--lookups", type=int, default=20000)
+    args = parser.parse_args(argv)
+    for size in args.sizes:
+        run(args.backend, size, args.lookups)
+
+
+if __name__ == "__main__":
+    main()
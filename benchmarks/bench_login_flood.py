@@ -0,0 +1,225 @@
+"""Legitimate voter latency while a flood of ID guesses hits the API login.
+
+Starts ``api.py`` on a synthetic roll of --voters voters. A legitimate
+client, on its own loopback address (127.0.0.2), logs voters in and
+casts their ballots at a kiosk's pace (--voter-rate per second), while
+--attackers processes hammer ``POST /api/login`` with random IDs from
+--addresses source addresses (127.1.x.y, all on loopback on Linux) over
+keep-alive connections. The run is repeated with the flood off and on,
+and with the login rate limit on and off (``LOGIN_RATE_PER_ADDRESS=0``),
+and reports for each:
+
+- the voter's login and vote latency (p50/p99) and any failures;
+- the flood's requests per second and statuses (404 guessed wrong,
+  429 turned away by the limiter);
+- the server's resident memory before and after, and the clients the
+  limiter tracks (from ``/metrics``).
+
+A second part drives ``ratelimit.RateLimiter`` directly with --keys
+distinct keys to show the cost of a check and that its memory stops
+growing at ``max_keys``.
+
+    python -m benchmarks.bench_login_flood --attackers 2 --addresses 1 500 --seconds 10
+"""
+import argparse
+import csv
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from multiprocessing import Pool
+
+from benchmarks.bench_api import _free_port, _wait_ready
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CANDIDATES = ["Gabriel Oliver", "Gonzalo Ros"]
+VOTER_ADDRESS = "127.0.0.2"
+
+
+def voter_id(i):
+    return f"{i:08d}V"
+
+
+def _attacker(args):
+    """Guess IDs for ``seconds`` from ``addresses``, one keep-alive connection each"""
+    port, addresses, seconds, seed = args
+    rng = random.Random(seed)
+    conns = [http.client.HTTPConnection("127.0.0.1", port, source_address=(address, 0)) for address in addresses]
+    statuses = {}
+    deadline = time.perf_counter() + seconds
+    i = 0
+    while time.perf_counter() < deadline:
+        conn = conns[i % len(conns)]
+        i += 1
+        body = json.dumps({"user_id": f"{rng.randrange(10 ** 8):08d}{rng.choice('ABCDEFGHJKLMNPQRSTVWXYZ')}"})
+        conn.request("POST", "/api/login", body=body, headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        response.read()
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+    for conn in conns:
+        conn.close()
+    return statuses
+
+
+def _post(conn, path, body):
+    start = time.perf_counter()
+    conn.request("POST", path, body=json.dumps(body), headers={"Content-Type": "application/json"})
+    response = conn.getresponse()
+    response.read()
+    return response.status, time.perf_counter() - start
+
+
+def vote_at_pace(port, voters, rate, seconds):
+    """Log in and vote as ``voters`` in turn, ``rate`` voters per second, for ``seconds``"""
+    conn = http.client.HTTPConnection("127.0.0.1", port, source_address=(VOTER_ADDRESS, 0))
+    samples = {"login": [], "vote": []}
+    failures = {}
+    start = time.perf_counter()
+    for n, user_id in enumerate(voters):
+        due = start + n / rate
+        if due > start + seconds:
+            break
+        time.sleep(max(0.0, due - time.perf_counter()))
+        for step, path, body in (("login", "/api/login", {"user_id": user_id}),
+                                 ("vote", "/api/votes", {"user_id": user_id, "candidate": CANDIDATES[n % 2]})):
+            status, elapsed = _post(conn, path, body)
+            samples[step].append(elapsed)
+            if status not in (200, 201):
+                failures[f"{step} {status}"] = failures.get(f"{step} {status}", 0) + 1
+                break
+    conn.close()
+    return samples, failures
+
+
+def server_rss(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def limiter_keys(port):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    conn.request("GET", "/metrics")
+    text = conn.getresponse().read().decode()
+    conn.close()
+    keys = [line.rsplit(" ", 1)[1] for line in text.splitlines()
+            if line.startswith('voting_login_limiter_keys{key="address"}')]
+    return keys[0] if keys else "-"
+
+
+def _p(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] * 1000 if values else float("nan")
+
+
+def run_case(args, roll_path, limited, flood, addresses):
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, VOTER_ROLL=roll_path, VERIFY_TALLY_ON_START="0",
+               LOGIN_RATE_PER_ADDRESS=os.environ.get("LOGIN_RATE_PER_ADDRESS", "10") if limited else "0")
+    with tempfile.TemporaryDirectory(prefix="bench_login_flood_") as data_dir:
+        server = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "api.py"), "--port", str(port)],
+                                  cwd=data_dir, stdout=subprocess.DEVNULL, env=env)
+        try:
+            _wait_ready(url)
+            rss_before = server_rss(server.pid)
+            statuses = {}
+            pool = None
+            if flood:
+                sources = [f"127.1.{n // 250}.{n % 250 + 1}" for n in range(addresses)]
+                pool = Pool(args.attackers)
+                pending = pool.map_async(_attacker, [(port, sources[n::args.attackers] or sources[:1],
+                                                      args.seconds, n) for n in range(args.attackers)])
+                time.sleep(0.5)  # let the flood build up
+            voters = [voter_id(n) for n in range(int(args.voter_rate * args.seconds) + 1)]
+            samples, failures = vote_at_pace(port, voters, args.voter_rate, args.seconds - (0.5 if flood else 0))
+            if pool is not None:
+                for attacker_statuses in pending.get():
+                    for status, count in attacker_statuses.items():
+                        statuses[status] = statuses.get(status, 0) + count
+                pool.close()
+                pool.join()
+            rss_after = server_rss(server.pid)
+            keys = limiter_keys(port)
+        finally:
+            server.terminate()
+            server.wait()
+    flood_label = f"flood from {addresses:5} addresses" if flood else "no flood" + " " * 20
+    print(f"  limit {'on ' if limited else 'off'} {flood_label} "
+          f"login p50={_p(samples['login'], 0.5):6.2f}ms p99={_p(samples['login'], 0.99):7.2f}ms  "
+          f"vote p50={_p(samples['vote'], 0.5):6.2f}ms p99={_p(samples['vote'], 0.99):7.2f}ms  "
+          f"voters={len(samples['login'])} failures={failures or 0}")
+    if flood:
+        print(f"      flood {sum(statuses.values()) / args.seconds:6.0f} req/s statuses={dict(sorted(statuses.items()))}")
+    print(f"      server rss {rss_before / 1e6:.1f}MB -> {rss_after / 1e6:.1f}MB, limiter tracks {keys} addresses")
+
+
+def _spray(limiter, keys, checkpoints=()):
+    """One check (and a failure when let through) from each of ``keys`` new keys"""
+    for n in range(keys):
+        key = f"10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}"
+        if not limiter.retry_after(key):
+            limiter.failed(key)
+        if n + 1 in checkpoints:
+            print(f"  {n + 1:9} keys seen: {len(limiter):7} tracked, {limiter.evictions:8} evicted, "
+                  f"{tracemalloc.get_traced_memory()[0] / 1e6:6.1f}MB")
+
+
+def run_limiter(keys, max_keys):
+    sys.path.insert(0, REPO_DIR)
+    from ratelimit import RateLimiter
+
+    tracemalloc.start()
+    _spray(RateLimiter(10, 50, max_keys=max_keys), keys,
+           {max_keys // 2, max_keys, 2 * max_keys, keys // 2, keys})
+    tracemalloc.stop()
+    limiter = RateLimiter(10, 50, max_keys=max_keys)
+    start = time.perf_counter()
+    _spray(limiter, keys)
+    spread = time.perf_counter() - start
+    for _ in range(200):
+        limiter.failed("attacker")
+    start = time.perf_counter()
+    for _ in range(100000):
+        limiter.retry_after("attacker")
+    rejected = time.perf_counter() - start
+    print(f"  check + failure from a new key {spread / keys * 1e6:.2f}us, "
+          f"turning a locked-out key away {rejected / 100000 * 1e6:.2f}us")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--voters", type=int, default=100000, help="voters on the synthetic roll")
+    parser.add_argument("--voter-rate", type=float, default=5, help="legitimate voters per second")
+    parser.add_argument("--attackers", type=int, default=2, help="flooding client processes")
+    parser.add_argument("--addresses", type=int, nargs="+", default=[1, 500],
+                        help="source addresses the flood rotates through")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--keys", type=int, default=1000000, help="distinct keys fed to the limiter directly")
+    parser.add_argument("--max-keys", type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="bench_login_flood_roll_") as roll_dir:
+        roll_path = os.path.join(roll_dir, "roll.csv")
+        with open(roll_path, 'w', newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["user_id", "name"])
+            writer.writerows((voter_id(i), f"Votante {i}") for i in range(args.voters))
+        print(f"voters={args.voters} voter_rate={args.voter_rate}/s attackers={args.attackers} "
+              f"seconds={args.seconds}")
+        for limited in (True, False):
+            for flood, addresses in [(False, 0)] + [(True, addresses) for addresses in args.addresses]:
+                run_case(args, roll_path, limited, flood, addresses)
+    print(f"limiter alone, max_keys={args.max_keys}:")
+    run_limiter(args.keys, args.max_keys)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Parallel recount of ballot archives against the pool size.
+
+Writes a chained ballot log (with its voter marks and tally checkpoint)
+and a compact ballot file of --ballots ballots each, links them into
+--archives directories (as many archives of the same size), and times:
+
+- the single-threaded recount a store does today (``store.recount()``,
+  after opening it);
+- ``audit.py recount`` over one archive and over all of them, with each
+  of the --processes pool sizes.
+
+Speedups are against one process; they can only grow up to the number of
+cores (printed), and the log recount scales further than the compact one,
+which is bound by memory bandwidth.
+
+    python -m benchmarks.bench_recount --ballots 5000000 --processes 1 2 4 8
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_analytics import CANDIDATES
+from benchmarks.bench_chain import write_chained_log
+from storage import CompactStore, VoteLog
+from storage.compact import HEADER, MAGIC, VERSION, record_dtype
+from storage.recount import compact_archive, log_archive, recount
+
+
+def write_marks(path, count):
+    with open(path, 'wb') as f:
+        for first in range(0, count, 100000):
+            f.write(b"".join(b'"%08dV"\n' % i for i in range(first, min(first + 100000, count))))
+
+
+def write_compact(path, count):
+    records = np.zeros(count, record_dtype())
+    records["vote_id"] = np.arange(1, count + 1)
+    records["timestamp_ms"] = 1767254400000 + np.arange(count)
+    records["candidate"] = (np.arange(1, count + 1) * 7919) % 3 == 0
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, records.dtype.itemsize, 0))
+        f.write(records.tobytes())
+    with open(path + ".candidates", 'wb') as f:
+        f.write(b"".join(json.dumps(name, ensure_ascii=False).encode("utf-8") + b"\n" for name in CANDIDATES[:2]))
+    write_marks(path + ".voters", count)
+
+
+def link_copies(files, root, copies):
+    """``copies`` directories of hard links to ``files``"""
+    directories = []
+    os.mkdir(root)
+    for n in range(copies):
+        directory = os.path.join(root, f"archive-{n}")
+        os.mkdir(directory)
+        for path in files:
+            os.link(path, os.path.join(directory, os.path.basename(path)))
+        directories.append(directory)
+    return directories
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def run(label, archives, baseline, processes, count):
+    print(f"{label}: store.recount() after opening {baseline:.2f}s ({count / baseline:,.0f} ballots/s)")
+    for many in (False, True):
+        subset = archives if many else archives[:1]
+        single = None
+        for pool in processes:
+            reports, elapsed = timed(lambda: recount(subset, pool))
+            assert all(report["ok"] for report in reports), [report["problems"] for report in reports]
+            single = single or elapsed
+            ballots = sum(report["ballots"] for report in reports)
+            print(f"  {len(subset)} archive{'s' if many else ' '} processes={pool:<3} {elapsed:7.2f}s "
+                  f"{ballots / elapsed:12,.0f} ballots/s  speedup {single / elapsed:4.1f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ballots", type=int, default=2000000, help="ballots per archive")
+    parser.add_argument("--archives", type=int, default=4)
+    parser.add_argument("--processes", type=int, nargs="+", default=sorted({1, 2, os.cpu_count() or 1}))
+    args = parser.parse_args(argv)
+
+    root = tempfile.mkdtemp(prefix="bench_recount_")
+    try:
+        print(f"ballots={args.ballots} archives={args.archives} cores={os.cpu_count()}")
+        votes_path = os.path.join(root, "votes.ndjson")
+        write_chained_log(votes_path, args.ballots, 4096)
+        write_marks(os.path.join(root, "users.ndjson"), args.ballots)
+        compact_path = os.path.join(root, "votes.bin")
+        write_compact(compact_path, args.ballots)
+
+        def reopen_log():
+            store = VoteLog(votes_path, os.path.join(root, "users.ndjson"))
+            store.recount()
+            store.close()
+
+        def reopen_compact():
+            store = CompactStore(compact_path)
+            store.recount()
+            store.close()
+
+        baseline = timed(reopen_log)[1]
+        directories = link_copies([votes_path, os.path.join(root, "users.ndjson"), votes_path + ".checkpoint"],
+                                  os.path.join(root, "log"), args.archives)
+        archives = [log_archive(d, os.path.join(d, "votes.ndjson"), os.path.join(d, "users.ndjson")) for d in directories]
+        run("ballot log", archives, baseline, args.processes, args.ballots)
+
+        directories = link_copies([compact_path, compact_path + ".candidates", compact_path + ".voters"],
+                                  os.path.join(root, "compact"), args.archives)
+        archives = [compact_archive(d, os.path.join(d, "votes.bin")) for d in directories]
+        run("compact", archives, timed(reopen_compact)[1], args.processes, args.ballots)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
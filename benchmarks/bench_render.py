@@ -0,0 +1,185 @@
+"""Bytes sent and server CPU spent per interaction with the Streamlit app.
+
+Starts ``streamlit run`` on the app in a scratch data directory (seeded
+with --ballots ballots so the admin charts have data) and talks to it
+over its websocket like a browser would: it clicks buttons, types IDs and
+picks options by sending the widget states, including the fragment id
+when the widget lives in a fragment. For each interaction it counts the
+websocket bytes the server sends until the run finishes, and the server
+process's CPU time (user + system), averaged over --repeat rounds.
+
+Compare against an older revision by pointing --app at its checkout:
+
+    git worktree add /tmp/before <rev>
+    python -m benchmarks.bench_render --app /tmp/before/app.py
+    python -m benchmarks.bench_render
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from websockets.sync.client import connect
+
+from benchmarks.bench_api import _free_port
+from storage import VoteLog
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VOTER_ID = "41607985L"
+ADMIN_ID = "46151901D"
+CANDIDATES = ["Gabriel Oliver", "Gonzalo Ros"]
+DONE = (ForwardMsg.FINISHED_SUCCESSFULLY, ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY,
+        ForwardMsg.FINISHED_WITH_COMPILE_ERROR)
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+class Browser:
+    """Just enough of the Streamlit frontend to drive widgets over the websocket"""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.widgets = {}  # label -> (kind, widget id, fragment id)
+        self.values = {}  # widget id -> WidgetState for widgets holding a value
+
+    def _run(self, widget_states=(), fragment_id=""):
+        msg = BackMsg()
+        state = msg.rerun_script
+        state.query_string = ""
+        state.page_script_hash = ""
+        state.fragment_id = fragment_id
+        state.widget_states.widgets.extend(list(self.values.values()) + list(widget_states))
+        self.ws.send(msg.SerializeToString())
+        received = 0
+        while True:
+            data = self.ws.recv()
+            received += len(data)
+            fmsg = ForwardMsg()
+            fmsg.ParseFromString(data)
+            kind = fmsg.WhichOneof("type")
+            if kind == "delta" and fmsg.delta.WhichOneof("type") == "new_element":
+                element = fmsg.delta.new_element
+                widget = element.WhichOneof("type")
+                proto = getattr(element, widget)
+                if hasattr(proto, "id") and hasattr(proto, "label"):
+                    self.widgets[proto.label] = (widget, proto.id, fmsg.delta.fragment_id)
+            elif kind == "script_finished" and fmsg.script_finished in DONE:
+                return received
+
+    def load(self):
+        return self._run()
+
+    def _find(self, label):
+        return next(widget for name, widget in self.widgets.items() if label in name)
+
+    def has(self, label):
+        return any(label in name for name in self.widgets)
+
+    def set(self, label, value):
+        """Set a text, radio or select widget without submitting anything"""
+        _, widget_id, _ = self._find(label)
+        self.values[widget_id] = WidgetState(id=widget_id, string_value=value)
+
+    def click(self, label):
+        _, widget_id, fragment_id = self._find(label)
+        return self._run([WidgetState(id=widget_id, trigger_value=True)], fragment_id)
+
+    def choose(self, label, value):
+        """Pick an option; the widget reruns the app (or its fragment) right away"""
+        _, widget_id, fragment_id = self._find(label)
+        self.values[widget_id] = WidgetState(id=widget_id, string_value=value)
+        return self._run(fragment_id=fragment_id)
+
+
+def measure(pid, label, action, repeat):
+    sent = 0
+    cpu = cpu_seconds(pid)
+    start = time.perf_counter()
+    for i in range(repeat):
+        sent += action(i)
+    elapsed = time.perf_counter() - start
+    cpu = cpu_seconds(pid) - cpu
+    print(f"  {label:34} {sent / repeat / 1024:8.1f} KiB/interaction "
+          f"{cpu / repeat * 1000:7.1f} ms CPU {elapsed / repeat * 1000:7.1f} ms wall")
+    return {"bytes": sent / repeat, "cpu": cpu / repeat}
+
+
+def scenario(url, pid, repeat):
+    with connect(url, max_size=None) as ws:
+        browser = Browser(ws)
+        measure(pid, "first page load", lambda i: browser.load(), 1)
+        browser.set("ID de Usuario", "00000000X")
+        measure(pid, "login with an invalid ID", lambda i: browser.click("INGRESAR"), repeat)
+        browser.set("ID de Usuario", VOTER_ID)
+        measure(pid, "login", lambda i: browser.click("INGRESAR"), 1)
+        measure(pid, "vote without a candidate", lambda i: browser.click("CONFIRMAR"), repeat)
+        measure(pid, "open the admin panel", lambda i: browser.click("Panel Admin"), 1)
+        browser.set("Ingrese su ID", ADMIN_ID)
+        measure(pid, "admin login", lambda i: browser.click("Acceder"), 1)
+        # Revisions without a refresh button only had the whole page to rerun
+        refresh = ((lambda i: browser.click("Actualizar Resultados")) if browser.has("Actualizar Resultados")
+                   else (lambda i: browser.load()))
+        measure(pid, "refresh the tally", refresh, repeat)
+        measure(pid, "audit the tally", lambda i: browser.click("Auditar Recuento"), repeat)
+        measure(pid, "switch the export dataset", lambda i: browser.choose(
+            "Datos a exportar", ["tally", "ballots"][i % 2]), repeat)
+
+
+def seed(data_dir, ballots):
+    store = VoteLog(os.path.join(data_dir, "votes_runoff.ndjson"), os.path.join(data_dir, "users_runoff.ndjson"))
+    for start in range(0, ballots, 1000):
+        store.record_votes([(f"seed-{i}", CANDIDATES[i % 3 == 0]) for i in range(start, min(start + 1000, ballots))])
+    store.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", default=os.path.join(REPO_DIR, "app.py"))
+    parser.add_argument("--ballots", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+    app_path = os.path.abspath(args.app)
+
+    data_dir = tempfile.mkdtemp(prefix="bench_render_")
+    port = _free_port()
+    server = None
+    try:
+        seed(data_dir, args.ballots)
+        server = subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", app_path, "--server.headless", "true",
+             "--server.port", str(port), "--browser.gatherUsageStats", "false",
+             "--server.fileWatcherType", "none"],
+            cwd=data_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            env=dict(os.environ, VERIFY_TALLY_ON_START="0",
+                     LOGIN_RATE_PER_SESSION="0", LOGIN_RATE_PER_ADDRESS="0"))
+        url = f"ws://127.0.0.1:{port}/_stcore/stream"
+        deadline = time.time() + 60
+        while True:
+            try:
+                with connect(url):
+                    break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.2)
+        print(f"app={app_path} ballots={args.ballots} repeat={args.repeat}")
+        scenario(url, server.pid, args.repeat)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
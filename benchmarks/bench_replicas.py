@@ -0,0 +1,190 @@
+"""Several API replicas sharing one vote ledger: throughput and no double votes.
+
+Starts a vote ledger (``ledger.py``) and, for each count in --replicas,
+that many ``api.py`` replicas, each in its own empty data directory and
+pointed at the ledger (``VOTING_STORAGE=remote``). Client processes then
+hammer the replicas round robin: every voter in a synthetic roll is sent
+to two different replicas at once, so half of all attempts race another
+replica for the same voter. The run fails unless every voter ends up
+with exactly one ballot on the ledger.
+
+Aggregate throughput grows with the replicas while the front ends are
+the bottleneck (parsing, validation, HTTP); the ledger commits every
+replica's ballots in one group-commit queue. On a machine with fewer
+cores than replicas plus clients the processes only take turns, and the
+numbers show the coordination overhead rather than the scaling.
+
+    python -m benchmarks.bench_replicas --replicas 1 2 4 --voters 20000
+    python -m benchmarks.bench_replicas --backend sqlite
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import Pool
+from urllib.parse import urlsplit
+
+from benchmarks.bench_api import _free_port, _wait_ready
+from storage import RemoteStore
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CANDIDATES = ["Gabriel Oliver", "Gonzalo Ros"]
+TOKEN = "bench-replicas"
+
+
+def _client(args):
+    """Cast ``attempts`` [(replica url, voter id)] over ``threads`` keep-alive connections"""
+    attempts, threads = args
+    statuses = {}
+    lock = threading.Lock()
+
+    def worker(chunk):
+        conns = {}
+        counts = {}
+        for url, user_id in chunk:
+            conn = conns.get(url)
+            if conn is None:
+                parts = urlsplit(url)
+                conn = conns[url] = http.client.HTTPConnection(parts.hostname, parts.port)
+            body = json.dumps({"user_id": user_id, "candidate": CANDIDATES[int(user_id[:8]) % 2]})
+            try:
+                conn.request("POST", "/api/votes", body=body, headers={"Content-Type": "application/json"})
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except OSError as e:
+                conn.close()
+                del conns[url]
+                status = type(e).__name__
+            counts[status] = counts.get(status, 0) + 1
+        for conn in conns.values():
+            conn.close()
+        with lock:
+            for status, count in counts.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    pool = [threading.Thread(target=worker, args=(attempts[n::threads],)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return statuses
+
+
+def start_ledger(root, backend):
+    """Run ``ledger.py`` on a free port; returns ``(url, process, RemoteStore of the default store)``"""
+    port = _free_port()
+    ledger_url = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, "ledger.py"), "--data-dir", os.path.join(root, "ledger"),
+         "--port", str(port), "--backend", backend, "--token", TOKEN],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    ledger = RemoteStore(ledger_url, "default", TOKEN)
+    deadline = time.time() + 30
+    while True:
+        try:
+            ledger.vote_count()
+            return ledger_url, process, ledger
+        except Exception:
+            if time.time() > deadline:
+                process.terminate()
+                raise
+            time.sleep(0.1)
+
+
+def start_replicas(count, root, ledger_url, roll_path):
+    replicas = []
+    env = dict(os.environ, VOTING_STORAGE="remote", VOTING_LEDGER_URL=ledger_url, VOTING_LEDGER_TOKEN=TOKEN,
+               VOTER_ROLL=roll_path, VERIFY_TALLY_ON_START="0")
+    for n in range(count):
+        data_dir = os.path.join(root, f"replica-{n}")
+        os.makedirs(data_dir)
+        port = _free_port()
+        process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "api.py"), "--port", str(port)],
+                                   cwd=data_dir, env=env, stdout=subprocess.DEVNULL)
+        replicas.append((f"http://127.0.0.1:{port}", process))
+    for url, _ in replicas:
+        _wait_ready(url)
+    return replicas
+
+
+def run(replica_urls, ledger, voters, clients, threads):
+    voter_ids = [f"{i:08d}R" for i in range(voters)]
+    attempts = []
+    for i, user_id in enumerate(voter_ids):
+        attempts.append((replica_urls[i % len(replica_urls)], user_id))
+        attempts.append((replica_urls[(i + 1) % len(replica_urls)], user_id))
+    start = time.perf_counter()
+    with Pool(clients) as pool:
+        outcomes = pool.map(_client, [(attempts[n::clients], threads) for n in range(clients)])
+    elapsed = time.perf_counter() - start
+
+    statuses = {}
+    for client_statuses in outcomes:
+        for status, count in client_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+    accepted = statuses.get(201, 0)
+    marked = ledger.voted_users()
+    problems = []
+    if accepted != voters:
+        problems.append(f"{accepted} ballots accepted for {voters} voters")
+    if ledger.vote_count() != voters:
+        problems.append(f"{ledger.vote_count()} ballots on the ledger for {voters} voters")
+    if len(marked) != len(set(marked)) or set(marked) != set(voter_ids):
+        problems.append(f"{len(marked)} voter marks, {len(set(marked))} distinct")
+    if set(statuses) - {201, 409}:
+        problems.append(f"unexpected statuses {statuses}")
+    print(f"  replicas={len(replica_urls)} attempts={len(attempts)} accepted={accepted} "
+          f"rejected={statuses.get(409, 0)} elapsed={elapsed:.2f}s "
+          f"{len(attempts) / elapsed:7.0f} attempts/s {accepted / elapsed:7.0f} ballots/s")
+    for problem in problems:
+        print(f"  FAIL: {problem}")
+    return not problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--replicas", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--voters", type=int, default=5000)
+    parser.add_argument("--clients", type=int, default=4, help="client processes")
+    parser.add_argument("--threads", type=int, default=8, help="connections per client")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    args = parser.parse_args(argv)
+
+    root = tempfile.mkdtemp(prefix="bench_replicas_")
+    ledger_process = None
+    ok = True
+    try:
+        roll_path = os.path.join(root, "roll.csv")
+        with open(roll_path, 'w') as f:
+            f.write("user_id,name\n")
+            f.writelines(f"{i:08d}R,Votante {i}\n" for i in range(args.voters))
+        ledger_url, ledger_process, ledger = start_ledger(root, args.backend)
+
+        print(f"backend={args.backend} voters={args.voters} clients={args.clients}x{args.threads} "
+              f"cores={os.cpu_count()}")
+        for count in args.replicas:
+            ledger.clear()
+            replicas = start_replicas(count, os.path.join(root, f"run-{count}"), ledger_url, roll_path)
+            try:
+                ok = run([url for url, _ in replicas], ledger, args.voters, args.clients, args.threads) and ok
+            finally:
+                for _, process in replicas:
+                    process.terminate()
+                    process.wait()
+    finally:
+        if ledger_process is not None:
+            ledger_process.terminate()
+            ledger_process.wait()
+        shutil.rmtree(root, ignore_errors=True)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
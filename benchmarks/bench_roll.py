@@ -0,0 +1,91 @@
+"""Startup time, resident memory and lookup latency of the voter roll.
+
+For each roll size a synthetic CSV roll is generated and imported with
+``roll.import_roll``. A fresh process then loads the roll the way
+``core`` does, once from the CSV (a dict, as the built-in roll) and once
+from the imported SQLite file, and reports load time, peak RSS and
+eligibility/name lookup latency.
+
+    python -m benchmarks.bench_roll --sizes 1000000 5000000
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _measure(path, size):
+    """Runs in a child process so RSS covers only this roll"""
+    sys.path.insert(0, REPO_DIR)
+    from roll import load_roll
+
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    voters = load_roll(path)
+    first = "00000000V" in voters
+    startup = time.perf_counter() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss
+
+    rng = random.Random(0)
+    probes = [f"{rng.randrange(size * 2):08d}V" for _ in range(20000)]
+    samples = []
+    for user_id in probes:
+        t = time.perf_counter_ns()
+        if user_id in voters:
+            voters[user_id]
+        samples.append((time.perf_counter_ns() - t) / 1000)
+    samples.sort()
+    print(json.dumps({"startup": startup, "rss_kb": rss, "first": first,
+                      "p50_us": samples[len(samples) // 2], "p99_us": samples[int(len(samples) * 0.99)]}))
+
+
+def run(size, data_dir):
+    csv_path = os.path.join(data_dir, f"roll_{size}.csv")
+    db_path = os.path.join(data_dir, f"roll_{size}.db")
+    with open(csv_path, 'w') as f:
+        f.write("user_id,name\n")
+        for i in range(size):
+            f.write(f"{i:08d}V,Votante {i}\n")
+
+    sys.path.insert(0, REPO_DIR)
+    from roll import import_roll
+    start = time.perf_counter()
+    import_roll(csv_path, db_path)
+    import_time = time.perf_counter() - start
+    print(f"size={size} import={import_time:.1f}s db={os.path.getsize(db_path) / 1e6:.0f}MB")
+
+    for label, path in (("csv->dict", csv_path), ("sqlite", db_path)):
+        out = subprocess.run([sys.executable, "-m", "benchmarks.bench_roll", "--measure", path, str(size)],
+                             cwd=REPO_DIR, capture_output=True, text=True, check=True)
+        r = json.loads(out.stdout)
+        print(f"  {label:10} startup={r['startup'] * 1000:9.1f}ms rss=+{r['rss_kb'] / 1024:7.1f}MB "
+              f"lookup p50={r['p50_us']:.1f}us p99={r['p99_us']:.1f}us")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000000, 5000000])
+    parser.add_argument("--measure", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.measure:
+        _measure(args.measure[0], int(args.measure[1]))
+        return
+
+    data_dir = tempfile.mkdtemp(prefix="bench_roll_")
+    try:
+        for size in args.sizes:
+            run(size, data_dir)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
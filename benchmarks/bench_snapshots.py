@@ -0,0 +1,127 @@
+"""Time of snapshots, resets and restores against the number of ballots.
+
+For each --ballots count and --backends backend, casts that many ballots
+into a fresh election (the default election's layout, files in the data
+directory) and times:
+
+- the old destructive reset (``store.clear()``) and the old way of
+  reading archived data (parsing every ballot);
+- a snapshot, a reset (which now moves the ballots to a snapshot) and
+  the comparison data of an archived snapshot (``snapshot.json`` only);
+- restoring the reset snapshot (hard links back) and then a snapshot
+  whose files were appended to since (a prefix clone), each with the
+  first tally read afterwards, which reopens the store.
+
+It also reports the disk the snapshots add, counting each linked inode once.
+
+    python -m benchmarks.bench_snapshots --ballots 100000 1000000 --backends json compact
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CANDIDATES = ["Gabriel Oliver", "Gonzalo Ros", "Ana Martín"]
+FILES = {"votes": "votes.ndjson", "users": "users.ndjson", "sqlite": "votes.db", "compact": "votes.bin"}
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def voter_id(i):
+    return f"{i:08d}V"
+
+
+def cast(store, start, end):
+    for first in range(start, end, 10000):
+        store.record_votes([(voter_id(i), CANDIDATES[i % 3]) for i in range(first, min(first + 10000, end))])
+
+
+def disk_usage(root):
+    """Bytes under ``root``, each inode counted once"""
+    seen = set()
+    total = 0
+    for directory, _, names in os.walk(root):
+        for name in names:
+            st = os.stat(os.path.join(directory, name))
+            if (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                total += st.st_size
+    return total
+
+
+def open_election(data_dir, backend):
+    from elections import Election
+
+    return Election({"id": "bench", "candidates": CANDIDATES}, data_dir, valid_users={}, files=FILES,
+                    settings={"backend": backend, "verify_tally_on_start": False})
+
+
+def run(count, backend, root):
+    data_dir = tempfile.mkdtemp(prefix=f"{backend}_", dir=root)
+    election = open_election(data_dir, backend)
+    _, elapsed = _timed(cast, election.store(), 0, count)
+    print(f"ballots={count} backend={backend} cast in {elapsed:.1f}s, "
+          f"store {disk_usage(data_dir) / 1e6:.1f}MB")
+    row = []
+
+    # Before: a reset deleted the files, and reading archived data parsed every ballot
+    copy_dir = data_dir + "-old"
+    shutil.copytree(data_dir, copy_dir)
+    old = open_election(copy_dir, backend)
+    _, parse = _timed(lambda: {f"vote_{vote['vote_id']}": vote for vote in old.store().iter_votes()})
+    _, clear = _timed(old.store().clear)
+    old.close()
+    shutil.rmtree(copy_dir)
+    row.append(f"old clear {clear * 1000:8.1f}ms  parse all {parse * 1000:8.1f}ms")
+
+    before = disk_usage(data_dir)
+    manual, snapshot = _timed(election.take_snapshot, "bench")
+    _, reset = _timed(election.clear_all_votes)
+    reset_snapshot = election.snapshots()[0]
+    # A fresh object, as the admin panel has after a rerun: only the picked snapshot is read
+    _, compare = _timed(lambda: election.get_snapshot(reset_snapshot.name).meta["results"])
+    row.append(f"snapshot {snapshot * 1000:6.1f}ms  reset {reset * 1000:6.1f}ms  "
+               f"compare {compare * 1000:6.2f}ms  (+{(disk_usage(data_dir) - before) / 1e6:.2f}MB)")
+
+    _, restore = _timed(election.restore_snapshot, reset_snapshot.name)
+    _, reopen = _timed(election.get_results)
+    assert election.store().vote_count() == count
+    row.append(f"restore by link {restore * 1000:6.1f}ms + reopen {reopen * 1000:7.1f}ms")
+
+    cast(election.store(), count, count + 1000)
+    _, restore = _timed(election.restore_snapshot, manual.name)
+    _, reopen = _timed(election.get_results)
+    assert election.store().vote_count() == count
+    row.append(f"restore by clone {restore * 1000:6.1f}ms + reopen {reopen * 1000:7.1f}ms  "
+               f"snapshots hold {disk_usage(election.snapshots_dir()) / 1e6:.1f}MB, "
+               f"all files {disk_usage(data_dir) / 1e6:.1f}MB")
+    election.close()
+    for line in row:
+        print(f"  {line}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ballots", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--backends", nargs="+", choices=("json", "sqlite", "compact"), default=["json", "compact"])
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, REPO_DIR)
+    root = tempfile.mkdtemp(prefix="bench_snapshots_")
+    try:
+        for count in args.ballots:
+            for backend in args.backends:
+                run(count, backend, root)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Tabulation time for plurality, IRV and Borda over large ranked electorates.
+
+Generates random ranked ballots (each voter ranks a random number of
+candidates, with a few popular candidates favoured), encodes them with
+``tabulation.encode_ballots`` and times every method. The vectorized IRV
+is checked against a plain Python IRV that loops over every ballot each
+round, which is also timed on a subset. Finally the same ballots are fed
+to ``StreamingTally`` in chunks, reporting the cost of each partial result.
+
+    python -m benchmarks.bench_tabulate --ballots 1000000 --candidates 12
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_rankings(n_ballots, candidates, seed=0):
+    rng = np.random.default_rng(seed)
+    # Skewed preferences: sort candidates by a noisy popularity score
+    popularity = rng.normal(size=len(candidates))
+    order = np.argsort(-(popularity + rng.gumbel(size=(n_ballots, len(candidates)))), axis=1)
+    lengths = rng.integers(1, len(candidates) + 1, size=n_ballots)
+    return [[candidates[i] for i in row[:length]] for row, length in zip(order.tolist(), lengths.tolist())]
+
+
+def python_irv(rankings, candidates):
+    """Reference IRV: one Python pass over every ballot per round"""
+    eliminated = set()
+    first_round = None
+    while True:
+        counts = {candidate: 0 for candidate in candidates if candidate not in eliminated}
+        for ranking in rankings:
+            for candidate in ranking:
+                if candidate not in eliminated:
+                    counts[candidate] += 1
+                    break
+        if first_round is None:
+            first_round = dict(counts)
+        leader = max(counts, key=counts.get)
+        if counts[leader] * 2 > sum(counts.values()) or len(counts) <= 2:
+            return leader
+        loser = min(counts, key=lambda c: (counts[c], first_round[c], -candidates.index(c)))
+        eliminated.add(loser)
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ballots", type=int, default=1000000)
+    parser.add_argument("--candidates", type=int, default=12)
+    parser.add_argument("--reference-ballots", type=int, default=100000,
+                        help="ballots for the pure Python IRV comparison")
+    parser.add_argument("--chunk", type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, REPO_DIR)
+    from tabulation import TABULATORS, StreamingTally, encode_ballots
+
+    candidates = [f"Candidato {i}" for i in range(args.candidates)]
+    rankings, elapsed = _timed(make_rankings, args.ballots, candidates)
+    print(f"generated {args.ballots} ballots over {args.candidates} candidates in {elapsed:.1f}s")
+
+    ballots, elapsed = _timed(encode_ballots, rankings, candidates)
+    print(f"encode        {elapsed:7.2f}s  matrix={ballots.nbytes / 1e6:.0f}MB")
+    for method, tabulate in TABULATORS.items():
+        result, elapsed = _timed(tabulate, ballots, candidates)
+        print(f"{method:13} {elapsed:7.2f}s  rounds={len(result['rounds'])} winner={result['winner']}")
+
+    subset = rankings[:args.reference_ballots]
+    fast, fast_time = _timed(TABULATORS["irv"], encode_ballots(subset, candidates), candidates)
+    slow, slow_time = _timed(python_irv, subset, candidates)
+    assert fast["winner"] in (slow, None), (fast["winner"], slow)
+    print(f"irv on {len(subset)} ballots: vectorized {fast_time:.3f}s, python loop {slow_time:.2f}s "
+          f"({slow_time / fast_time:.0f}x)")
+
+    for method in TABULATORS:
+        streaming = StreamingTally(candidates, method)
+        partial_times = []
+        for start in range(0, args.ballots, args.chunk):
+            streaming.add(ballots[start:start + args.chunk])
+            _, elapsed = _timed(streaming.result)
+            partial_times.append(elapsed)
+        assert streaming.result()["counts"] == TABULATORS[method](ballots, candidates)["counts"]
+        print(f"streaming {method:9} {len(partial_times)} partial results, "
+              f"mean {np.mean(partial_times) * 1000:.1f}ms, last {partial_times[-1] * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
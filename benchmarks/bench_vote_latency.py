@@ -0,0 +1,104 @@
+"""End-to-end latency of the Streamlit login and vote flow.
+
+Drives app.py headlessly with Streamlit's AppTest: every voter in the roll
+logs in, picks a candidate and confirms, all voters at once from separate
+worker processes sharing one data directory. Each round starts from an
+empty data directory so the roll can vote again. Reports p50/p99 for the
+login step, the vote step and the whole flow.
+
+Compare against an older revision by pointing --app at its checkout:
+
+    git worktree add /tmp/before <rev>
+    python -m benchmarks.bench_vote_latency --app /tmp/before/app.py
+    python -m benchmarks.bench_vote_latency
+"""
+import argparse
+import ast
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+
+def _click(at, label):
+    next(b for b in at.button if label in b.label).click()
+    at.run()
+
+
+def _init_worker(app_path, data_dir):
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    os.chdir(data_dir)
+    sys.path.insert(0, os.path.dirname(app_path))
+
+
+def _flow(args):
+    app_path, user_id, candidate, start_at = args
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(app_path, default_timeout=60)
+    at.run()
+    # Line the workers up so every voter is in flight at the same time
+    time.sleep(max(0.0, start_at - time.time()))
+    start = time.perf_counter()
+    at.text_input(key="user_login").input(user_id)
+    _click(at, "INGRESAR")
+    logged_in = time.perf_counter()
+    at.radio[0].set_value(candidate)
+    _click(at, "CONFIRMAR")
+    voted = time.perf_counter()
+    if not at.session_state.vote_submitted:
+        return {"error": f"{user_id}: {[e.value for e in at.error]}"}
+    return {"login": logged_in - start, "vote": voted - logged_in, "flow": voted - start}
+
+
+def read_roll(app_path):
+    """Voter IDs and candidates declared in the app source"""
+    core_path = os.path.join(os.path.dirname(app_path), "core.py")
+    with open(core_path if os.path.exists(core_path) else app_path) as f:
+        tree = ast.parse(f.read())
+    literals = {node.targets[0].id: node.value for node in tree.body
+                if isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name)}
+    return list(ast.literal_eval(literals["VALID_USERS"])), ast.literal_eval(literals["RUNOFF_CANDIDATES"])
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py"))
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args(argv)
+    app_path = os.path.abspath(args.app)
+    roll, candidates = read_roll(app_path)
+
+    samples = []
+    errors = []
+    ctx = multiprocessing.get_context("spawn")
+    for _ in range(args.rounds):
+        with tempfile.TemporaryDirectory(prefix="bench_vote_latency_") as data_dir:
+            with ctx.Pool(len(roll), initializer=_init_worker, initargs=(app_path, data_dir)) as pool:
+                start_at = time.time() + 5
+                jobs = [(app_path, user_id, candidates[i % len(candidates)], start_at)
+                        for i, user_id in enumerate(roll)]
+                for result in pool.map(_flow, jobs):
+                    if "error" in result:
+                        errors.append(result["error"])
+                    else:
+                        samples.append(result)
+
+    print(f"app={app_path} flows={len(samples)} failed={len(errors)}")
+    for error in errors:
+        print(f"  {error}")
+    for step in ("login", "vote", "flow"):
+        values = [s[step] * 1000 for s in samples]
+        if values:
+            print(f"{step:6} p50={percentile(values, 0.50):8.1f}ms p99={percentile(values, 0.99):8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
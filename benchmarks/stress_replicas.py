@@ -0,0 +1,165 @@
+"""Stress test several API replicas voting through one vote ledger.
+
+Starts a ledger (``ledger.py``) and ``--replicas`` ``api.py`` replicas
+pointed at it, then sends every voter of the round to two different
+replicas at once, so half of all attempts race another replica for the
+same voter. Between rounds the ledger store is reset, and round ``r``
+only votes every ``r``-th voter. The run fails unless, after each round:
+
+- each voter got exactly one 201, and every other attempt a 409
+- the ledger holds one voter mark per voter and ballots numbered 1..N
+- the ledger's tally, its recount and every replica's ``/api/results``
+  equal the ballots cast
+- every replica turns this round's voters away at login and lets the
+  others in, so a reset made elsewhere is seen too
+
+    python -m benchmarks.stress_replicas --replicas 3 --voters 2000
+    python -m benchmarks.stress_replicas --backend sqlite --rounds 3
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+from collections import Counter
+from multiprocessing import Pool
+from urllib.parse import urlsplit
+
+from benchmarks.bench_replicas import CANDIDATES, _client, start_ledger, start_replicas
+
+ADMIN_ID = "stress-admin"
+
+
+def _candidate(user_id):
+    # The candidate benchmarks.bench_replicas._client votes for
+    return CANDIDATES[int(user_id[:8]) % 2]
+
+
+def _replica_view(url, voted, not_voted):
+    """``(results, wrong logins)`` as seen by the replica at ``url``"""
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+    try:
+        conn.request("GET", "/api/results", headers={"X-Admin-Id": ADMIN_ID})
+        response = conn.getresponse()
+        results = json.loads(response.read()).get("results")
+        wrong = []
+        for user_id, expected in [(user_id, 409) for user_id in voted] + [(user_id, 200) for user_id in not_voted]:
+            conn.request("POST", "/api/login", body=json.dumps({"user_id": user_id}),
+                         headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response.read()
+            if response.status != expected:
+                wrong.append((user_id, response.status, expected))
+        return results, wrong
+    finally:
+        conn.close()
+
+
+def run_round(number, replica_urls, ledger, voter_ids, clients, threads, login_checks):
+    """One round over every ``number``-th voter; returns the problems found"""
+    voters = voter_ids[::number]
+    attempts = []
+    for i, user_id in enumerate(voters):
+        attempts.append((replica_urls[i % len(replica_urls)], user_id))
+        attempts.append((replica_urls[(i + 1) % len(replica_urls)], user_id))
+    with Pool(clients) as pool:
+        outcomes = pool.map(_client, [(attempts[n::clients], threads) for n in range(clients)])
+    statuses = Counter()
+    for client_statuses in outcomes:
+        statuses.update(client_statuses)
+
+    problems = []
+    if statuses[201] != len(voters):
+        problems.append(f"{statuses[201]} ballots accepted for {len(voters)} voters")
+    if set(statuses) - {201, 409}:
+        problems.append(f"unexpected statuses {dict(statuses)}")
+    marked = ledger.voted_users()
+    if len(marked) != len(set(marked)) or set(marked) != set(voters):
+        problems.append(f"{len(marked)} voter marks on the ledger, {len(set(marked))} distinct, "
+                        f"for {len(voters)} voters")
+    vote_ids = [vote["vote_id"] for vote in ledger.iter_votes()]
+    if vote_ids != list(range(1, len(voters) + 1)):
+        problems.append(f"ballot ids not unique/contiguous ({len(vote_ids)} ballots, {len(set(vote_ids))} distinct)")
+
+    expected = {candidate: 0 for candidate in CANDIDATES}
+    expected.update(Counter(_candidate(user_id) for user_id in voters))
+    tally = {candidate: ledger.tally().get(candidate, 0) for candidate in CANDIDATES}
+    recount = {candidate: ledger.recount().get(candidate, 0) for candidate in CANDIDATES}
+    if tally != expected:
+        problems.append(f"ledger tally {tally}, expected {expected}")
+    if recount != expected:
+        problems.append(f"ledger recount {recount}, expected {expected}")
+
+    rng = random.Random(number)
+    voted = rng.sample(voters, min(login_checks, len(voters)))
+    others = sorted(set(voter_ids) - set(voters))
+    not_voted = rng.sample(others, min(login_checks, len(others)))
+    for url in replica_urls:
+        results, wrong = _replica_view(url, voted, not_voted)
+        if results != expected:
+            problems.append(f"{url} reports {results}, expected {expected}")
+        for user_id, status, want in wrong[:5]:
+            problems.append(f"{url} answers {status} at login for {user_id}, expected {want}")
+        if len(wrong) > 5:
+            problems.append(f"{url} gives {len(wrong) - 5} more wrong login answers")
+
+    print(f"round={number} voters={len(voters)} attempts={len(attempts)} "
+          f"accepted={statuses[201]} rejected_duplicates={statuses[409]} tally={tally}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument("--voters", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--clients", type=int, default=4, help="client processes")
+    parser.add_argument("--threads", type=int, default=8, help="connections per client")
+    parser.add_argument("--login-checks", type=int, default=100,
+                        help="voters (and non-voters) each replica is asked about per round")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    args = parser.parse_args(argv)
+    if args.replicas < 2:
+        parser.error("--replicas must be at least 2")
+
+    root = tempfile.mkdtemp(prefix="stress_replicas_")
+    processes = []
+    problems = []
+    # Logins are checked in bulk from one address
+    os.environ.update(LOGIN_RATE_PER_ADDRESS="0", ADMIN_ID=ADMIN_ID)
+    try:
+        voter_ids = [f"{i:08d}R" for i in range(args.voters)]
+        roll_path = os.path.join(root, "roll.csv")
+        with open(roll_path, 'w') as f:
+            f.write("user_id,name\n")
+            f.writelines(f"{user_id},Votante {i}\n" for i, user_id in enumerate(voter_ids))
+        ledger_url, ledger_process, ledger = start_ledger(root, args.backend)
+        processes.append(ledger_process)
+        replicas = start_replicas(args.replicas, os.path.join(root, "replicas"), ledger_url, roll_path)
+        processes.extend(process for _, process in replicas)
+
+        print(f"backend={args.backend} replicas={args.replicas} voters={args.voters} "
+              f"clients={args.clients}x{args.threads}")
+        for number in range(1, args.rounds + 1):
+            if number > 1:
+                ledger.reset()
+            problems = run_round(number, [url for url, _ in replicas], ledger, voter_ids,
+                                 args.clients, args.threads, args.login_checks)
+            if problems:
+                break
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(root, ignore_errors=True)
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""Stress test concurrent vote commits across processes and threads.
+
+Every voter is handed to two different workers, so half of all attempts are
+races for the same voter. The run fails unless every voter ends up with
+exactly one ballot and ballot numbers are unique and contiguous.
+
+    python -m benchmarks.stress_votes --processes 8 --threads 16 --voters 2000
+    python -m benchmarks.stress_votes --backend sqlite
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+
+from storage import AlreadyVotedError, SqliteStore, VoteLog
+
+CANDIDATES = ["Gabriel Oliver", "Gonzalo Ros"]
+
+
+def _open(backend, data_dir):
+    if backend == "sqlite":
+        return SqliteStore(os.path.join(data_dir, "votes.db"))
+    return VoteLog(os.path.join(data_dir, "votes.ndjson"), os.path.join(data_dir, "users.ndjson"))
+
+
+def _worker(args):
+    backend, data_dir, voter_ids, threads = args
+    store = _open(backend, data_dir)
+
+    def cast(voter_id):
+        try:
+            store.record_vote(voter_id, CANDIDATES[int(voter_id[:8]) % len(CANDIDATES)])
+            return True
+        except AlreadyVotedError:
+            return False
+
+    with ThreadPoolExecutor(threads) as pool:
+        accepted = sum(pool.map(cast, voter_ids))
+    store.close()
+    return accepted, len(voter_ids) - accepted
+
+
+def run(backend, processes, threads, voters, data_dir):
+    voter_ids = [f"{i:08d}X" for i in range(voters)]
+    shards = [[] for _ in range(processes)]
+    for i, voter_id in enumerate(voter_ids):
+        shards[i % processes].append(voter_id)
+        shards[(i + 1) % processes].append(voter_id)
+
+    start = time.perf_counter()
+    with Pool(processes) as pool:
+        outcomes = pool.map(_worker, [(backend, data_dir, shard, threads) for shard in shards])
+    elapsed = time.perf_counter() - start
+
+    accepted = sum(a for a, _ in outcomes)
+    rejected = sum(r for _, r in outcomes)
+    store = _open(backend, data_dir)
+    vote_ids = sorted(vote["vote_id"] for vote in store.iter_votes())
+    marked = store.voted_users()
+
+    problems = []
+    if accepted != voters:
+        problems.append(f"{accepted} ballots accepted for {voters} voters")
+    if vote_ids != list(range(1, voters + 1)):
+        problems.append(f"ballot ids not unique/contiguous ({len(vote_ids)} ballots, {len(set(vote_ids))} distinct)")
+    if len(marked) != len(set(marked)) or set(marked) != set(voter_ids):
+        problems.append(f"{len(marked)} voter marks, {len(set(marked))} distinct")
+
+    attempts = accepted + rejected
+    print(f"backend={backend} processes={processes} threads/process={threads} voters={voters}")
+    print(f"attempts={attempts} accepted={accepted} rejected_duplicates={rejected}")
+    print(f"elapsed={elapsed:.2f}s throughput={attempts / elapsed:.0f} attempts/s, {accepted / elapsed:.0f} ballots/s")
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    return not problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--voters", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    data_dir = tempfile.mkdtemp(prefix="stress_votes_")
+    try:
+        ok = run(args.backend, args.processes, args.threads, args.voters, data_dir)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
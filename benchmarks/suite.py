@@ -0,0 +1,350 @@
+"""Reproducible load test of the voting core, with results saved as JSON.
+
+Drives the operations the app and the API call, headlessly and through
+the same ``Election`` objects ``core`` delegates to: ``has_user_voted``,
+``save_vote``, ``get_results`` and ``clear_all_votes``. For every
+electorate size, backend and concurrency setting, a fresh child process:
+
+- writes a synthetic roll of that many voters and creates an election;
+- casts ``--turnout`` of the roll in bulk (not timed);
+- times ``--ops`` eligibility checks on random voters, ``--ops`` ballots
+  from voters who have not voted yet, and ``--reads`` result reads, split
+  over ``--workers`` threads or processes;
+- times one ``clear_all_votes`` and checks every count along the way.
+
+Each row reports throughput, p50/p95/p99 latency, peak RSS so far and the
+bytes the operation wrote (``wchar`` from ``/proc/self/io``, so it counts
+every write call, synced or not). Voter ids, candidates and samples come
+from ``--seed``, so two runs do the same work; ``--repeat`` runs every
+case several times and keeps the median, which steadies small machines.
+
+    python -m benchmarks.suite --sizes 1000 10000 100000 1000000 --out before.json
+    python -m benchmarks.suite --concurrency processes --workers 1 4 --backends json sqlite
+    python -m benchmarks.suite --compare before.json after.json
+
+``--compare`` matches rows by backend, size, concurrency, workers and
+operation, and exits 1 when throughput drops or p99 grows by more than
+``--threshold``.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CANDIDATES = ["Ana", "Beto", "Carla"]
+ELECTION_ID = "bench"
+KEY_FIELDS = ("backend", "electorate", "concurrency", "workers", "operation")
+
+
+def voter_id(i):
+    return f"{i:08d}V"
+
+
+def write_roll(path, size):
+    with open(path, 'w', newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["user_id", "name"])
+        writer.writerows((voter_id(i), f"Votante {i}") for i in range(size))
+
+
+def peak_rss():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def written_bytes():
+    """Bytes this process has passed to write calls, or None off Linux"""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+# Runs in each worker, thread or process
+
+
+def _call(election, operation):
+    if operation == "has_user_voted":
+        return election.has_user_voted
+    if operation == "save_vote":
+        return lambda item: election.save_vote(*item)
+    return lambda item: election.get_results()
+
+
+def _drive(election, operation, items, threads):
+    """Run ``operation`` over ``items`` from ``threads`` threads; returns the latencies"""
+    call = _call(election, operation)
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(chunk):
+        samples = []
+        for item in chunk:
+            start = time.perf_counter()
+            call(item)
+            samples.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(samples)
+
+    pool = [threading.Thread(target=worker, args=(items[n::threads],)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return latencies
+
+
+_worker_election = None
+
+
+def _open_election(root, settings):
+    from elections import ElectionRegistry
+
+    election = ElectionRegistry(root, settings).get(ELECTION_ID)
+    # Warm up what the first request of a real process would pay for
+    election.has_user_voted(voter_id(0))
+    election.get_results()
+    return election
+
+
+def _init_process(root, settings, ready):
+    global _worker_election
+    _worker_election = _open_election(root, settings)
+    ready.put(os.getpid())
+
+
+def _process_job(args):
+    operation, items = args
+    before = written_bytes()
+    latencies = _drive(_worker_election, operation, items, 1)
+    after = written_bytes()
+    return latencies, None if before is None else after - before, peak_rss()
+
+
+# One case: one electorate size, backend and concurrency, in its own process
+
+
+def run_case(case):
+    from elections import ElectionRegistry
+
+    size, workers = case["electorate"], case["workers"]
+    rng = random.Random(case["seed"])
+    root = tempfile.mkdtemp(prefix="bench_suite_")
+    settings = {"backend": case["backend"], "verify_tally_on_start": False}
+    registry = ElectionRegistry(root, settings)
+    pool = None
+    try:
+        roll_path = os.path.join(root, "roll.csv")
+        write_roll(roll_path, size)
+        election = registry.create(ELECTION_ID, "Benchmark", CANDIDATES, roll_path)
+        os.remove(roll_path)
+
+        turnout = int(size * case["turnout"])
+        store = election.store()
+        for start in range(0, turnout, 10000):
+            store.record_votes([(voter_id(i), CANDIDATES[i % len(CANDIDATES)])
+                                for i in range(start, min(start + 10000, turnout))])
+        election = _open_election(root, settings) if case["concurrency"] == "threads" else election
+        if case["concurrency"] == "processes":
+            ctx = multiprocessing.get_context("spawn")
+            ready = ctx.Queue()
+            pool = ctx.Pool(workers, initializer=_init_process, initargs=(root, settings, ready))
+            # Start timing once every worker has opened the election
+            for _ in range(workers):
+                ready.get()
+
+        checks = [voter_id(rng.randrange(size)) for _ in range(case["ops"])]
+        new_voters = list(range(turnout, min(size, turnout + case["ops"])))
+        ballots = [(voter_id(i), CANDIDATES[rng.randrange(len(CANDIDATES))]) for i in new_voters]
+        phases = [("has_user_voted", checks), ("save_vote", ballots), ("get_results", list(range(case["reads"])))]
+
+        rows = []
+        for operation, items in phases:
+            if not items:
+                continue
+            before = written_bytes()
+            start = time.perf_counter()
+            if pool is None:
+                latencies = _drive(election, operation, items, workers)
+                elapsed = time.perf_counter() - start
+                written = None if before is None else written_bytes() - before
+                rss = peak_rss()
+            else:
+                results = pool.map(_process_job, [(operation, items[n::workers]) for n in range(workers)])
+                elapsed = time.perf_counter() - start
+                latencies = [sample for samples, _, _ in results for sample in samples]
+                written = None if before is None else sum(w for _, w, _ in results)
+                rss = max([peak_rss()] + [r for _, _, r in results])
+            rows.append(summarize(case, operation, latencies, elapsed, rss, written))
+
+        results = election.get_results()
+        expected = turnout + len(ballots)
+        if sum(results.values()) != expected:
+            raise SystemExit(f"FAIL: {sum(results.values())} ballots counted, {expected} cast")
+
+        before = written_bytes()
+        start = time.perf_counter()
+        election.clear_all_votes()
+        elapsed = time.perf_counter() - start
+        written = None if before is None else written_bytes() - before
+        if sum(election.get_results().values()) != 0 or election.has_user_voted(voter_id(0)):
+            raise SystemExit("FAIL: votes left after clear_all_votes")
+        rows.append(summarize(case, "clear_all_votes", [elapsed], elapsed, peak_rss(), written))
+        return rows
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        registry.close()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def summarize(case, operation, latencies, elapsed, rss, written):
+    latencies = sorted(latencies)
+    return {
+        "backend": case["backend"],
+        "electorate": case["electorate"],
+        "concurrency": case["concurrency"],
+        "workers": case["workers"],
+        "operation": operation,
+        "ops": len(latencies),
+        "seconds": round(elapsed, 6),
+        "throughput": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 4),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 4),
+        "peak_rss_bytes": rss,
+        "bytes_written": written,
+    }
+
+
+# Driver
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def print_row(row):
+    written = "-" if row["bytes_written"] is None else f"{row['bytes_written'] / 1e6:.1f}MB"
+    print(f"  {row['backend']:6} {row['electorate']:8d} {row['concurrency'][0]}x{row['workers']:<3d} "
+          f"{row['operation']:16} {row['ops']:7d} ops {row['throughput']:10.0f}/s "
+          f"p50={row['p50_ms']:8.3f}ms p95={row['p95_ms']:8.3f}ms p99={row['p99_ms']:8.3f}ms "
+          f"rss={row['peak_rss_bytes'] / 2**20:5.0f}MB written={written}")
+
+
+def compare(base_path, new_path, threshold):
+    """Print the change of every matching row; returns the number of regressions"""
+    with open(base_path) as f:
+        base = {tuple(row[k] for k in KEY_FIELDS): row for row in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = json.load(f)
+    regressions = 0
+    for row in new["results"]:
+        old = base.get(tuple(row[k] for k in KEY_FIELDS))
+        if old is None:
+            continue
+        throughput = row["throughput"] / old["throughput"] - 1
+        p99 = row["p99_ms"] / old["p99_ms"] - 1 if old["p99_ms"] else 0.0
+        regressed = throughput < -threshold or p99 > threshold
+        regressions += regressed
+        print(f"  {row['backend']:6} {row['electorate']:8d} {row['concurrency'][0]}x{row['workers']:<3d} "
+              f"{row['operation']:16} throughput {throughput:+7.1%} p99 {p99:+7.1%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="electorate sizes")
+    parser.add_argument("--backends", nargs="+", choices=("json", "sqlite"), default=["json"])
+    parser.add_argument("--concurrency", choices=("threads", "processes"), default="threads")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--turnout", type=float, default=0.5, help="share of the roll cast before timing")
+    parser.add_argument("--ops", type=int, default=10000, help="eligibility checks, and ballots cast")
+    parser.add_argument("--reads", type=int, default=1000, help="result reads")
+    parser.add_argument("--seed", type=int, default=2026)
+    parser.add_argument("--repeat", type=int, default=1, help="runs per case; the median run of each row is kept")
+    parser.add_argument("--out", help="write the results here as JSON")
+    parser.add_argument("--compare", nargs="+", metavar="JSON", help="compare a baseline with --out or a second file")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return 0
+    if args.compare and len(args.compare) == 2:
+        return 1 if compare(*args.compare, args.threshold) else 0
+
+    commit, dirty = git_revision()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "started_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": {k: v for k, v in vars(args).items() if k not in ("case", "compare", "out")},
+        "results": [],
+    }
+    print(f"commit={commit}{' (dirty)' if dirty else ''} cpus={os.cpu_count()} concurrency={args.concurrency}")
+    for backend in args.backends:
+        for size in args.sizes:
+            for workers in args.workers:
+                case = {"backend": backend, "electorate": size, "concurrency": args.concurrency,
+                        "workers": workers, "turnout": args.turnout, "ops": args.ops,
+                        "reads": args.reads, "seed": args.seed}
+                runs = []
+                for _ in range(args.repeat):
+                    # A fresh process per run, so peak RSS belongs to that case alone
+                    out = subprocess.run([sys.executable, "-m", "benchmarks.suite", "--case", json.dumps(case)],
+                                         cwd=REPO_DIR, capture_output=True, text=True)
+                    if out.returncode != 0:
+                        print(out.stdout + out.stderr)
+                        return 1
+                    runs.append(json.loads(out.stdout.splitlines()[-1]))
+                for rows in zip(*runs):
+                    row = sorted(rows, key=lambda r: r["throughput"])[len(rows) // 2]
+                    print_row(row)
+                    report["results"].append(row)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"results written to {args.out}")
+        if args.compare:
+            return 1 if compare(args.compare[0], args.out, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+"""Voting core shared by the Streamlit app and the HTTP API.
+
+Holds the roll, the candidates and the process-wide storage resources, with
+no dependency on Streamlit, so every front end applies the same rules.
+The module-level functions act on the default election; ``get_election``
+returns any other election hosted here (see ``elections``).
+"""
+import atexit
+import functools
+import logging
+import os
+import threading
+
+import metrics
+from elections import DEFAULT_ELECTION, Election, ElectionRegistry
+from ratelimit import LoginGuard, RateLimiter
+from roll import load_candidates, load_roll
+from tabulation import METHODS
+
+# Configuration
+STORAGE_BACKEND = os.environ.get("VOTING_STORAGE", "json")  # "json", "sqlite", "compact" or "remote"
+# Vote ledger shared by every replica (see ledger.py), for the "remote" backend
+LEDGER_URL = os.environ.get("VOTING_LEDGER_URL")
+LEDGER_TOKEN = os.environ.get("VOTING_LEDGER_TOKEN")
+VOTES_LOG = "votes_runoff.ndjson"
+USERS_LOG = "users_runoff.ndjson"
+SQLITE_FILE = "votes_runoff.db"
+COMPACT_FILE = "votes_runoff.bin"
+# Expected electorate size; when set, logins are prefiltered by a Bloom filter
+VOTER_BLOOM_CAPACITY = int(os.environ.get("VOTER_BLOOM_CAPACITY", "0")) or None
+# Recount every ballot once at startup to check the stored tally
+VERIFY_TALLY_ON_START = os.environ.get("VERIFY_TALLY_ON_START", "1") == "1"
+# Ballots committed together by the ingestion writer, and how long a caller waits for its commit
+INGEST_MAX_BATCH = int(os.environ.get("INGEST_MAX_BATCH", "256"))
+# When a ballot reaches stable storage: "group" (one journal fsync per committed batch)
+# or "vote" (each ballot committed and fsynced on its own, before the next). With the
+# sqlite backend "group" keeps synchronous=NORMAL, which syncs at WAL checkpoints only,
+# and "vote" switches to synchronous=FULL
+VOTE_DURABILITY = os.environ.get("VOTE_DURABILITY", "group")
+VOTE_COMMIT_TIMEOUT = 10
+# Most tally updates per second pushed to live results watchers
+LIVE_RESULTS_HZ = float(os.environ.get("LIVE_RESULTS_HZ", "2"))
+# How winners are decided: "plurality" (single choice), or "irv"/"borda" (ranked ballots)
+BALLOT_METHOD = os.environ.get("BALLOT_METHOD", "plurality")
+# Ballots read per chunk when tabulating
+TABULATE_CHUNK = 100000
+
+# Voter roll (.db from `python roll.py import`, or .csv/.json) and candidate
+# list (.json or one name per line); the built-in lists below when unset
+VOTER_ROLL_FILE = os.environ.get("VOTER_ROLL")
+CANDIDATES_FILE = os.environ.get("CANDIDATES_FILE")
+
+# Serve this process's metrics (Prometheus text) on this port; the API serves them at /metrics
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0")) or None
+# ID checks (logins, admin access) allowed per second per browser session and per client
+# address, with bursts of LOGIN_BURST; 0 turns a limit off. Repeated failures lock the key
+# out with exponential backoff (see ratelimit)
+LOGIN_RATE_PER_SESSION = float(os.environ.get("LOGIN_RATE_PER_SESSION", "0.5"))
+LOGIN_RATE_PER_ADDRESS = float(os.environ.get("LOGIN_RATE_PER_ADDRESS", "10"))
+LOGIN_BURST = 5
+# Failed ID checks tolerated before the lockout starts; an address may front many voters
+LOGIN_FREE_FAILURES_PER_SESSION = 3
+LOGIN_FREE_FAILURES_PER_ADDRESS = 20
+# Directory holding the other elections hosted by this deployment
+ELECTIONS_DIR = os.environ.get("ELECTIONS_DIR", "elections")
+
+# Whole-file JSON stores used before the append-only log, imported on first start
+VOTES_FILE = "votes_runoff.json"
+USERS_FILE = "users_runoff.json"
+
+# Valid users with their IDs and names
+VALID_USERS = {
+    "41607985L": "Ricky Ortiz", 
+    "23899839X": "Oscar Boado",
+    "39974093R": "Tillo",
+    "46151901D": "Miguel Ginot",
+    "21773570E": "Pablo Beaus",
+    "46152551S": "Carlos Oteiza",
+    "23929566K": "Ignacio Garcia",
+    "26271508B": "Pablo Corbat"
+}
+
+# RUNOFF CANDIDATES - Only the two finalists
+RUNOFF_CANDIDATES = [
+    "Gabriel Oliver",
+    "Gonzalo Ros"
+]
+
+# Admin user who can see results
+ADMIN_ID = os.environ.get("ADMIN_ID", "46151901D")  # Miguel Ginot
+
+if STORAGE_BACKEND == "remote" and not LEDGER_URL:
+    raise ValueError("VOTING_STORAGE=remote needs VOTING_LEDGER_URL")
+if BALLOT_METHOD not in METHODS:
+    raise ValueError(f"BALLOT_METHOD must be one of {', '.join(METHODS)}, not {BALLOT_METHOD!r}")
+if VOTE_DURABILITY not in ("group", "vote"):
+    raise ValueError(f"VOTE_DURABILITY must be group or vote, not {VOTE_DURABILITY!r}")
+if VOTER_ROLL_FILE:
+    VALID_USERS = load_roll(VOTER_ROLL_FILE)
+if CANDIDATES_FILE:
+    RUNOFF_CANDIDATES = load_candidates(CANDIDATES_FILE)
+
+logger = logging.getLogger(__name__)
+
+_resources = {}
+_resources_lock = threading.RLock()
+
+# Process tuning shared by every election
+ELECTION_SETTINGS = {
+    "backend": STORAGE_BACKEND,
+    "bloom_capacity": VOTER_BLOOM_CAPACITY,
+    "verify_tally_on_start": VERIFY_TALLY_ON_START,
+    "ingest_max_batch": INGEST_MAX_BATCH,
+    "durability": VOTE_DURABILITY,
+    "vote_commit_timeout": VOTE_COMMIT_TIMEOUT,
+    "live_results_hz": LIVE_RESULTS_HZ,
+    "tabulate_chunk": TABULATE_CHUNK,
+    "ledger_url": LEDGER_URL,
+    "ledger_token": LEDGER_TOKEN,
+}
+
+def process_resource(fn):
+    """Create the decorated resource once per process and share it"""
+    @functools.wraps(fn)
+    def wrapper():
+        if fn.__name__ not in _resources:
+            with _resources_lock:
+                if fn.__name__ not in _resources:
+                    _resources[fn.__name__] = fn()
+        return _resources[fn.__name__]
+    return wrapper
+
+@process_resource
+def get_default_election():
+    """The deployment's own election, stored in the data directory, importing any legacy JSON files once"""
+    election = Election(
+        {"id": DEFAULT_ELECTION, "title": "Segunda Vuelta", "candidates": RUNOFF_CANDIDATES,
+         "method": BALLOT_METHOD, "admin_id": ADMIN_ID},
+        ".", valid_users=VALID_USERS,
+        files={"votes": VOTES_LOG, "users": USERS_LOG, "sqlite": SQLITE_FILE, "compact": COMPACT_FILE},
+        legacy_files=(VOTES_FILE, USERS_FILE), settings=ELECTION_SETTINGS)
+    atexit.register(election.close)
+    return election
+
+@process_resource
+def get_registry():
+    """The other elections hosted here, each opened on first use"""
+    registry = ElectionRegistry(ELECTIONS_DIR, ELECTION_SETTINGS)
+    atexit.register(registry.close)
+    return registry
+
+def get_election(election_id=None):
+    """Election ``election_id`` (the default election when None); raises ``ElectionNotFoundError``"""
+    if election_id in (None, DEFAULT_ELECTION):
+        return get_default_election()
+    return get_registry().get(election_id)
+
+def list_elections():
+    """Ids of every election hosted here, the default one first"""
+    return [DEFAULT_ELECTION] + get_registry().ids()
+
+def get_store():
+    """The default election's vote store"""
+    return get_default_election().store()
+
+def get_ingestor():
+    """The default election's writer that group-commits queued ballots"""
+    return get_default_election().ingestor()
+
+def get_voter_index():
+    """The default election's index of voters who have already voted"""
+    return get_default_election().voter_index()
+
+def get_startup_audit():
+    """Check the stored tally against a full recount once per process"""
+    return get_default_election().startup_audit()
+
+def get_analytics():
+    """Columnar ballot frame shared by every admin session in this process"""
+    return get_default_election().analytics()
+
+def get_read_cache():
+    """Parsed store snapshots shared by every session in this process"""
+    return get_default_election().read_cache()
+
+def load_votes():
+    """Load votes from the ballot store (shared snapshot, do not modify)"""
+    return get_default_election().load_votes()
+
+def save_vote(user_id, candidate, ranking=None):
+    """Save a vote to the ballot store
+
+    ``ranking`` lists candidates in order of preference for ranked ballots;
+    ``candidate`` is then its first choice. Returns True once the ballot is
+    committed, as durably as ``VOTE_DURABILITY`` says. Raises ``AlreadyVotedError`` if the voter already
+    voted; storage errors propagate to the caller.
+    """
+    return get_default_election().save_vote(user_id, candidate, ranking)
+
+def load_voted_users():
+    """Load list of users who have already voted (shared snapshot, do not modify)"""
+    return get_default_election().load_voted_users()
+
+def has_user_voted(user_id):
+    """Check if user has already voted"""
+    return get_default_election().has_user_voted(user_id)
+
+def clear_all_votes():
+    """Clear all votes and reset the system (Admin only); errors propagate"""
+    return get_default_election().clear_all_votes()
+
+def get_results():
+    """Get voting results"""
+    return get_default_election().get_results()
+
+def tabulate_results(method=None):
+    """Tabulate every ballot with ``method`` (default ``BALLOT_METHOD``), see ``tabulation``"""
+    return get_default_election().tabulate_results(method)
+
+def get_broadcaster():
+    """Start the process-wide publisher of live tally updates"""
+    return get_default_election().broadcaster()
+
+def _election_metrics():
+    """Per-election gauges and counters read from the resources this process has open"""
+    families = {
+        "ballots": ("voting_ballots", "gauge", "Ballots in the current round"),
+        "ingest_batches": ("voting_ingest_batches_total", "counter", "Group commits written"),
+        "ingest_ballots": ("voting_ingest_ballots_total", "counter", "Ballots written by group commit"),
+        "cache_hits": ("voting_read_cache_hits_total", "counter", "Store snapshots served from the read cache"),
+        "cache_misses": ("voting_read_cache_misses_total", "counter", "Store snapshots read from disk"),
+    }
+    samples = {key: [] for key in families}
+    storage = []
+    for election in [get_default_election()] + get_registry().opened():
+        try:
+            stats = election.resource_stats()
+        except OSError:
+            continue  # reset or archived mid-scrape
+        for key, value in stats.items():
+            if key == "bytes":
+                storage.extend(({"election": election.id, "file": name}, size) for name, size in value.items())
+            else:
+                samples[key].append(({"election": election.id}, value))
+    return [families[key] + (samples[key],) for key in families] + [
+        ("voting_storage_bytes", "gauge", "Size of the ballot store files", storage)]
+
+metrics.REGISTRY.register_collector(_election_metrics)
+
+@process_resource
+def get_login_guard():
+    """Rate limits on ID checks shared by every session (and API request) in this process"""
+    guard = LoginGuard(
+        RateLimiter(LOGIN_RATE_PER_SESSION, LOGIN_BURST, LOGIN_FREE_FAILURES_PER_SESSION)
+        if LOGIN_RATE_PER_SESSION > 0 else None,
+        RateLimiter(LOGIN_RATE_PER_ADDRESS, LOGIN_BURST * max(LOGIN_RATE_PER_ADDRESS, 1),
+                    LOGIN_FREE_FAILURES_PER_ADDRESS)
+        if LOGIN_RATE_PER_ADDRESS > 0 else None)
+    limiters = [(kind, limiter) for kind, limiter in (("session", guard.session_limiter),
+                                                      ("address", guard.address_limiter)) if limiter is not None]
+    metrics.REGISTRY.register_collector(lambda: [
+        ("voting_login_limiter_keys", "gauge", "Clients tracked by the login rate limiter",
+         [({"key": kind}, len(limiter)) for kind, limiter in limiters]),
+        ("voting_login_limiter_evictions_total", "counter", "Clients dropped by the full login rate limiter",
+         [({"key": kind}, limiter.evictions) for kind, limiter in limiters]),
+    ])
+    return guard
+
+@process_resource
+def get_metrics_server():
+    """Serve this process's metrics on ``METRICS_PORT``, if set"""
+    if not METRICS_PORT:
+        return None
+    try:
+        return metrics.serve(METRICS_PORT)
+    except OSError as e:
+        # Another process (a second app worker) already serves that port
+        logger.warning("Metrics not served on port %s: %s", METRICS_PORT, e)
+        return None
@@ -0,0 +1,675 @@
+"""Elections hosted side by side, each with its own roll, candidates, rounds and storage shard.
+
+Every election lives in its own directory under the elections root
+(``ELECTIONS_DIR``, ``elections`` by default):
+
+    elections/<id>/election.json   title, candidates, method, admin, roll, rounds
+    elections/<id>/roll.csv        the voter roll (or .json / .db), unless inline in election.json
+    elections/<id>/round-1/        the current round's ballot store (a shard)
+    elections/<id>/snapshots/      point-in-time snapshots of the ballot store
+
+Each election opens its own store, ingestion writer, voter index and
+caches on first use, so elections never wait on each other's locks.
+Resetting an election moves its ballots to a snapshot and points it at a
+new, empty shard, and archiving one moves its directory under
+``_archive/``: both are renames, whatever the number of ballots, and
+touch no other election. Snapshots are hard links (see
+``storage.snapshot``), so taking one is as cheap, and restoring one
+first snapshots the ballots it replaces: no ballot is ever deleted
+without an explicit ``rm``. Other processes serving the same directory
+notice through the manifest.
+
+With the ``remote`` backend the shards live on a vote ledger
+(``ledger.py``) instead, named ``<id>/round-N``, and every replica must
+see the same manifests.
+
+The deployment's original single election (``core``'s roll, candidates and
+files in the data directory) is the ``default`` election.
+
+    python elections.py create consejo --title "Consejo 2026" --candidates cands.json --roll voters.csv
+    python elections.py list
+    python elections.py new-round consejo --candidates finalists.json
+    python elections.py reset consejo
+    python elections.py snapshot consejo --label "antes del escrutinio"
+    python elections.py snapshots consejo
+    python elections.py restore consejo 20260301120000000000-reset
+    python elections.py archive consejo
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import threading
+from datetime import datetime
+
+import metrics
+from analytics import BallotFrame, BallotTally
+from live import TallyBroadcaster
+from roll import load_candidates, load_roll
+from storage import (AlreadyVotedError, CompactStore, RemoteStore, Snapshot, SnapshotCache, SqliteStore,
+                     StoreRetiredError, VoteIngestor, VoteLog, VoterIndex, list_snapshots)
+from storage.base import legacy_pending
+from storage.locking import FileLock, atomic_write
+from storage.snapshot import thaw
+from tabulation import METHODS
+
+DEFAULT_ELECTION = "default"
+MANIFEST = "election.json"
+ARCHIVE_DIR = "_archive"
+SNAPSHOT_DIR = "snapshots"
+# Lowercase letters, digits, "-" and "_": safe as a directory name and in URLs
+ELECTION_ID = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+# Store files inside a shard
+STORE_FILES = {"votes": "votes.ndjson", "users": "users.ndjson", "sqlite": "votes.db", "compact": "votes.bin"}
+DEFAULT_SETTINGS = {
+    "backend": "json",
+    "bloom_capacity": None,
+    "verify_tally_on_start": True,
+    "ingest_max_batch": 256,
+    "durability": "group",
+    "vote_commit_timeout": 10,
+    "live_results_hz": 2.0,
+    "tabulate_chunk": 100000,
+    "ledger_url": None,
+    "ledger_token": None,
+}
+
+logger = logging.getLogger(__name__)
+
+
+class ElectionNotFoundError(KeyError):
+    """No election with that id (or it was archived)"""
+
+
+def shard_name(round_number, resets=0):
+    return f"round-{round_number}" if not resets else f"round-{round_number}.{resets}"
+
+
+def discard(path):
+    """Rename ``path`` out of the way and delete it in the background"""
+    if not os.path.exists(path):
+        return
+    doomed = f"{path}.{os.getpid()}.{threading.get_ident()}.discarded"
+    os.rename(path, doomed)
+    threading.Thread(target=shutil.rmtree, args=(doomed, True), name="discard-shard", daemon=True).start()
+
+
+class Election:
+    """One election: its rules, and its storage resources opened on first use
+
+    ``config`` holds ``id``, ``title``, ``candidates``, ``method``,
+    ``admin_id`` and, for elections with a manifest, ``roll``, ``round``
+    and ``shard``. With ``manifest_path`` the config is read from (and
+    kept in sync with) that file instead.
+    """
+
+    def __init__(self, config, data_dir, valid_users=None, files=STORE_FILES, legacy_files=None,
+                 manifest_path=None, settings=None):
+        self.data_dir = data_dir
+        self.files = files
+        self.legacy_files = legacy_files
+        self.manifest_path = manifest_path
+        self.settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        self._valid_users = valid_users
+        self._lock = threading.RLock()
+        self._resources = {}
+        self._manifest_stamp = None
+        self.config = None
+        if manifest_path is not None:
+            self._manifest_lock = FileLock(os.path.join(data_dir, "election.lock"))
+            self._reload()
+        else:
+            self._load(config)
+
+    # Configuration
+
+    def _load(self, config):
+        if self.config is not None and (config.get("shard"), config.get("round")) != (
+                self.config.get("shard"), self.config.get("round")):
+            self._release()
+        if self.manifest_path is not None and (self.config or {}).get("roll") != config.get("roll"):
+            self._valid_users = None
+        self.config = config
+        self.id = config["id"]
+        self.title = config.get("title", self.id)
+        self.candidates = list(config["candidates"])
+        self.method = config.get("method", "plurality")
+        self.admin_id = config.get("admin_id")
+        self.round = config.get("round", 1)
+        self.backend = config.get("backend", self.settings["backend"])
+        self.shard_dir = os.path.join(self.data_dir, config["shard"]) if "shard" in config else self.data_dir
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            with self._lock:
+                self._release()
+            raise ElectionNotFoundError(self.id) from None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _reload(self):
+        with self._lock:
+            stamp = self._stamp()
+            with open(self.manifest_path, 'rb') as f:
+                self._load(json.load(f))
+            self._manifest_stamp = stamp
+
+    def _check_manifest(self):
+        """Pick up a reset, new round or archive done by another process (one stat)"""
+        if self.manifest_path is not None and self._stamp() != self._manifest_stamp:
+            self._reload()
+
+    def _write_manifest(self, config):
+        """Replace the manifest (call with both locks held) and switch to it"""
+        atomic_write(self.manifest_path, json.dumps(config, ensure_ascii=False, indent=2).encode("utf-8"))
+        self._reload()
+
+    @property
+    def valid_users(self):
+        """The roll as ``{user_id: name}``; SQLite rolls are read lazily"""
+        if self._valid_users is None:
+            roll = self.config.get("roll")
+            if isinstance(roll, dict):
+                self._valid_users = roll
+            elif roll:
+                self._valid_users = load_roll(os.path.join(self.data_dir, roll))
+            else:
+                self._valid_users = {}
+        return self._valid_users
+
+    def describe(self):
+        return {"id": self.id, "title": self.title, "candidates": self.candidates,
+                "method": self.method, "round": self.round}
+
+    # Resources
+
+    def _resource(self, name, create):
+        self._check_manifest()
+        if name not in self._resources:
+            with self._lock:
+                if name not in self._resources:
+                    self._resources[name] = create()
+        return self._resources[name]
+
+    def _release(self):
+        """Close the open resources; they reopen, on the current shard, on next use"""
+        with self._lock:
+            resources, self._resources = self._resources, {}
+            for name in ("ingestor", "broadcaster", "store"):
+                if name in resources:
+                    resources[name].close()
+
+    def close(self):
+        self._release()
+
+    def ledger_name(self):
+        """Name of the current shard on the vote ledger"""
+        return self.id if "shard" not in self.config else f"{self.id}/{self.config['shard']}"
+
+    def _open_store(self):
+        if self.backend == "remote":
+            store = RemoteStore(self.settings["ledger_url"], self.ledger_name(), self.settings["ledger_token"])
+            if self.legacy_files and not store.import_legacy(*self.legacy_files) \
+                    and legacy_pending(*self.legacy_files):
+                logger.warning("Legacy files %s not imported: the ledger store %s already has votes",
+                               ", ".join(self.legacy_files), self.ledger_name())
+            return store
+        os.makedirs(self.shard_dir, exist_ok=True)
+        if self.backend == "sqlite":
+            # NORMAL only syncs the write-ahead log at checkpoints: no use when each ballot must be on disk
+            store = SqliteStore(os.path.join(self.shard_dir, self.files["sqlite"]),
+                                synchronous="FULL" if self.settings["durability"] == "vote" else "NORMAL")
+        elif self.backend == "compact":
+            # Room in each record for a full ranking when ballots are ranked
+            store = CompactStore(os.path.join(self.shard_dir, self.files["compact"]),
+                                 rank_slots=len(self.candidates) if self.method != "plurality" else 0)
+        else:
+            store = VoteLog(os.path.join(self.shard_dir, self.files["votes"]),
+                            os.path.join(self.shard_dir, self.files["users"]))
+        if self.legacy_files:
+            store.import_legacy(*self.legacy_files)
+        return store
+
+    def store(self):
+        return self._resource("store", self._open_store)
+
+    def ingestor(self):
+        # "vote" commits (and fsyncs) each ballot on its own, "group" lets queued ballots share one
+        max_batch = 1 if self.settings["durability"] == "vote" else self.settings["ingest_max_batch"]
+        return self._resource("ingestor", lambda: VoteIngestor(self.store(), max_batch=max_batch))
+
+    def voter_index(self):
+        return self._resource("voter_index", lambda: VoterIndex(
+            self.store(), bloom_capacity=self.settings["bloom_capacity"]))
+
+    def read_cache(self):
+        return self._resource("read_cache", SnapshotCache)
+
+    def analytics(self):
+        return self._resource("analytics", lambda: BallotFrame(self.store()))
+
+    def tabulation(self):
+        return self._resource("tabulation", lambda: BallotTally(
+            self.store(), self.candidates, chunk_size=self.settings["tabulate_chunk"]))
+
+    def broadcaster(self):
+        return self._resource("broadcaster", lambda: TallyBroadcaster(
+            self.get_results, rate_hz=self.settings["live_results_hz"]))
+
+    def _refresh_live(self):
+        """Show live watchers a reset or restore now rather than at the next interval"""
+        broadcaster = self._resources.get("broadcaster")
+        if broadcaster is not None:
+            broadcaster.refresh()
+
+    def startup_audit(self):
+        """Check the stored tally against a full recount once per shard"""
+        return self._resource("startup_audit", lambda: self.store().verify_tally()
+                              if self.settings["verify_tally_on_start"] else None)
+
+    # Voting
+
+    def load_votes(self):
+        store = self.store()
+        try:
+            with metrics.timer("load_votes", election=self.id):
+                return self.read_cache().get("votes", store.stamp(), lambda: {
+                    f"vote_{vote['vote_id']}": vote for vote in store.iter_votes()
+                })
+        except Exception:
+            return {}
+
+    def load_voted_users(self):
+        store = self.store()
+        try:
+            return self.read_cache().get("voted_users", store.stamp(), store.voted_users)
+        except Exception:
+            return []
+
+    def _record_vote(self, user_id, candidate, ranking):
+        # Voter marks are stored separately from the anonymous ballots
+        self.ingestor().record_vote(user_id, candidate, ranking, timeout=self.settings["vote_commit_timeout"])
+
+    def save_vote(self, user_id, candidate, ranking=None):
+        rejected = None
+        with metrics.timer("save_vote", election=self.id):
+            try:
+                try:
+                    self._record_vote(user_id, candidate, ranking)
+                except StoreRetiredError:
+                    if self.manifest_path is None:
+                        raise
+                    # Another process is resetting the round: vote on the shard it switches to
+                    with self._manifest_lock:
+                        self._reload()
+                    self._record_vote(user_id, candidate, ranking)
+            except AlreadyVotedError as e:
+                rejected = e
+            if self.backend != "remote":
+                self.voter_index().add(user_id)
+        if rejected is not None:
+            metrics.REJECTIONS.inc(reason="already_voted", stage="vote", election=self.id)
+            raise rejected
+        metrics.VOTES.inc(election=self.id)
+        self.read_cache().invalidate()
+        return True
+
+    def has_user_voted(self, user_id):
+        with metrics.timer("has_user_voted", election=self.id):
+            # A ledger answers from its own index, which sees every replica's ballots
+            if self.backend == "remote":
+                return self.store().has_voted(user_id)
+            return self.voter_index().has_voted(user_id)
+
+    def get_results(self):
+        with metrics.timer("get_results", election=self.id):
+            tally = self.store().tally()
+        return {candidate: tally.get(candidate, 0) for candidate in self.candidates}
+
+    def tabulate_results(self, method=None):
+        with metrics.timer("tabulate", election=self.id):
+            return self.tabulation().result(method or self.method)
+
+    def resource_stats(self):
+        """Sizes and counters of the resources already open; opens nothing"""
+        resources = dict(self._resources)
+        stats = {}
+        if "store" in resources:
+            store = resources["store"]
+            stats["ballots"] = store.vote_count()
+            stats["bytes"] = {os.path.basename(path): os.path.getsize(path)
+                              for path in store.data_files() if os.path.exists(path)}
+        if "ingestor" in resources:
+            stats["ingest_batches"] = resources["ingestor"].batches
+            stats["ingest_ballots"] = resources["ingestor"].ballots
+        if "read_cache" in resources:
+            stats["cache_hits"] = resources["read_cache"].hits
+            stats["cache_misses"] = resources["read_cache"].misses
+        return stats
+
+    # Lifecycle
+
+    def clear_all_votes(self):
+        """Reset the current round; returns whether there were votes to clear"""
+        if self.manifest_path is not None:
+            return self.reset()
+        if self.backend == "remote":
+            # The ledger keeps the ballots in a snapshot of its own; this one records it
+            with self._lock:
+                kept = self.store().reset()
+                snapshot = Snapshot.create(self.snapshots_dir(), "reset")
+                snapshot.seal({}, kept["results"], ledger=kept["snapshot"], **self._snapshot_context())
+            cleared = kept["cleared"]
+        else:
+            with self._lock:
+                cleared = bool(self._retire("reset", self.store().detach).meta["ballots"])
+            self.voter_index().clear()
+        self.read_cache().invalidate()
+        self.analytics().reset()
+        self.tabulation().reset()
+        self._refresh_live()
+        return cleared
+
+    def reset(self):
+        """Start the current round over on a new, empty shard
+
+        The ballots are moved to a snapshot (with the ``remote`` backend,
+        left on the ledger under the old shard's name), so this takes the
+        same time with ten ballots or ten million and can be undone with
+        ``restore_snapshot``.
+        """
+        with self._lock, self._manifest_lock:
+            self._reload()
+            if self.backend == "remote":
+                # The old shard stays on the ledger; the snapshot only records it
+                store = self.store()
+                snapshot = Snapshot.create(self.snapshots_dir(), "reset")
+                snapshot.seal({}, store.tally(), ledger=self.ledger_name(), **self._snapshot_context())
+            else:
+                store = self.store()
+                store.retire()
+                snapshot = self._retire("reset", store.detach)
+            self._switch_shard()
+        return snapshot.meta["ballots"] > 0
+
+    # Snapshots
+
+    def snapshots_dir(self):
+        return os.path.join(self.data_dir, SNAPSHOT_DIR)
+
+    def snapshots(self):
+        """Snapshots of this election, newest first; each reads its metadata on first use"""
+        return list_snapshots(self.snapshots_dir())
+
+    def get_snapshot(self, name):
+        for snapshot in self.snapshots():
+            if snapshot.name == name:
+                return snapshot
+        raise ValueError(f"no snapshot {name!r}")
+
+    def _snapshot_context(self):
+        return {"round": self.round, "backend": self.backend, "method": self.method,
+                "candidates": self.candidates}
+
+    def _retire(self, reason, save, label=None):
+        """Snapshot the store with ``save(target_dir)`` (a store's ``snapshot`` or ``detach``)"""
+        if self.backend == "remote":
+            raise ValueError("snapshots need a local backend, not remote")
+        snapshot = Snapshot.create(self.snapshots_dir(), reason, label)
+        files, tally = save(snapshot.path)
+        snapshot.seal(files, tally, **self._snapshot_context())
+        return snapshot
+
+    def take_snapshot(self, label=None):
+        """Save the current round's ballots and voter marks as they are now; returns the snapshot"""
+        with metrics.timer("snapshot", election=self.id):
+            return self._retire("manual", self.store().snapshot, label)
+
+    def restore_snapshot(self, name):
+        """Put the ballots of snapshot ``name`` back in place of the current round's
+
+        The ballots it replaces are snapshotted first, so a restore can be
+        undone too; returns that snapshot.
+        """
+        source = self.get_snapshot(name)
+        if "ledger" in source.meta:
+            raise ValueError(f"snapshot {name!r} only records the ledger shard {source.meta['ledger']}")
+        if source.meta["backend"] != self.backend:
+            raise ValueError(f"snapshot {name!r} was taken with the {source.meta['backend']} backend, "
+                             f"this election uses {self.backend}")
+        if source.meta["round"] != self.round:
+            raise ValueError(f"snapshot {name!r} is from round {source.meta['round']}, "
+                             f"this election is on round {self.round}")
+        with metrics.timer("restore", election=self.id):
+            if self.manifest_path is None:
+                with self._lock:
+                    retired = self._retire("restore", lambda target_dir: self.store().restore(
+                        source.path, source.meta["files"], target_dir))
+                    # The voter index, caches and frames rebuild from the restored store on next use
+                    for resource in ("voter_index", "read_cache", "analytics", "tabulation", "startup_audit"):
+                        self._resources.pop(resource, None)
+                    self._refresh_live()
+                return retired
+            with self._lock, self._manifest_lock:
+                self._reload()
+                store = self.store()
+                store.retire()
+                retired = self._retire("restore", store.detach)
+                shard_dir = os.path.join(self.data_dir, self._next_shard()["shard"])
+                os.makedirs(shard_dir, exist_ok=True)
+                thaw(source.path, source.meta["files"],
+                     [os.path.join(shard_dir, file_name) for file_name in source.meta["files"]])
+                self._switch_shard()
+            return retired
+
+    def _next_shard(self):
+        config = dict(self.config)
+        config["resets"] = config.get("resets", 0) + 1
+        config["shard"] = shard_name(config["round"], config["resets"])
+        return config
+
+    def _switch_shard(self):
+        """Point the manifest at the next shard and drop the old one, emptied by now
+        (call with both locks held)"""
+        old_shard = self.shard_dir
+        self._write_manifest(self._next_shard())
+        if self.backend != "remote":
+            discard(old_shard)
+
+    def new_round(self, candidates=None, method=None):
+        """Close the current round, keeping its shard and final tally, and open the next"""
+        if candidates is not None and len(set(candidates)) < 2:
+            raise ValueError("a round needs at least two distinct candidates")
+        if method is not None and method not in METHODS:
+            raise ValueError(f"method must be one of {', '.join(METHODS)}")
+        with self._lock, self._manifest_lock:
+            self._reload()
+            config = dict(self.config)
+            config["rounds"] = config.get("rounds", []) + [{
+                "round": self.round,
+                "shard": config["shard"],
+                "candidates": self.candidates,
+                "method": self.method,
+                "results": self.get_results(),
+                "closed_at": datetime.now().isoformat(),
+            }]
+            config["round"] = self.round + 1
+            config["resets"] = 0
+            config["shard"] = shard_name(config["round"])
+            if candidates is not None:
+                config["candidates"] = list(candidates)
+            if method is not None:
+                config["method"] = method
+            self._write_manifest(config)
+        return self.round
+
+
+class ElectionRegistry:
+    """The elections under ``root``, each opened on first use and kept open"""
+
+    def __init__(self, root, settings=None):
+        self.root = root
+        self.settings = settings
+        self._elections = {}
+        self._lock = threading.Lock()
+
+    def _dir(self, election_id):
+        if not isinstance(election_id, str) or not ELECTION_ID.match(election_id):
+            raise ElectionNotFoundError(election_id)
+        return os.path.join(self.root, election_id)
+
+    def get(self, election_id):
+        election = self._elections.get(election_id)
+        if election is None:
+            with self._lock:
+                election = self._elections.get(election_id)
+                if election is None:
+                    data_dir = self._dir(election_id)
+                    manifest_path = os.path.join(data_dir, MANIFEST)
+                    if not os.path.exists(manifest_path):
+                        raise ElectionNotFoundError(election_id)
+                    election = Election(None, data_dir, manifest_path=manifest_path, settings=self.settings)
+                    self._elections[election_id] = election
+        return election
+
+    def ids(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if ELECTION_ID.match(name) and os.path.exists(os.path.join(self.root, name, MANIFEST)))
+
+    def create(self, election_id, title, candidates, roll, method="plurality", admin_id=None, backend=None):
+        """Create an election; ``roll`` is a roll file (copied in) or a ``{user_id: name}`` dict"""
+        if election_id == DEFAULT_ELECTION or not ELECTION_ID.match(election_id or ""):
+            raise ValueError(f"invalid election id {election_id!r}")
+        if len(set(candidates)) < 2:
+            raise ValueError("an election needs at least two distinct candidates")
+        if method not in METHODS:
+            raise ValueError(f"method must be one of {', '.join(METHODS)}")
+        data_dir = self._dir(election_id)
+        os.makedirs(self.root, exist_ok=True)
+        try:
+            os.mkdir(data_dir)
+        except FileExistsError:
+            raise ValueError(f"election {election_id!r} already exists") from None
+        if isinstance(roll, str):
+            roll_file = "roll" + os.path.splitext(roll)[1]
+            shutil.copyfile(roll, os.path.join(data_dir, roll_file))
+            roll = roll_file
+        config = {
+            "id": election_id,
+            "title": title or election_id,
+            "candidates": list(candidates),
+            "method": method,
+            "admin_id": admin_id,
+            "roll": roll,
+            "backend": backend or (self.settings or DEFAULT_SETTINGS).get("backend", "json"),
+            "round": 1,
+            "resets": 0,
+            "shard": shard_name(1),
+            "created_at": datetime.now().isoformat(),
+        }
+        atomic_write(os.path.join(data_dir, MANIFEST), json.dumps(config, ensure_ascii=False, indent=2).encode("utf-8"))
+        return self.get(election_id)
+
+    def archive(self, election_id):
+        """Move an election under ``_archive/``; returns where it went"""
+        election = self.get(election_id)
+        archive_dir = os.path.join(self.root, ARCHIVE_DIR)
+        os.makedirs(archive_dir, exist_ok=True)
+        target = os.path.join(archive_dir, f"{election_id}-{datetime.now().strftime('%Y%m%d%H%M%S%f')}")
+        with election._lock, election._manifest_lock:
+            election._release()
+            os.rename(election.data_dir, target)
+        with self._lock:
+            self._elections.pop(election_id, None)
+        return target
+
+    def opened(self):
+        """Elections opened by this process so far"""
+        return list(self._elections.values())
+
+    def close(self):
+        with self._lock:
+            elections, self._elections = list(self._elections.values()), {}
+        for election in elections:
+            election.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the elections hosted by this deployment")
+    parser.add_argument("--root", default=os.environ.get("ELECTIONS_DIR", "elections"))
+    commands = parser.add_subparsers(dest="command", required=True)
+    create_cmd = commands.add_parser("create", help="create an election")
+    create_cmd.add_argument("election_id")
+    create_cmd.add_argument("--title")
+    create_cmd.add_argument("--candidates", required=True, help="JSON array or one name per line")
+    create_cmd.add_argument("--roll", required=True, help="voter roll (.csv, .json or .db from roll.py)")
+    create_cmd.add_argument("--method", choices=METHODS, default="plurality")
+    create_cmd.add_argument("--admin-id")
+    create_cmd.add_argument("--backend", choices=("json", "sqlite", "compact", "remote"))
+    commands.add_parser("list", help="list the elections")
+    round_cmd = commands.add_parser("new-round", help="close the current round and open the next")
+    round_cmd.add_argument("election_id")
+    round_cmd.add_argument("--candidates", help="candidates of the new round (default: the same)")
+    round_cmd.add_argument("--method", choices=METHODS)
+    reset_cmd = commands.add_parser("reset", help="snapshot the current round's ballots and start it over")
+    reset_cmd.add_argument("election_id")
+    snapshot_cmd = commands.add_parser("snapshot", help="snapshot the current round's ballots")
+    snapshot_cmd.add_argument("election_id")
+    snapshot_cmd.add_argument("--label")
+    snapshots_cmd = commands.add_parser("snapshots", help="list an election's snapshots")
+    snapshots_cmd.add_argument("election_id")
+    restore_cmd = commands.add_parser("restore", help="put a snapshot's ballots back in the current round")
+    restore_cmd.add_argument("election_id")
+    restore_cmd.add_argument("snapshot")
+    archive_cmd = commands.add_parser("archive", help="move an election to the archive")
+    archive_cmd.add_argument("election_id")
+    args = parser.parse_args(argv)
+
+    registry = ElectionRegistry(args.root, {"backend": os.environ.get("VOTING_STORAGE", "json"),
+                                            "ledger_url": os.environ.get("VOTING_LEDGER_URL"),
+                                            "ledger_token": os.environ.get("VOTING_LEDGER_TOKEN")})
+    try:
+        if args.command == "create":
+            election = registry.create(args.election_id, args.title, load_candidates(args.candidates),
+                                       args.roll, args.method, args.admin_id, args.backend)
+            print(f"Created {election.id}: {len(election.valid_users)} voters, "
+                  f"candidates {', '.join(election.candidates)}")
+        elif args.command == "list":
+            for election_id in registry.ids():
+                election = registry.get(election_id)
+                print(f"{election.id}\tround {election.round}\t{election.method}\t{election.title}")
+        elif args.command == "new-round":
+            candidates = load_candidates(args.candidates) if args.candidates else None
+            print(f"{args.election_id} is now on round {registry.get(args.election_id).new_round(candidates, args.method)}")
+        elif args.command == "reset":
+            election = registry.get(args.election_id)
+            election.reset()
+            print(f"Reset {args.election_id}; the ballots are in snapshot {election.snapshots()[0].name}")
+        elif args.command == "snapshot":
+            snapshot = registry.get(args.election_id).take_snapshot(args.label)
+            print(f"Snapshot {snapshot.name}: {snapshot.meta['ballots']} ballots")
+        elif args.command == "snapshots":
+            for snapshot in registry.get(args.election_id).snapshots():
+                meta = snapshot.meta
+                print(f"{snapshot.name}\tround {meta['round']}\t{meta['ballots']} ballots\t{meta['label']}")
+        elif args.command == "restore":
+            retired = registry.get(args.election_id).restore_snapshot(args.snapshot)
+            print(f"Restored {args.snapshot}; the ballots it replaced are in snapshot {retired.name}")
+        elif args.command == "archive":
+            print(f"Archived {args.election_id} to {registry.archive(args.election_id)}")
+    except (ValueError, ElectionNotFoundError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        registry.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
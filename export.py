@@ -0,0 +1,248 @@
+"""Streaming export of the anonymous ballots and the tally.
+
+Every format is produced by a generator of byte chunks, written one chunk
+of ``chunk_size`` ballots at a time, so memory stays bounded however many
+ballots there are:
+
+- ``csv`` and ``ndjson``: text, one ballot per row/line;
+- ``parquet``: one row group per chunk;
+- ``arrow``: an Arrow IPC stream, one record batch per chunk.
+
+Parquet and Arrow need ``pyarrow``. From the data directory:
+
+    python export.py ballots --format parquet -o ballots.parquet
+    python export.py tally --format csv
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from analytics import read_ndjson, records_frame
+from storage import CompactStore, VoteLog
+
+FORMATS = ("csv", "ndjson", "parquet", "arrow")
+DATASETS = ("ballots", "tally")
+MIME_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+BALLOT_COLUMNS = ["vote_id", "candidate", "timestamp", "ranking"]
+DEFAULT_CHUNK_SIZE = 100000
+
+
+def _ballot_frame(frame):
+    """Fixed export schema; rankings become JSON text so every chunk has the same types"""
+    frame = frame.reindex(columns=BALLOT_COLUMNS)
+    frame["vote_id"] = frame["vote_id"].astype("int64")
+    frame["candidate"] = frame["candidate"].astype("str")
+    frame["timestamp"] = frame["timestamp"].astype("str")
+    frame["ranking"] = pd.array([
+        json.dumps(list(ranking), ensure_ascii=False)
+        if isinstance(ranking, (list, np.ndarray)) and len(ranking) else None
+        for ranking in frame["ranking"]
+    ], dtype="string")
+    return frame
+
+
+def _log_blocks(store, block_size):
+    """Committed ballot log in blocks of whole lines"""
+    start, end, _ = store.committed_span()
+    with open(store.votes_path, 'rb') as f:
+        f.seek(start)
+        position = start
+        rest = b""
+        while position < end:
+            data = rest + f.read(min(block_size, end - position))
+            position = f.tell()
+            cut = data.rfind(b"\n") + 1
+            rest = data[cut:]
+            if cut:
+                yield data[:cut]
+
+
+def _log_line_size(store):
+    """Average bytes per ballot in the log, to turn a chunk size into a block size"""
+    with open(store.votes_path, 'rb') as f:
+        sample = f.read(65536)
+    lines = sample.count(b"\n")
+    return max(len(sample) // lines, 1) if lines else 128
+
+
+def _record_chunks(store, chunk_size):
+    """Compact-store records converted a column at a time, timestamps as ISO text"""
+    records = store.records()
+    candidates = store.candidates()
+    names = np.array(candidates + [None], dtype=object)
+    for start in range(0, len(records), chunk_size):
+        chunk = records[start:start + chunk_size]
+        frame = records_frame(chunk, candidates)
+        frame["timestamp"] = np.datetime_as_string(frame["timestamp"].to_numpy(), unit="ms")
+        if store.rank_slots:
+            # Empty slots map to the trailing None
+            ranks = np.minimum(chunk["ranking"], len(candidates))
+            frame["ranking"] = [[name for name in row if name is not None] or None for row in names[ranks]]
+        yield frame
+
+
+def ballot_chunks(store, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the committed ballots as DataFrames of about ``chunk_size`` rows
+
+    An empty store yields one empty frame, so exports still get a header
+    or schema.
+    """
+    empty = True
+    if isinstance(store, VoteLog):
+        for block in _log_blocks(store, chunk_size * _log_line_size(store)):
+            empty = False
+            yield _ballot_frame(read_ndjson(block))
+    elif isinstance(store, CompactStore):
+        for frame in _record_chunks(store, chunk_size):
+            empty = False
+            yield _ballot_frame(frame)
+    else:
+        rows = []
+        for vote in store.iter_votes():
+            rows.append(vote)
+            if len(rows) >= chunk_size:
+                empty = False
+                yield _ballot_frame(pd.DataFrame(rows))
+                rows = []
+        if rows:
+            empty = False
+            yield _ballot_frame(pd.DataFrame(rows))
+    if empty:
+        yield _ballot_frame(pd.DataFrame(columns=BALLOT_COLUMNS))
+
+
+def _ndjson_chunks(store, chunk_size):
+    """Ballots as NDJSON in the log's own record format"""
+    lines = []
+    for vote in store.iter_votes():
+        lines.append(json.dumps(vote, ensure_ascii=False))
+        if len(lines) >= chunk_size:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def tally_chunks(store, candidates):
+    tally = store.tally()
+    names = list(candidates) + sorted(set(tally) - set(candidates))
+    yield pd.DataFrame({"candidate": names, "votes": [tally.get(name, 0) for name in names]})
+
+
+class _Drain:
+    """Write-only file object that hands back what was written since the last drain"""
+
+    def __init__(self):
+        self._parts = []
+        self.closed = False
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet and Arrow exports need pyarrow (pip install pyarrow)") from None
+    return pyarrow
+
+
+def encode_chunks(frames, fmt):
+    """Encode DataFrames as a stream of ``fmt`` byte chunks"""
+    if fmt == "csv":
+        for i, frame in enumerate(frames):
+            yield frame.to_csv(index=False, header=i == 0).encode("utf-8")
+    elif fmt == "ndjson":
+        for frame in frames:
+            if len(frame):
+                yield frame.to_json(orient="records", lines=True, force_ascii=False).encode("utf-8")
+    elif fmt in ("parquet", "arrow"):
+        pa = _pyarrow()
+        sink = _Drain()
+        writer = None
+        for frame in frames:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if writer is None:
+                schema = table.schema
+                writer = (pa.parquet.ParquetWriter(sink, schema) if fmt == "parquet"
+                          else pa.ipc.new_stream(sink, schema))
+            writer.write_table(table.cast(schema))
+            yield sink.drain()
+        if writer is not None:
+            writer.close()
+            yield sink.drain()
+    else:
+        raise ValueError(f"unknown export format {fmt!r}")
+
+
+def export(store, dataset="ballots", fmt="csv", chunk_size=DEFAULT_CHUNK_SIZE, candidates=()):
+    """Stream ``dataset`` ("ballots" or "tally") as ``fmt`` byte chunks"""
+    if dataset == "ballots":
+        if fmt == "ndjson":
+            if isinstance(store, VoteLog):
+                # The log already is NDJSON with anonymous ballots: copy it as is
+                return _log_blocks(store, chunk_size * _log_line_size(store))
+            return _ndjson_chunks(store, chunk_size)
+        frames = ballot_chunks(store, chunk_size)
+    elif dataset == "tally":
+        frames = tally_chunks(store, candidates)
+    else:
+        raise ValueError(f"unknown export dataset {dataset!r}")
+    return encode_chunks(frames, fmt)
+
+
+def export_filename(dataset, fmt, now):
+    return f"{dataset}_segunda_vuelta_{now.strftime('%Y%m%d_%H%M')}.{fmt}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the anonymous ballots or the tally")
+    parser.add_argument("dataset", choices=DATASETS)
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("-o", "--output", default="-", help="output file, - for stdout")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    import core
+    start = time.perf_counter()
+    written = 0
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, 'wb')
+    try:
+        for chunk in export(core.get_store(), args.dataset, args.format, args.chunk_size,
+                            core.RUNOFF_CANDIDATES):
+            out.write(chunk)
+            written += len(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    print(f"Exported {args.dataset} as {args.format}: {written / 1e6:.1f}MB in "
+          f"{time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,352 @@
+"""Vote ledger: one authoritative ballot store shared by every app replica.
+
+Replicas behind a load balancer each keep their own data directory, so
+on their own they neither see each other's ballots nor stop a voter from
+voting once per replica. Run one ledger and point every replica at it:
+
+    python ledger.py --data-dir ledger --port 8765 --token s3cret
+    VOTING_STORAGE=remote VOTING_LEDGER_URL=http://ledger-host:8765 VOTING_LEDGER_TOKEN=s3cret \\
+        streamlit run app.py
+
+The ledger is the only writer of its stores (json log or SQLite, as
+usual). It enforces the one-vote rule for all replicas, group-commits
+the ballots they send in a single ingestion queue per store, and answers
+login checks from one voter index. Each election shard is a named store
+(``default``, ``consejo/round-1``...) under ``--data-dir``. Elections
+other than the default one keep their manifest in ``ELECTIONS_DIR``,
+which replicas must then share (or be given the same copy of).
+
+Resetting a store (``clear``) moves its ballots to a snapshot under its
+directory (``<store>/snapshots/``), which ``audit.py recount`` can check;
+the ledger never deletes ballots itself.
+
+Requests are ``POST /<operation>`` with a JSON body naming the store; see
+``storage.remote.RemoteStore`` for the client. ``GET /metrics`` serves
+the ledger's own timings.
+"""
+import argparse
+import hmac
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import metrics
+from elections import SNAPSHOT_DIR, STORE_FILES
+from storage import AlreadyVotedError, Snapshot, SqliteStore, VoteIngestor, VoteLog, VoterIndex
+
+# A store name is one or more path segments, each starting with a letter or digit (no "..")
+STORE_NAME = re.compile(r"^[a-z0-9][a-z0-9_.-]{0,63}(/[a-z0-9][a-z0-9_.-]{0,63}){0,3}$")
+MAX_BODY_BYTES = 64 * 2**20  # a legacy import carries a whole election
+STREAM_CHUNK_BYTES = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def content_length(headers):
+    """The request's Content-Length (0 when absent), or None when it is not a number of bytes"""
+    value = (headers.get("Content-Length") or "0").strip()
+    return int(value) if value.isascii() and value.isdigit() else None
+
+
+class LedgerStore:
+    """One named store with its ingestion queue and voter index"""
+
+    def __init__(self, path, backend, max_batch, bloom_capacity):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_batch = max_batch
+        if backend == "sqlite":
+            self.store = SqliteStore(os.path.join(path, STORE_FILES["sqlite"]))
+        else:
+            self.store = VoteLog(os.path.join(path, STORE_FILES["votes"]), os.path.join(path, STORE_FILES["users"]))
+        self.index = VoterIndex(self.store, bloom_capacity=bloom_capacity)
+        self.ingestor = VoteIngestor(self.store, max_batch=max_batch)
+        # Bumped by every change that is not a new ballot, so replica caches notice
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def replace(self, change):
+        """Run ``change()`` with the ingestion queue drained and stopped, then restart it"""
+        with self.lock:
+            self.ingestor.close()
+            try:
+                return change()
+            finally:
+                self.index.warm()
+                self.generation += 1
+                self.ingestor = VoteIngestor(self.store, max_batch=self.max_batch)
+
+    def close(self):
+        with self.lock:
+            self.ingestor.close()
+            self.store.close()
+
+
+class Ledger:
+    """The named stores under ``root``, each opened on first use"""
+
+    def __init__(self, root, backend="json", max_batch=256, bloom_capacity=None, commit_timeout=10):
+        self.root = root
+        self.backend = backend
+        self.max_batch = max_batch
+        self.bloom_capacity = bloom_capacity
+        self.commit_timeout = commit_timeout
+        # Part of every stamp, so a restarted ledger never matches a replica's old cache entry
+        self.boot = uuid.uuid4().hex
+        self._stores = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        if not isinstance(name, str) or not STORE_NAME.match(name):
+            raise ValueError(f"invalid store name {name!r}")
+        entry = self._stores.get(name)
+        if entry is None:
+            with self._lock:
+                entry = self._stores.get(name)
+                if entry is None:
+                    entry = self._stores[name] = LedgerStore(
+                        os.path.join(self.root, *name.split("/")), self.backend, self.max_batch, self.bloom_capacity)
+        return entry
+
+    def record_votes(self, entry, body):
+        with entry.lock:
+            futures = [entry.ingestor.submit(user_id, candidate, ranking)
+                       for user_id, candidate, ranking in body["ballots"]]
+        results = []
+        for (user_id, _, _), future in zip(body["ballots"], futures):
+            try:
+                results.append(future.result(self.commit_timeout))
+            except AlreadyVotedError:
+                results.append(None)
+                continue
+            entry.index.add(user_id)
+        return {"results": results}
+
+    def has_voted(self, entry, body):
+        return {"voted": entry.index.has_voted(body["user_id"])}
+
+    def voted_users(self, entry, body):
+        return {"users": entry.store.voted_users()}
+
+    def state(self, entry, body):
+        count = entry.store.vote_count()
+        return {"vote_count": count, "tally": entry.store.tally(),
+                "stamp": [self.boot, entry.generation, count]}
+
+    def recount(self, entry, body):
+        return {"tally": entry.store.recount()}
+
+    def verify_tally(self, entry, body):
+        return {"mismatches": entry.store.verify_tally()}
+
+    def repair_tally(self, entry, body):
+        entry.replace(entry.store.repair_tally)
+        return {}
+
+    def chain_head(self, entry, body):
+        return {"chain_head": entry.store.chain_head()}
+
+    def verify_chain(self, entry, body):
+        return {"report": entry.store.verify_chain(body.get("incremental", False), body.get("processes"))}
+
+    def clear(self, entry, body):
+        """Move the store's ballots to a snapshot kept next to it and start it over empty
+
+        Returns the snapshot's name (``<store>/snapshots/<name>``, under the
+        ledger's data directory) and its tally; nothing is deleted.
+        """
+        snapshot = Snapshot.create(os.path.join(entry.path, SNAPSHOT_DIR), "reset")
+        files, tally = entry.replace(lambda: entry.store.detach(snapshot.path))
+        snapshot.seal(files, tally, store=body["store"], backend=self.backend)
+        return {"cleared": snapshot.meta["ballots"] > 0, "results": tally,
+                "snapshot": f"{body['store']}/{SNAPSHOT_DIR}/{snapshot.name}"}
+
+    def import_legacy(self, entry, body):
+        """Import a replica's old whole-file JSON stores, into a store nobody voted in yet
+
+        Each replica may start with legacy files of its own; only the first
+        one reaches an empty store. The others are refused (``imported``
+        false) and the replica keeps its files, so no ballot is replaced.
+        """
+        votes_file = os.path.join(entry.path, "legacy_votes.json")
+        users_file = os.path.join(entry.path, "legacy_users.json")
+
+        def import_if_empty():
+            # The ingestion queue is stopped: no ballot can land between the check and the import
+            if entry.store.vote_count() or entry.store.voted_users():
+                return False
+            with open(votes_file, 'w', encoding="utf-8") as f:
+                json.dump({f"vote_{vote['vote_id']}": vote for vote in body["votes"]}, f, ensure_ascii=False)
+            with open(users_file, 'w', encoding="utf-8") as f:
+                json.dump(body["users"], f, ensure_ascii=False)
+            return entry.store.import_legacy(votes_file, users_file)
+
+        for path in (votes_file, users_file):
+            if os.path.exists(path + ".migrated"):
+                os.remove(path + ".migrated")
+        try:
+            return {"imported": entry.replace(import_if_empty)}
+        finally:
+            for path in (votes_file, users_file, votes_file + ".migrated", users_file + ".migrated"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def iter_votes(self, name, after):
+        return self.get(name).store.votes_after(after)
+
+    def close(self):
+        with self._lock:
+            stores, self._stores = list(self._stores.values()), {}
+        for entry in stores:
+            entry.close()
+
+
+OPERATIONS = ("record_votes", "has_voted", "voted_users", "state", "recount", "verify_tally", "repair_tally",
+              "chain_head", "verify_chain", "clear", "import_legacy")
+
+
+class LedgerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # replicas keep one connection per thread
+    server_version = "VoteLedger/1.0"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/metrics":
+            self._send(200, metrics.REGISTRY.render(), metrics.CONTENT_TYPE)
+        elif path == "/health":
+            self._send_json(200, {"status": "ok", "boot": self.server.ledger.boot})
+        else:
+            self._send_json(404, {"error": "no such route"})
+
+    def do_POST(self):
+        op = urlsplit(self.path).path.lstrip("/")
+        try:
+            body = self._read_json()
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        token = self.server.token
+        if token and not hmac.compare_digest(self.headers.get("X-Ledger-Token", ""), token):
+            self._send_json(403, {"error": "bad ledger token"})
+            return
+        if op == "votes":
+            self._stream_votes(body)
+            return
+        if op not in OPERATIONS:
+            self._send_json(404, {"error": f"no such operation {op!r}"})
+            return
+        ledger = self.server.ledger
+        with metrics.timer("ledger", op=op):
+            try:
+                status, payload = 200, getattr(ledger, op)(ledger.get(body.get("store")), body)
+            except (ValueError, KeyError, TypeError) as e:
+                status, payload = 400, {"error": f"bad request: {e}"}
+            except Exception:
+                logger.exception("Ledger operation %s failed", op)
+                metrics.ERRORS.inc(operation="ledger", op=op)
+                status, payload = 500, {"error": "internal error"}
+        self._send_json(status, payload)
+
+    def _read_json(self):
+        length = content_length(self.headers)
+        if length is None or length > MAX_BODY_BYTES:
+            # The body stays unread, so this connection cannot carry another request
+            self.close_connection = True
+            raise ValueError("bad Content-Length" if length is None else "request too large")
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not isinstance(body, dict):
+            raise ValueError("expected a JSON object")
+        return body
+
+    def _stream_votes(self, body):
+        """Every ballot after ``after``, as chunked NDJSON"""
+        try:
+            votes = self.server.ledger.iter_votes(body.get("store"), int(body.get("after", 0)))
+        except (ValueError, TypeError) as e:
+            self._send_json(400, {"error": f"bad request: {e}"})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            block = []
+            size = 0
+            for vote in votes:
+                line = json.dumps(vote, ensure_ascii=False).encode("utf-8") + b"\n"
+                block.append(line)
+                size += len(line)
+                if size >= STREAM_CHUNK_BYTES:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (size, b"".join(block)))
+                    block, size = [], 0
+            if block:
+                self.wfile.write(b"%x\r\n%s\r\n" % (size, b"".join(block)))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        except Exception:
+            # Too late for an error status; cut the stream so the client sees it incomplete
+            logger.exception("Streaming ballots failed")
+            self.close_connection = True
+
+    def _send_json(self, status, payload):
+        self._send(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def _send(self, status, data, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_request(self, code="-", size="-"):
+        pass
+
+
+class LedgerServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # every replica thread holds a connection
+
+
+def make_server(ledger, host="127.0.0.1", port=8765, token=None):
+    server = LedgerServer((host, port), LedgerHandler)
+    server.ledger = ledger
+    server.token = token
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Vote ledger shared by every replica of the app")
+    parser.add_argument("--data-dir", default="ledger")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--max-batch", type=int, default=256, help="ballots committed together")
+    parser.add_argument("--bloom-capacity", type=int, default=None, help="expected voters per store")
+    parser.add_argument("--token", default=os.environ.get("VOTING_LEDGER_TOKEN"),
+                        help="shared secret replicas must send (default: $VOTING_LEDGER_TOKEN)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    ledger = Ledger(args.data_dir, args.backend, args.max_batch, args.bloom_capacity)
+    server = make_server(ledger, args.host, args.port, args.token)
+    print(f"Vote ledger on http://{args.host}:{server.server_port} storing in {os.path.abspath(args.data_dir)}",
+          flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        ledger.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""Coalesced live tally broadcasting for results watchers.
+
+One publisher thread per process looks at the tally at most ``rate_hz``
+times a second, and only while someone is watching. When the tally has
+changed it encodes the update once and wakes every watcher, who writes
+the same bytes out. Server work therefore follows the vote rate (capped
+at ``rate_hz``), not the number of watchers times their refresh rate.
+Watchers either block in ``wait`` (the SSE stream) or poll ``latest``
+(the Streamlit views, from a timed fragment).
+"""
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# A poll keeps the publisher reading for this many intervals
+POLL_LEASE_INTERVALS = 10
+
+
+class TallyBroadcaster:
+    """Publish tally changes from ``read_tally()`` to any number of watchers"""
+
+    def __init__(self, read_tally, rate_hz=2.0):
+        self.read_tally = read_tally
+        self.interval = 1.0 / rate_hz
+        self.published = 0
+        self._cond = threading.Condition()
+        self._watchers = 0
+        self._version = 0
+        self._tally = None
+        self._event = None
+        self._closed = False
+        self._polled = float("-inf")
+        self._thread = threading.Thread(target=self._run, name="tally-broadcaster", daemon=True)
+        self._thread.start()
+
+    def subscribe(self):
+        """Register a watcher; returns the version to pass to the first ``wait``
+
+        A new watcher receives the latest published tally straight away.
+        """
+        with self._cond:
+            self._watchers += 1
+            return self._version - 1 if self._event else 0
+
+    def unsubscribe(self):
+        with self._cond:
+            self._watchers -= 1
+
+    def wait(self, seen_version, timeout=None):
+        """Block until a version newer than ``seen_version`` is published
+
+        Returns ``(version, event_bytes)``, or ``(seen_version, None)`` on
+        timeout.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._version > seen_version, timeout):
+                return seen_version, None
+            return self._version, self._event
+
+    def latest(self):
+        """The latest ``(version, tally)``, for watchers that poll instead of ``wait``
+
+        A poll counts as watching for the next ``POLL_LEASE_INTERVALS``
+        intervals; the first one after that reads the tally itself, so it is
+        never older than one interval.
+        """
+        now = time.monotonic()
+        with self._cond:
+            idle = not self._watchers and now - self._polled > POLL_LEASE_INTERVALS * self.interval
+            self._polled = now
+        if idle or self._tally is None:
+            self._publish_if_changed()
+        with self._cond:
+            return self._version, self._tally
+
+    def refresh(self):
+        """Publish the current tally now if it changed, instead of at the next interval"""
+        self._publish_if_changed()
+
+    def close(self):
+        """Stop publishing; the thread exits after its current sleep"""
+        self._closed = True
+
+    def _run(self):
+        while not self._closed:
+            if self._watchers or time.monotonic() - self._polled <= POLL_LEASE_INTERVALS * self.interval:
+                try:
+                    self._publish_if_changed()
+                except Exception:
+                    logger.exception("Could not read the tally for live watchers")
+            time.sleep(self.interval)
+
+    def _publish_if_changed(self):
+        tally = self.read_tally()
+        if tally == self._tally:
+            return
+        payload = {"results": tally, "total_votes": sum(tally.values())}
+        event = f"event: tally\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+        with self._cond:
+            self._tally = tally
+            self._version += 1
+            self._event = event
+            self.published += 1
+            self._cond.notify_all()
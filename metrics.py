@@ -0,0 +1,353 @@
+"""Hot-path timings, counters and an on-demand profiler, in Prometheus text format.
+
+Operations are timed into histograms labelled by operation and election:
+
+    with metrics.timer("save_vote", election="default"):
+        ...
+
+Each process keeps its own metrics. The API serves them at ``/metrics``;
+the Streamlit process serves them on ``METRICS_PORT`` when that is set,
+and the admin panel shows the percentiles. Values that are cheaper to read
+when scraped than to track (file sizes, queue counters) come from
+collectors registered with ``register_collector``.
+
+The profiler is off by default. An admin can switch it to ``cprofile``
+(call statistics of the timed operations) or ``tracemalloc`` (allocation
+sites) at runtime and read the report without restarting anything.
+"""
+import bisect
+import cProfile
+import io
+import logging
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Seconds, 100 µs to 10 s in 1-2-5 steps
+DEFAULT_BUCKETS = (0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05,
+                   0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PROFILE_MODES = ("cprofile", "tracemalloc")
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, with percentile estimates"""
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._by_call = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        # Call sites pass their labels in a fixed order: look the series up
+        # by that order and only sort the labels the first time
+        series = self._by_call.get(tuple(labels.items()))
+        if series is None:
+            series = self._series_for(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _series_for(self, labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            self._by_call[tuple(labels.items())] = series
+        return series
+
+    def quantile(self, q, **labels):
+        """Estimate the ``q`` quantile by interpolating inside its bucket, like ``histogram_quantile``"""
+        series = self._series.get(tuple(sorted(labels.items())))
+        return self._quantile(series, q) if series else None
+
+    def _quantile(self, series, q):
+        counts, _, total = series
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                if i == len(self.buckets):
+                    return lower  # above the last bucket: its bound is all we know
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return 0.0
+
+    def summary(self):
+        """``[(labels, count, mean, p50, p95, p99)]`` for every label set"""
+        with self._lock:
+            series = {key: ([*counts], total, n) for key, (counts, total, n) in self._series.items()}
+        rows = []
+        for key, s in sorted(series.items()):
+            _, total, n = s
+            rows.append((dict(key), n, total / n, self._quantile(s, 0.5),
+                         self._quantile(s, 0.95), self._quantile(s, 0.99)))
+        return rows
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: ([*counts], total, n) for key, (counts, total, n) in self._series.items()}
+        for labels, (counts, total, n) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_text(labels + (('le', _number(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_label_text(labels)} {n}")
+        return lines
+
+
+class Profiler:
+    """Profile the timed operations on demand, with cProfile or tracemalloc
+
+    cProfile profiles one operation at a time (the profiler is process
+    wide), so an operation that starts while another is being profiled is
+    timed as usual but left out of the report. tracemalloc records every
+    allocation from when it is switched on, and is read as a snapshot.
+    """
+
+    def __init__(self):
+        self.mode = None
+        self.profiled = 0
+        self.skipped = 0
+        self.started = None
+        self._stats = None
+        self._busy = threading.Lock()
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    def enable(self, mode):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"profiling mode must be one of {', '.join(PROFILE_MODES)}")
+        with self._lock:
+            self.disable()
+            if mode == "tracemalloc":
+                tracemalloc.start(10)
+            self.mode = mode
+            self.started = time.time()
+
+    def disable(self):
+        with self._lock:
+            if self.mode == "tracemalloc":
+                tracemalloc.stop()
+            self.mode = None
+            self._stats = None
+            self.profiled = self.skipped = 0
+
+    @contextmanager
+    def profile(self):
+        if self.mode != "cprofile" or getattr(self._local, "active", False):
+            # Off, or nested in an operation this thread is already profiling
+            yield
+            return
+        if not self._busy.acquire(blocking=False):
+            self.skipped += 1
+            yield
+            return
+        profile = cProfile.Profile()
+        self._local.active = True
+        try:
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+            with self._lock:
+                if self.mode == "cprofile":
+                    if self._stats is None:
+                        self._stats = pstats.Stats(profile)
+                    else:
+                        self._stats.add(profile)
+                    self.profiled += 1
+        finally:
+            self._local.active = False
+            self._busy.release()
+
+    def report(self, limit=30):
+        """Text report of what was collected since the profiler was switched on"""
+        with self._lock:
+            if self.mode == "cprofile":
+                if self._stats is None:
+                    return "cprofile: no operation profiled yet"
+                out = io.StringIO()
+                self._stats.stream = out
+                self._stats.sort_stats("cumulative").print_stats(limit)
+                return f"cprofile: {self.profiled} operations profiled, {self.skipped} skipped\n{out.getvalue()}"
+            if self.mode == "tracemalloc":
+                current, peak = tracemalloc.get_traced_memory()
+                lines = [f"tracemalloc: {current / 1e6:.1f}MB traced now, {peak / 1e6:.1f}MB peak"]
+                for stat in tracemalloc.take_snapshot().statistics("lineno")[:limit]:
+                    lines.append(str(stat))
+                return "\n".join(lines)
+            return "profiling is off"
+
+
+class Metrics:
+    """Named counters and histograms, plus collectors read at scrape time"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self.profiler = Profiler()
+
+    def _get(self, cls, name, help_text, *args):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, help_text, *args)
+            return self._metrics[name]
+
+    def counter(self, name, help_text):
+        return self._get(Counter, name, help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets)
+
+    def register_collector(self, collect):
+        """``collect()`` returns ``[(name, type, help, [(labels dict, value), ...]), ...]``"""
+        self._collectors.append(collect)
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            try:
+                families = collect()
+            except Exception:
+                logger.exception("Metrics collector failed")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_label_text(tuple(sorted(labels.items())))} {_number(value)}")
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+REGISTRY = Metrics()
+OPERATION_SECONDS = REGISTRY.histogram("voting_operation_seconds", "Time spent in voting operations")
+ERRORS = REGISTRY.counter("voting_errors_total", "Operations that raised an unexpected error")
+VOTES = REGISTRY.counter("voting_votes_total", "Ballots committed")
+REJECTIONS = REGISTRY.counter("voting_rejections_total", "Logins and ballots turned away, by reason")
+
+
+class timer:
+    """Time a block into ``voting_operation_seconds``; unexpected errors are counted too
+
+    A class rather than a generator context manager: it runs on every vote
+    and login check, so it is kept to two clock reads and one locked update
+    while the profiler is off.
+    """
+
+    __slots__ = ("labels", "start", "profiling")
+
+    def __init__(self, operation, **labels):
+        labels["operation"] = operation
+        self.labels = labels
+        self.profiling = None
+
+    def __enter__(self):
+        if REGISTRY.profiler.mode is not None:
+            self.profiling = REGISTRY.profiler.profile()
+            self.profiling.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        if self.profiling is not None:
+            self.profiling.__exit__(exc_type, exc, tb)
+        if exc_type is not None and issubclass(exc_type, Exception):
+            ERRORS.inc(**self.labels)
+        OPERATION_SECONDS.observe(elapsed, **self.labels)
+        return False
+
+
+def _process_metrics():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak_bytes = peak if sys.platform == "darwin" else peak * 1024
+    return [("voting_process_peak_rss_bytes", "gauge", "Peak resident memory of this process",
+             [({}, peak_bytes)])]
+
+
+if resource is not None:
+    REGISTRY.register_collector(_process_metrics)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        data = REGISTRY.render()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_request(self, code="-", size="-"):
+        pass
+
+
+def serve(port, host="127.0.0.1"):
+    """Serve this process's metrics at ``http://host:port/`` from a daemon thread"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
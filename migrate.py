@@ -0,0 +1,120 @@
+"""Convert a ballot store to the compact binary format (``VOTING_STORAGE=compact``).
+
+Reads the ballots and voter marks from the append-only log (.ndjson),
+a SQLite store (.db) or the old whole-file JSON stores (.json), writes
+them as fixed-width records (see ``storage.compact``), checks that the
+new store holds the same ballots and tally, and reports the sizes.
+From the data directory of the default election:
+
+    python migrate.py                        # votes_runoff.ndjson -> votes_runoff.bin
+    python migrate.py votes_runoff.json --users users_runoff.json
+    python migrate.py elections/consejo/round-1/votes.ndjson elections/consejo/round-1/votes.bin
+
+The source is left in place; switch the backend once the check passes.
+An election's manifest takes ``"backend": "compact"``.
+"""
+import argparse
+import os
+import sys
+import time
+
+from storage import CompactStore, SqliteStore, VoteLog
+from storage.base import read_legacy
+
+
+class _LegacySource:
+    """The whole-file JSON stores, read once"""
+
+    def __init__(self, votes_file, users_file):
+        self.votes, self.users = read_legacy(votes_file, users_file)
+
+    def iter_votes(self):
+        return iter(self.votes)
+
+    def voted_users(self):
+        return list(self.users)
+
+    def vote_count(self):
+        return len(self.votes)
+
+    def recount(self):
+        counts = {}
+        for vote in self.votes:
+            counts[vote["candidate"]] = counts.get(vote["candidate"], 0) + 1
+        return counts
+
+    def close(self):
+        pass
+
+
+def open_source(path, users_path=None):
+    if path.endswith(".db"):
+        return SqliteStore(path), [path, path + "-wal"]
+    if users_path is None:
+        users_path = os.path.join(os.path.dirname(path), os.path.basename(path).replace("votes", "users", 1))
+    if path.endswith(".json"):
+        return _LegacySource(path, users_path), [path, users_path]
+    return VoteLog(path, users_path), [path, users_path, path + ".checkpoint", path + ".merkle"]
+
+
+def _size(paths):
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def migrate(source, target):
+    """Copy ``source``'s ballots and voter marks into the compact store ``target``
+
+    Returns the problems found comparing the two afterwards (empty when
+    they match).
+    """
+    target.import_votes(source.iter_votes(), source.voted_users())
+    problems = []
+    if target.vote_count() != source.vote_count():
+        problems.append(f"{target.vote_count()} ballots written, the source has {source.vote_count()}")
+    if target.recount() != source.recount():
+        problems.append(f"tally {target.recount()} differs from the source's {source.recount()}")
+    if target.voted_users() != source.voted_users():
+        problems.append("the voter marks differ from the source's")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a ballot store to the compact binary format")
+    parser.add_argument("source", nargs="?", default="votes_runoff.ndjson",
+                        help="ballot log (.ndjson), SQLite store (.db) or old JSON store (.json)")
+    parser.add_argument("target", nargs="?", help="compact ballot file (default: the source with .bin)")
+    parser.add_argument("--users", help="voter marks of a log or JSON store (default: votes -> users in the name)")
+    parser.add_argument("--force", action="store_true", help="replace a target that already holds ballots")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.source):
+        print(f"{args.source} not found", file=sys.stderr)
+        return 1
+    target_path = args.target or os.path.splitext(args.source)[0] + ".bin"
+    if os.path.exists(target_path) and CompactStore(target_path).vote_count() and not args.force:
+        print(f"{target_path} already holds ballots; pass --force to replace them", file=sys.stderr)
+        return 1
+
+    source, source_files = open_source(args.source, args.users)
+    target = CompactStore(target_path)
+    try:
+        start = time.perf_counter()
+        problems = migrate(source, target)
+        elapsed = time.perf_counter() - start
+        before = _size(source_files)
+        after = _size(target.data_files() + [target.candidates_path])
+        ballots = target.vote_count()
+        print(f"{ballots} ballots, {len(target.voted_users())} voter marks migrated in {elapsed:.2f}s")
+        print(f"{args.source}: {before} bytes ({before / max(ballots, 1):.1f} per ballot)")
+        print(f"{target_path}: {after} bytes ({after / max(ballots, 1):.1f} per ballot, "
+              f"{target.rank_slots} ranking slots), {before / max(after, 1):.1f}x smaller")
+    finally:
+        source.close()
+        target.close()
+    for problem in problems:
+        print(f"FAIL: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
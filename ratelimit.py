@@ -0,0 +1,116 @@
+"""In-memory rate limiting for the ID checks: voter login, admin access and the API.
+
+IDs are short, so every login form is an oracle a script can query to
+enumerate them, and every guess costs a rerun and a storage read. Each
+client key (a browser session, a client address) gets a token bucket:
+attempts spend a token, tokens refill at ``rate`` per second up to
+``burst``. Past ``free_failures`` consecutive failed attempts the key is
+also locked out, for a time that doubles with each further failure up
+to ``backoff_max``. A success clears the failures.
+
+A check is one dictionary lookup under a lock and comes before any
+storage access, so turning a flood away costs next to nothing. The state
+is bounded: past ``max_keys`` keys the least recently seen is dropped,
+so memory stays flat however many addresses an attacker rotates through.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """Token bucket per key with exponential backoff after failures, LRU-bounded"""
+
+    def __init__(self, rate, burst, free_failures=5, backoff_base=1.0, backoff_max=300.0,
+                 max_keys=100000, clock=time.monotonic):
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate must be positive and burst at least 1")
+        self.rate = rate
+        self.burst = burst
+        self.free_failures = free_failures
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_keys = max_keys
+        self.clock = clock
+        self.evictions = 0
+        # key -> [tokens, refilled_at, consecutive failures, locked_until]
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, key, now):
+        entry = self._keys.get(key)
+        if entry is None:
+            entry = self._keys[key] = [float(self.burst), now, 0, 0.0]
+            if len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._keys.move_to_end(key)
+        return entry
+
+    def retry_after(self, key, cost=1):
+        """Spend ``cost`` tokens of ``key``: 0 when allowed, else the seconds to wait
+
+        ``cost=0`` only checks the failure lockout.
+        """
+        now = self.clock()
+        with self._lock:
+            entry = self._entry(key, now)
+            if entry[3] > now:
+                return entry[3] - now
+            tokens = min(self.burst, entry[0] + (now - entry[1]) * self.rate)
+            entry[1] = now
+            if tokens < cost:
+                entry[0] = tokens
+                return (cost - tokens) / self.rate
+            entry[0] = tokens - cost
+            return 0.0
+
+    def failed(self, key):
+        """Count a failed attempt, locking ``key`` out once past the free failures"""
+        now = self.clock()
+        with self._lock:
+            entry = self._entry(key, now)
+            entry[2] += 1
+            extra = entry[2] - self.free_failures
+            if extra > 0:
+                entry[3] = now + min(self.backoff_base * 2 ** min(extra - 1, 32), self.backoff_max)
+
+    def succeeded(self, key):
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is not None:
+                entry[2] = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class LoginGuard:
+    """Rate limits on ID checks, per browser session and per client address
+
+    Either limiter may be None (turned off), and either key may be None
+    (unknown, e.g. a local connection has no address).
+    """
+
+    def __init__(self, session_limiter=None, address_limiter=None):
+        self.session_limiter = session_limiter
+        self.address_limiter = address_limiter
+
+    def _limits(self, session, address):
+        for limiter, key in ((self.session_limiter, session), (self.address_limiter, address)):
+            if limiter is not None and key is not None:
+                yield limiter, key
+
+    def retry_after(self, session=None, address=None, cost=1):
+        """0 when the attempt may go ahead, else the seconds to wait"""
+        return max((limiter.retry_after(key, cost) for limiter, key in self._limits(session, address)),
+                   default=0.0)
+
+    def failed(self, session=None, address=None):
+        for limiter, key in self._limits(session, address):
+            limiter.failed(key)
+
+    def succeeded(self, session=None, address=None):
+        for limiter, key in self._limits(session, address):
+            limiter.succeeded(key)
@@ -0,0 +1,148 @@
+"""Voter roll and candidate list loaded from files instead of app literals.
+
+Small rolls can be plain JSON (``{"id": "name", ...}``) or CSV (``user_id,name``)
+files, read into a dict. Large rolls are imported once into an indexed
+SQLite file:
+
+    python roll.py import voters.csv roll.db
+
+and opened with ``SqliteRoll``, which reads nothing up front: eligibility
+checks are primary-key lookups and names are only fetched when a page
+needs one, so startup time and memory do not depend on the size of the
+electorate.
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections.abc import Mapping
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS voters (
+    user_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class SqliteRoll(Mapping):
+    """Read-only ``{user_id: name}`` mapping backed by an indexed SQLite roll"""
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.path = path
+        self._local = threading.local()
+        self._size = None
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def __contains__(self, user_id):
+        if not isinstance(user_id, str):
+            return False
+        return self._conn().execute(
+            "SELECT 1 FROM voters WHERE user_id = ?", (user_id,)
+        ).fetchone() is not None
+
+    def __getitem__(self, user_id):
+        row = None
+        if isinstance(user_id, str):
+            row = self._conn().execute(
+                "SELECT name FROM voters WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        if row is None:
+            raise KeyError(user_id)
+        return row[0]
+
+    def __len__(self):
+        if self._size is None:
+            row = self._conn().execute("SELECT value FROM meta WHERE key = 'count'").fetchone()
+            self._size = int(row[0]) if row else self._conn().execute("SELECT COUNT(*) FROM voters").fetchone()[0]
+        return self._size
+
+    def __iter__(self):
+        for (user_id,) in self._conn().execute("SELECT user_id FROM voters"):
+            yield user_id
+
+
+def read_rows(path):
+    """Yield ``(user_id, name)`` pairs from a CSV or JSON roll file"""
+    if path.endswith(".json"):
+        with open(path, 'r', encoding="utf-8") as f:
+            yield from json.load(f).items()
+        return
+    with open(path, 'r', newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if not row or row[0] == "user_id":
+                continue
+            yield row[0].strip(), row[1].strip() if len(row) > 1 else ""
+
+
+def import_roll(source, db_path, chunk_size=50000):
+    """Build an indexed SQLite roll from a CSV or JSON file; returns the voter count"""
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.executescript(SCHEMA)
+    rows = read_rows(source)
+    while True:
+        chunk = [row for _, row in zip(range(chunk_size), rows)]
+        if not chunk:
+            break
+        conn.executemany("INSERT OR REPLACE INTO voters (user_id, name) VALUES (?, ?)", chunk)
+    (count,) = conn.execute("SELECT COUNT(*) FROM voters").fetchone()
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('count', ?)", (str(count),))
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, db_path)
+    return count
+
+
+def load_roll(path):
+    """Open a voter roll: SQLite files lazily, CSV and JSON files into a dict"""
+    if path.endswith((".db", ".sqlite", ".sqlite3")):
+        return SqliteRoll(path)
+    return dict(read_rows(path))
+
+
+def load_candidates(path):
+    """Read the candidate list from a JSON array or a file with one name per line"""
+    with open(path, 'r', encoding="utf-8") as f:
+        if path.endswith(".json"):
+            return list(json.load(f))
+        return [line.strip() for line in f if line.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the voter roll")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_cmd = commands.add_parser("import", help="build an indexed SQLite roll from CSV or JSON")
+    import_cmd.add_argument("source")
+    import_cmd.add_argument("db_path")
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        start = time.perf_counter()
+        count = import_roll(args.source, args.db_path)
+        print(f"Imported {count} voters into {args.db_path} in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,29 @@
+"""Ballot storage engines for the voting app."""
+
+from storage.base import VoteStore
+from storage.cache import SnapshotCache
+from storage.compact import CompactStore
+from storage.errors import AlreadyVotedError, StoreRetiredError
+from storage.ingest import VoteIngestor
+from storage.remote import LedgerError, RemoteStore
+from storage.snapshot import Snapshot, list_snapshots
+from storage.sqlite_store import SqliteStore
+from storage.vote_log import VoteLog
+from storage.voter_index import BloomFilter, VoterIndex
+
+__all__ = [
+    "AlreadyVotedError",
+    "BloomFilter",
+    "CompactStore",
+    "LedgerError",
+    "RemoteStore",
+    "Snapshot",
+    "SnapshotCache",
+    "SqliteStore",
+    "StoreRetiredError",
+    "VoteIngestor",
+    "VoteLog",
+    "VoteStore",
+    "VoterIndex",
+    "list_snapshots",
+]
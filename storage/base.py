@@ -0,0 +1,225 @@
+import json
+import os
+from abc import ABC, abstractmethod
+
+from storage.cache import file_stamp
+from storage.errors import AlreadyVotedError, StoreRetiredError
+from storage.locking import atomic_write
+
+
+class VoteStore(ABC):
+    """Interface shared by the ballot storage backends
+
+    Voter marks and ballots are kept apart so a ballot cannot be traced back
+    to the voter who cast it.
+    """
+
+    @abstractmethod
+    def record_vote(self, user_id, candidate, ranking=None):
+        """Mark ``user_id`` as voted and store an anonymous ballot
+
+        ``ranking`` optionally lists candidates in order of preference, with
+        ``candidate`` as the first choice. Returns the stored ballot and
+        raises ``AlreadyVotedError`` if the voter already has one.
+        """
+
+    def record_votes(self, ballots):
+        """Commit a batch of ``(user_id, candidate)`` or ``(user_id, candidate, ranking)`` tuples
+
+        Returns one entry per tuple: the stored ballot, or the
+        ``AlreadyVotedError`` for a voter who already had one. Backends
+        override this to commit the whole batch with a single sync.
+        """
+        results = []
+        for user_id, candidate, ranking in map(ballot_fields, ballots):
+            try:
+                results.append(self.record_vote(user_id, candidate, ranking))
+            except AlreadyVotedError as e:
+                results.append(e)
+        return results
+
+    @abstractmethod
+    def has_voted(self, user_id):
+        """Check if ``user_id`` has already voted"""
+
+    @abstractmethod
+    def voted_users(self):
+        """List voters in the order they voted"""
+
+    def voters_since(self, cursor=None):
+        """Voter marks committed, by any process, since ``cursor`` (None: since the start)
+
+        Returns ``(cursor, voters, reset)``. ``reset`` means the marks were
+        replaced since ``cursor`` (a clear, reset or restore) and ``voters``
+        lists all of them; otherwise it lists only the new ones. Backends
+        override this to read just the new marks; this fallback rereads
+        them all whenever ``stamp`` changes.
+        """
+        stamp = self.stamp()
+        if cursor == stamp:
+            return cursor, [], False
+        return stamp, self.voted_users(), True
+
+    @abstractmethod
+    def iter_votes(self):
+        """Stream every committed ballot in commit order"""
+
+    def votes_after(self, vote_id):
+        """Stream the committed ballots numbered after ``vote_id``, as ``iter_votes`` does"""
+        for vote in self.iter_votes():
+            if vote["vote_id"] > vote_id:
+                yield vote
+
+    def ballots_after(self, vote_id):
+        """Stream ``(vote_id, candidate, timestamp)`` for ballots numbered after ``vote_id``"""
+        for vote in self.iter_votes():
+            if vote["vote_id"] > vote_id:
+                yield vote["vote_id"], vote["candidate"], vote["timestamp"]
+
+    @abstractmethod
+    def vote_count(self):
+        """Number of ballots committed"""
+
+    @abstractmethod
+    def data_files(self):
+        """Paths whose identity changes whenever the stored data changes"""
+
+    def stamp(self):
+        """Identity of the stored data, changing whenever it changes; keys ``SnapshotCache`` entries"""
+        return tuple(file_stamp(path) for path in self.data_files())
+
+    @abstractmethod
+    def tally(self):
+        """Ballots per candidate, as a dict"""
+
+    def recount(self):
+        """Count ballots per candidate from scratch by reading every ballot"""
+        counts = {}
+        for vote in self.iter_votes():
+            counts[vote["candidate"]] = counts.get(vote["candidate"], 0) + 1
+        return counts
+
+    def verify_tally(self):
+        """Compare the stored tally with a full recount
+
+        Returns ``{candidate: {"stored": n, "recount": m}}`` for every
+        candidate where the two disagree; empty when the tally is sound.
+        """
+        stored, recount = self._tally_and_recount()
+        return {
+            candidate: {"stored": stored.get(candidate, 0), "recount": recount.get(candidate, 0)}
+            for candidate in sorted(set(stored) | set(recount))
+            if stored.get(candidate, 0) != recount.get(candidate, 0)
+        }
+
+    def _tally_and_recount(self):
+        """Read the tally and recount the ballots from the same point in time"""
+        return self.tally(), self.recount()
+
+    def chain_head(self):
+        """Hex hash committing to every ballot so far, or None if the backend keeps no hash chain"""
+        return None
+
+    def verify_chain(self, incremental=False, processes=None):
+        """Check the ballots against their hash chain; None if the backend keeps no hash chain"""
+        return None
+
+    @abstractmethod
+    def repair_tally(self):
+        """Replace the stored tally with a full recount"""
+
+    @abstractmethod
+    def import_legacy(self, votes_file, users_file):
+        """Replace the store with the old whole-file JSON stores, if present and not
+        imported yet (see ``legacy_pending``); returns whether it did"""
+
+    @abstractmethod
+    def clear(self):
+        """Delete every ballot and voter mark; returns whether anything was stored"""
+
+    def snapshot(self, target_dir):
+        """Save a point-in-time copy of the store in ``target_dir`` (see ``storage.snapshot``)
+
+        Returns ``(files, tally)``: ``{file name: committed length, or None
+        for a full copy}`` and the tally of the copy.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not keep snapshots")
+
+    def detach(self, target_dir):
+        """Move every ballot and voter mark to a snapshot in ``target_dir`` and start over empty
+
+        Returns ``(files, tally)`` as ``snapshot`` does.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not keep snapshots")
+
+    def retire(self):
+        """Refuse every later commit with ``StoreRetiredError``, from any process
+
+        Called before the store's files are moved away for good (a reset to
+        a new shard), so a writer still holding the store cannot commit a
+        ballot that would be deleted with them.
+        """
+        raise NotImplementedError(f"{type(self).__name__} cannot be retired")
+
+    def restore(self, source_dir, files, retire_dir):
+        """Replace the contents with the snapshot ``files`` in ``source_dir``
+
+        The current contents are detached to ``retire_dir`` first; returns
+        their ``(files, tally)``.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not keep snapshots")
+
+    def close(self):
+        """Release files and connections"""
+
+
+def ballot_fields(ballot):
+    """Unpack a batch entry as ``(user_id, candidate, ranking or None)``"""
+    user_id, candidate, *rest = ballot
+    return user_id, candidate, rest[0] if rest else None
+
+
+def read_legacy(votes_file, users_file):
+    """Read the pre-log JSON stores as ``(ballots in vote_id order, voter ids)``"""
+    legacy_votes = {}
+    legacy_users = []
+    if os.path.exists(votes_file):
+        with open(votes_file, 'r') as f:
+            legacy_votes = json.load(f)
+    if os.path.exists(users_file):
+        with open(users_file, 'r') as f:
+            legacy_users = json.load(f)
+    return sorted(legacy_votes.values(), key=lambda v: v["vote_id"]), legacy_users
+
+
+def write_tombstone(path):
+    """Mark the store at ``path`` as retired (see ``VoteStore.retire``)"""
+    atomic_write(path + ".retired", b"")
+
+
+def check_live(path):
+    """Raise ``StoreRetiredError`` if the store at ``path`` was retired: its tombstone
+    is there, or its directory was moved away (call with the store's write lock held)"""
+    if os.path.exists(path + ".retired") or not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+        raise StoreRetiredError(path)
+
+
+def legacy_pending(votes_file, users_file):
+    """Whether the legacy files still have to be imported
+
+    Either ``*.migrated`` sibling marks the import as done: a crash between
+    the two renames of ``retire_legacy`` must not import what is left of
+    the pair over the store. Such a leftover is retired here.
+    """
+    legacy_files = (votes_file, users_file)
+    if any(os.path.exists(legacy_file + ".migrated") for legacy_file in legacy_files):
+        retire_legacy(votes_file, users_file)
+        return False
+    return any(os.path.exists(legacy_file) for legacy_file in legacy_files)
+
+
+def retire_legacy(votes_file, users_file):
+    """Rename imported legacy files to ``*.migrated`` so they are not imported twice"""
+    for legacy_file in (votes_file, users_file):
+        if os.path.exists(legacy_file):
+            os.replace(legacy_file, legacy_file + ".migrated")
@@ -0,0 +1,58 @@
+import os
+import threading
+
+
+class SnapshotCache:
+    """Read-through cache of parsed store snapshots
+
+    Each entry is keyed by name and stamped with the identity of the data
+    it was read from (``VoteStore.stamp()``: inode, size and mtime of the
+    store's files, or the ledger's version of a remote store). A lookup
+    takes a fresh stamp and reuses the parsed value only while it still
+    matches, so a write by any process invalidates it. The stamp is taken
+    before loading: if the data changes mid-read the entry is simply
+    reloaded on the next lookup, never served older than its stamp.
+
+    Cached values are shared between callers and must be treated as
+    read-only.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, stamp, load):
+        """Return the cached value for ``key``, calling ``load()`` if ``stamp`` changed"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = load()
+        with self._lock:
+            self._entries[key] = (stamp, value)
+        return value
+
+    def invalidate(self, key=None):
+        """Drop one entry, or all of them"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+def file_stamp(path):
+    """Identity of a file's current contents, or ``None`` if it does not exist"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
@@ -0,0 +1,200 @@
+"""Hash chain and Merkle checkpoints over the ballot log.
+
+Each ballot line carries ``"chain"``: the SHA-256 of the previous ballot's
+chain value followed by the ballot as it would be encoded without the
+field. Editing, inserting, dropping or reordering any ballot changes the
+chain value of every later one, so publishing the latest value (the log's
+head) commits to the whole log.
+
+Every ``merkle_every`` ballots a checkpoint line is appended to the
+Merkle file next to the log: the segment's byte range, the Merkle root of
+its ballots and the chain value at its end. Segments can then be checked
+independently, in parallel, and an auditor who has already checked the
+earlier segments only needs to read what follows the last checkpoint.
+
+Lines without a chain value (written before chaining) still feed the
+chain, they just have no stored value to compare against.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+GENESIS = bytes(32)
+CHAIN_FIELD = b', "chain": "'
+# ', "chain": "' + 64 hex digits + '"}\n'
+CHAIN_SUFFIX_LEN = len(CHAIN_FIELD) + 64 + 3
+MAX_PROBLEMS = 100
+
+
+def seal(payload, prev):
+    """Chain an encoded ballot (JSON object, no newline) to ``prev``; returns ``(line, digest)``"""
+    digest = hashlib.sha256(prev + payload).digest()
+    return payload[:-1] + CHAIN_FIELD + digest.hex().encode() + b'"}\n', digest
+
+
+def unseal(line):
+    """Split a log line into the chained payload and its stored digest (None if unchained)"""
+    if (len(line) > CHAIN_SUFFIX_LEN and line.endswith(b'"}\n')
+            and line[-CHAIN_SUFFIX_LEN:-CHAIN_SUFFIX_LEN + len(CHAIN_FIELD)] == CHAIN_FIELD):
+        try:
+            return line[:-CHAIN_SUFFIX_LEN] + b"}", bytes.fromhex(line[-67:-3].decode())
+        except ValueError:
+            pass
+    return line.rstrip(b"\n"), None
+
+
+def leaf_hash(payload):
+    return hashlib.sha256(b"\x00" + payload).digest()
+
+
+def merkle_root(leaves):
+    """Merkle root of leaf hashes; an odd node is carried up unchanged"""
+    if not leaves:
+        return hashlib.sha256(b"").digest()
+    level = list(leaves)
+    while len(level) > 1:
+        paired = [hashlib.sha256(b"\x01" + level[i] + level[i + 1]).digest()
+                  for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            paired.append(level[-1])
+        level = paired
+    return level[0]
+
+
+def checkpoint(index, first_vote, start, end, leaves, chain):
+    return {"segment": index, "first_vote": first_vote, "last_vote": first_vote + len(leaves) - 1,
+            "start": start, "end": end, "root": merkle_root(leaves).hex(), "chain": chain.hex()}
+
+
+def read_checkpoints(path, repair=False):
+    """Load the Merkle checkpoints, dropping (and with ``repair``, truncating) a torn last line"""
+    entries = []
+    good_end = 0
+    if not os.path.exists(path):
+        return entries
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break
+            good_end += len(line)
+    if repair and good_end < os.path.getsize(path):
+        with open(path, 'r+b') as f:
+            f.truncate(good_end)
+    return entries
+
+
+def verify_range(path, start, end, prev_hex, first_vote):
+    """Recompute the chain and Merkle root over ``[start, end)`` of the log
+
+    Returns ``{"records", "unchained", "chain", "root", "problems"}``; each
+    problem names the ballot (by position) whose stored chain value is wrong.
+    The Merkle root is over the ballots as read, so an altered ballot whose
+    chain value was forged as well still changes the segment's root.
+    """
+    chain = bytes.fromhex(prev_hex)
+    leaves = []
+    unchained = 0
+    problems = []
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        for line in f:
+            if remaining <= 0:
+                break
+            remaining -= len(line)
+            payload, stored = unseal(line)
+            chain = hashlib.sha256(chain + payload).digest()
+            leaves.append(leaf_hash(payload))
+            if stored is None:
+                unchained += 1
+            elif stored != chain:
+                if len(problems) < MAX_PROBLEMS:
+                    problems.append({"vote": first_vote + len(leaves) - 1,
+                                     "problem": "el encadenamiento no coincide"})
+                # Continue from the stored value so only the altered ballots are reported
+                chain = stored
+    return {"records": len(leaves), "unchained": unchained, "chain": chain.hex(),
+            "root": merkle_root(leaves).hex(), "problems": problems}
+
+
+def _at_line_start(path, offset):
+    if offset == 0:
+        return True
+    with open(path, 'rb') as f:
+        f.seek(offset - 1)
+        return f.read(1) == b"\n"
+
+
+def _shifted(records, chain, where):
+    # A ballot before it changed length: everything after is off by the same bytes
+    return {"records": records, "unchained": 0, "chain": chain, "root": None,
+            "problems": [dict(where, problem="desplazado: un voto anterior cambió de longitud")]}
+
+
+def _verify_segment(args):
+    path, segment, prev_hex = args
+    if not _at_line_start(path, segment["start"]):
+        return _shifted(segment["last_vote"] - segment["first_vote"] + 1, segment["chain"],
+                        {"segment": segment["segment"]})
+    result = verify_range(path, segment["start"], segment["end"], prev_hex, segment["first_vote"])
+    problems = result["problems"]
+    expected_records = segment["last_vote"] - segment["first_vote"] + 1
+    if result["records"] != expected_records:
+        problems.append({"segment": segment["segment"],
+                         "problem": f"{result['records']} votos en lugar de {expected_records}"})
+    if result["root"] != segment["root"]:
+        problems.append({"segment": segment["segment"], "problem": "la raíz de Merkle no coincide"})
+    if result["chain"] != segment["chain"]:
+        problems.append({"segment": segment["segment"], "problem": "el encadenamiento del punto de control no coincide"})
+    return result
+
+
+def verify_log(path, segments, end, from_segment=0, processes=None):
+    """Verify the log against its Merkle checkpoints, from ``from_segment`` on
+
+    Segments are checked in parallel with a process pool (``processes=1``
+    checks them in this process, in one streaming pass); the ballots after
+    the last checkpoint are checked from its chain value. Starting at a
+    later segment trusts the earlier ones, so the work is proportional to
+    what was added since.
+
+    Returns ``{"ok", "records", "segments", "unchained", "head", "problems"}``.
+    """
+    problems = []
+    expected_start = segments[from_segment - 1]["end"] if from_segment else 0
+    tasks = []
+    for i, segment in enumerate(segments[from_segment:], from_segment):
+        if segment["segment"] != i or segment["start"] != expected_start:
+            problems.append({"segment": i, "problem": "los puntos de control no son contiguos"})
+        prev_hex = segments[i - 1]["chain"] if i else GENESIS.hex()
+        tasks.append((path, segment, prev_hex))
+        expected_start = segment["end"]
+
+    if processes == 1 or len(tasks) <= 1:
+        results = list(map(_verify_segment, tasks))
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(_verify_segment, tasks, chunksize=max(1, len(tasks) // 64)))
+
+    head = segments[-1]["chain"] if segments else GENESIS.hex()
+    first_vote = segments[-1]["last_vote"] + 1 if segments else 1
+    if _at_line_start(path, expected_start):
+        tail = verify_range(path, expected_start, end, head, first_vote)
+    else:
+        tail = _shifted(0, head, {"vote": first_vote})
+    results.append(tail)
+    for result in results:
+        problems.extend(result["problems"])
+    return {
+        "ok": not problems,
+        "records": sum(r["records"] for r in results),
+        "segments": len(tasks),
+        "unchained": sum(r["unchained"] for r in results),
+        "head": tail["chain"],
+        "problems": problems[:MAX_PROBLEMS],
+    }
@@ -0,0 +1,567 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from storage.base import (VoteStore, ballot_fields, check_live, legacy_pending, read_legacy, retire_legacy,
+                          write_tombstone)
+from storage.errors import AlreadyVotedError
+from storage.journal import Journal
+from storage.locking import FileLock, atomic_write
+from storage.snapshot import detach, freeze, thaw
+
+MAGIC = b"BALLOT"
+VERSION = 1
+# magic, version, ranking slots per record, record size, reserved
+HEADER = struct.Struct("<6sBBII")
+NO_CHOICE = 0xFFFF  # empty ranking slot
+MAX_CANDIDATES = NO_CHOICE
+READ_CHUNK = 65536
+
+
+def record_dtype(rank_slots=0):
+    """Layout of one ballot record: packed, little-endian, fixed width"""
+    fields = [("vote_id", "<u4"), ("timestamp_ms", "<i8"), ("candidate", "<u2")]
+    if rank_slots:
+        fields.append(("ranking", "<u2", (rank_slots,)))
+    return np.dtype(fields)
+
+
+class CompactStore(VoteStore):
+    """Ballot store of fixed-width binary records with an interned candidate table
+
+    Each ballot is one ``record_dtype`` record in ``path``: its number, the
+    epoch-ms timestamp and the index of the candidate in the candidate
+    table (``path + ".candidates"``, one JSON name per line, appended the
+    first time a name is seen). A plurality ballot takes 14 bytes; ranked
+    ballots add ``rank_slots`` two-byte candidate indexes, fixed when the
+    file is created. Voter marks go to ``path + ".voters"``, one JSON ID
+    per line, ahead of the ballots as in ``VoteLog``, and as there every
+    commit is journaled first (``path + ".journal"``) and only the journal
+    is fsynced.
+
+    Because every record has the same size, the number of ballots is the
+    file size, a torn append is a partial last record, and ballot ``n``
+    sits at a known offset. ``records()`` maps the file read-only and
+    returns a NumPy view, so tallies, recounts and analytics run off the
+    buffer without building a Python object per ballot.
+
+    Several processes may share the files; commits hold an interprocess
+    lock on ``path + ".lock"`` and catch up with the others first. There
+    is no hash chain: use the ``json`` backend where auditors need one.
+    """
+
+    def __init__(self, path, rank_slots=0, journal=True):
+        self.path = path
+        self.candidates_path = path + ".candidates"
+        self.voters_path = path + ".voters"
+        self.rank_slots = rank_slots
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(path + ".lock")
+        self._votes_fh = None
+        self._voters_fh = None
+        self._candidates_fh = None
+        self._journal = Journal(path + ".journal", {"voters": self.voters_path, "candidates": self.candidates_path,
+                                                    "votes": path}) if journal else None
+        # What the journal's recovery did on the last replay (see Journal.recover)
+        self.recovered = None
+        # Bumped on every replay, so cursors from before a clear are detected
+        self._generation = 0
+        with self._file_lock:
+            self._replay()
+
+    # Startup
+
+    def _replay(self):
+        """Rebuild in-memory state from the files, repairing whatever a crash left behind
+
+        The journal first redoes the commits a crash interrupted and rolls
+        back appends it never recorded. Then, as without a journal, partial
+        records and torn lines are truncated, and voter marks without a
+        ballot are rolled back so those voters can vote again.
+        """
+        self._generation += 1
+        if self._journal is not None:
+            self.recovered = self._journal.recover()
+        self._read_header()
+        self._vote_count = 0
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._candidates = []
+        self._candidate_index = {}
+        self._voted = set()
+
+        names, self._candidates_end = _read_lines(self.candidates_path, 0, repair=True)
+        for name in names:
+            self._intern(name)
+        size = _file_size(self.path)
+        whole = (size - HEADER.size) // self._dtype.itemsize
+        if HEADER.size + whole * self._dtype.itemsize < size:
+            with open(self.path, 'r+b') as f:
+                f.truncate(HEADER.size + whole * self._dtype.itemsize)
+                os.fsync(f.fileno())
+        self._count_records(whole)
+
+        marks, self._voters_end = _read_lines(self.voters_path, 0, repair=True)
+        if len(marks) > self._vote_count:
+            with open(self.voters_path, 'rb') as f:
+                self._voters_end = sum(len(f.readline()) for _ in range(self._vote_count))
+            with open(self.voters_path, 'r+b') as f:
+                f.truncate(self._voters_end)
+                os.fsync(f.fileno())
+            del marks[self._vote_count:]
+        self._voted.update(marks)
+
+        for path in (self.candidates_path, self.voters_path):
+            if not os.path.exists(path):
+                open(path, 'ab').close()
+        self._identity = (_identity(self.path), _identity(self.voters_path), _identity(self.candidates_path))
+        if self._journal is not None:
+            self._journal.checkpoint()
+
+    def _read_header(self):
+        if not 0 <= self.rank_slots <= 255:
+            raise ValueError("rank_slots must be between 0 and 255")
+        if _file_size(self.path) < HEADER.size:
+            atomic_write(self.path, HEADER.pack(MAGIC, VERSION, self.rank_slots,
+                                                record_dtype(self.rank_slots).itemsize, 0))
+        with open(self.path, 'rb') as f:
+            magic, version, rank_slots, record_size, _ = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path} is not a version {VERSION} compact ballot file")
+        self.rank_slots = rank_slots
+        self._dtype = record_dtype(rank_slots)
+        if record_size != self._dtype.itemsize:
+            raise ValueError(f"{self.path}: records of {record_size} bytes, expected {self._dtype.itemsize}")
+
+    def _intern(self, name):
+        self._candidate_index[name] = len(self._candidates)
+        self._candidates.append(name)
+
+    def _count_records(self, end):
+        """Add the records from the current count up to ``end`` to the tally"""
+        if end <= self._vote_count:
+            return
+        counts = np.bincount(self._map(self._vote_count, end)["candidate"], minlength=len(self._candidates))
+        if len(counts) > len(self._counts):
+            self._counts = np.concatenate([self._counts, np.zeros(len(counts) - len(self._counts), np.int64)])
+        self._counts[:len(counts)] += counts
+        self._vote_count = end
+
+    def _map(self, start, end):
+        """Records ``[start, end)`` as a read-only view of the mapped file"""
+        if start >= end:
+            return np.empty(0, self._dtype)
+        with open(self.path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), HEADER.size + end * self._dtype.itemsize, access=mmap.ACCESS_READ)
+        return np.frombuffer(buffer, self._dtype, count=end - start, offset=HEADER.size + start * self._dtype.itemsize)
+
+    def _catch_up(self):
+        """Apply what other processes committed since our last look"""
+        with self._lock:
+            identity = (_identity(self.path), _identity(self.voters_path), _identity(self.candidates_path))
+            size = _file_size(self.path)
+            if identity != self._identity or size < HEADER.size + self._vote_count * self._dtype.itemsize:
+                # Another process cleared or replaced the files
+                with self._file_lock:
+                    self.close()
+                    self._replay()
+                return
+            if _file_size(self.candidates_path) > self._candidates_end:
+                names, self._candidates_end = _read_lines(self.candidates_path, self._candidates_end)
+                for name in names:
+                    self._intern(name)
+            if _file_size(self.voters_path) > self._voters_end:
+                marks, self._voters_end = _read_lines(self.voters_path, self._voters_end)
+                self._voted.update(marks)
+            self._count_records((size - HEADER.size) // self._dtype.itemsize)
+
+    # Writes
+
+    def _append(self, fh_attr, path, data):
+        fh = getattr(self, fh_attr)
+        if fh is None:
+            fh = open(path, 'ab')
+            setattr(self, fh_attr, fh)
+        fh.write(data)
+        fh.flush()
+        return len(data)
+
+    def _index(self, name, new_names):
+        index = self._candidate_index.get(name)
+        if index is None:
+            if len(self._candidates) >= MAX_CANDIDATES:
+                raise ValueError(f"a compact ballot file holds at most {MAX_CANDIDATES} candidates")
+            self._intern(name)
+            new_names.append(name)
+            index = len(self._candidates) - 1
+        return index
+
+    def record_vote(self, user_id, candidate, ranking=None):
+        (result,) = self.record_votes([(user_id, candidate, ranking)])
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def record_votes(self, ballots):
+        """Commit ballot tuples with one lock and one fsync (one per file without a journal)
+
+        A ballot whose ranking does not fit the records gets a ``ValueError``
+        entry, like a repeat voter gets an ``AlreadyVotedError``.
+        """
+        # Also before the lock, whose file goes with a shard moved away
+        check_live(self.path)
+        with self._lock, self._file_lock:
+            check_live(self.path)
+            if self._journal is not None:
+                self._journal.prepare()
+            self._catch_up()
+            ballots = [ballot_fields(ballot) for ballot in ballots]
+            results = []
+            accepted = []
+            new_names = []
+            now_ms = time.time_ns() // 1000000
+            for user_id, candidate, ranking in ballots:
+                if user_id in self._voted:
+                    results.append(AlreadyVotedError(user_id))
+                    continue
+                if ranking and len(ranking) > max(self.rank_slots, 1):
+                    # Only this ballot is refused; the rest of the batch commits
+                    results.append(ValueError(f"this ballot file holds rankings of up to {self.rank_slots} candidates"))
+                    continue
+                self._voted.add(user_id)
+                ranks = [self._index(name, new_names) for name in ranking] if ranking else []
+                accepted.append((user_id, self._index(candidate, new_names), ranks))
+                vote = {"candidate": candidate, "timestamp": _iso(now_ms),
+                        "vote_id": self._vote_count + len(accepted)}
+                if ranking:
+                    vote["ranking"] = list(ranking)
+                results.append(vote)
+            if not accepted:
+                return results
+
+            records = np.zeros(len(accepted), self._dtype)
+            records["vote_id"] = np.arange(self._vote_count + 1, self._vote_count + len(accepted) + 1)
+            records["timestamp_ms"] = now_ms
+            records["candidate"] = [index for _, index, _ in accepted]
+            if self.rank_slots:
+                records["ranking"] = NO_CHOICE
+                for record, (_, _, ranks) in zip(records, accepted):
+                    record["ranking"][:len(ranks)] = ranks
+            appends = [("voters", self._voters_end, b"".join(_encode(user_id) for user_id, _, _ in accepted))]
+            if new_names:
+                appends.append(("candidates", self._candidates_end, b"".join(_encode(name) for name in new_names)))
+            appends.append(("votes", HEADER.size + self._vote_count * self._dtype.itemsize, records.tobytes()))
+            try:
+                if self._journal is not None:
+                    self._journal.begin(appends)
+                # Voter marks and new names go first; recovery without a journal relies on that order
+                for name, _, data in appends:
+                    if name == "voters":
+                        self._voters_end += self._append("_voters_fh", self.voters_path, data)
+                    elif name == "candidates":
+                        self._candidates_end += self._append("_candidates_fh", self.candidates_path, data)
+                    else:
+                        self._append("_votes_fh", self.path, data)
+                if self._journal is not None:
+                    self._journal.commit()
+                self.sync()
+            except BaseException:
+                # Resynchronize with whatever actually reached the files
+                if self._journal is not None:
+                    self._journal.abort()
+                self.close()
+                self._replay()
+                raise
+            self._count_records(self._vote_count + len(accepted))
+            return results
+
+    def sync(self):
+        """Flush appends to stable storage (the journal, when there is one)"""
+        with self._lock:
+            if self._journal is not None:
+                self._journal.sync()
+                return
+            for fh in (self._voters_fh, self._candidates_fh, self._votes_fh):
+                if fh is not None:
+                    os.fsync(fh.fileno())
+
+    def import_votes(self, votes, voters):
+        """Replace the store with ``votes`` (ballot dicts in order) and ``voters`` (IDs)
+
+        The new files are written aside and renamed into place; the ranking
+        width grows to fit the longest ranking. Used by ``import_legacy``
+        and by ``migrate.py`` to convert the other backends.
+        """
+        with self._lock, self._file_lock:
+            candidates = []
+            index = {}
+            columns = {"timestamp_ms": [], "candidate": []}
+            rankings = []
+            for vote in votes:
+                for name in [vote["candidate"]] + list(vote.get("ranking") or ()):
+                    if name not in index:
+                        index[name] = len(candidates)
+                        candidates.append(name)
+                columns["timestamp_ms"].append(_epoch_ms(vote["timestamp"]))
+                columns["candidate"].append(index[vote["candidate"]])
+                rankings.append([index[name] for name in vote.get("ranking") or ()])
+            if len(candidates) > MAX_CANDIDATES:
+                raise ValueError(f"a compact ballot file holds at most {MAX_CANDIDATES} candidates")
+            rank_slots = max([self.rank_slots] + [len(ranks) for ranks in rankings if len(ranks) > 1])
+            records = np.zeros(len(rankings), record_dtype(rank_slots))
+            records["vote_id"] = np.arange(1, len(records) + 1)
+            records["timestamp_ms"] = columns["timestamp_ms"]
+            records["candidate"] = columns["candidate"]
+            if rank_slots:
+                records["ranking"] = NO_CHOICE
+                for i, ranks in enumerate(rankings):
+                    if ranks:
+                        records["ranking"][i, :len(ranks)] = ranks
+            self.close()
+            self._release()
+            atomic_write(self.voters_path, b"".join(_encode(user_id) for user_id in voters))
+            atomic_write(self.candidates_path, b"".join(_encode(name) for name in candidates))
+            atomic_write(self.path, HEADER.pack(MAGIC, VERSION, rank_slots, records.dtype.itemsize, 0)
+                         + records.tobytes())
+            self._replay()
+
+    def import_legacy(self, votes_file, users_file):
+        """Replace the store with the old whole-file JSON stores, if present"""
+        with self._lock, self._file_lock:
+            if not legacy_pending(votes_file, users_file):
+                return False
+            self.import_votes(*read_legacy(votes_file, users_file))
+            retire_legacy(votes_file, users_file)
+            return True
+
+    def repair_tally(self):
+        with self._lock, self._file_lock:
+            self._catch_up()
+            self._counts = self._recount_array()
+
+    def clear(self):
+        with self._lock, self._file_lock:
+            self._catch_up()
+            stored = bool(self._voted)
+            self.close()
+            self._release()
+            for path in (self.path, self.voters_path, self.candidates_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._replay()
+            return stored
+
+    # Snapshots (see storage.snapshot)
+
+    def _release(self):
+        """Make the files durable and out of the journal's reach, before they are removed,
+        replaced or moved (call with both locks held); the next replay covers the new ones"""
+        if self._journal is not None:
+            self._journal.checkpoint(release=True)
+
+    def _snapshot_paths(self):
+        return [self.path, self.voters_path, self.candidates_path]
+
+    def _committed_lengths(self):
+        """Committed length of each snapshot file (call with both locks held)"""
+        self._catch_up()
+        return [HEADER.size + self._vote_count * self._dtype.itemsize, self._voters_end, self._candidates_end]
+
+    def snapshot(self, target_dir):
+        """Hard-link the committed files into ``target_dir``; returns ``(files, tally)``"""
+        with self._lock, self._file_lock:
+            lengths = self._committed_lengths()
+            self.sync()
+            if self._journal is not None:
+                # The links must hold what the journal would otherwise redo
+                self._journal.checkpoint()
+            return freeze(self._snapshot_paths(), lengths, target_dir), self.tally()
+
+    def detach(self, target_dir):
+        """Move the files into ``target_dir`` and start over empty; returns ``(files, tally)``"""
+        with self._lock, self._file_lock:
+            lengths = self._committed_lengths()
+            tally = self.tally()
+            self.close()
+            self._release()
+            files = detach(self._snapshot_paths(), lengths, target_dir)
+            self._replay()
+            return files, tally
+
+    def retire(self):
+        with self._lock, self._file_lock:
+            write_tombstone(self.path)
+
+    def restore(self, source_dir, files, retire_dir):
+        """Replace the files with the snapshot ``files`` in ``source_dir``, moving the
+        current ones to ``retire_dir``; returns their ``(files, tally)``"""
+        with self._lock, self._file_lock:
+            retired = self.detach(retire_dir)
+            self._release()
+            thaw(source_dir, files, self._snapshot_paths())
+            self._replay()
+            return retired
+
+    def close(self):
+        with self._lock:
+            for fh_attr in ("_voters_fh", "_candidates_fh", "_votes_fh"):
+                fh = getattr(self, fh_attr)
+                if fh is not None:
+                    fh.close()
+                    setattr(self, fh_attr, None)
+            if self._journal is not None:
+                self._journal.close()
+
+    # Reads
+
+    def records(self, start=0, end=None):
+        """Committed records ``[start, end)`` as a read-only NumPy view of the mapped file
+
+        Record ``i`` is ballot ``i + 1``; map ``candidate`` (and
+        ``ranking``) through ``candidates()``.
+        """
+        with self._lock:
+            self._catch_up()
+            count = self._vote_count
+        return self._map(start, count if end is None else min(end, count))
+
+    def candidates(self):
+        """The interned candidate table; record indexes point into it"""
+        with self._lock:
+            self._catch_up()
+            return list(self._candidates)
+
+    def committed_span(self, cursor=None):
+        """Records committed since ``cursor``, like ``VoteLog.committed_span`` but in records"""
+        with self._lock:
+            self._catch_up()
+            end = self._vote_count
+            generation = (self._generation, self._identity)
+        start = 0
+        if cursor is not None and cursor[0] == generation and cursor[1] <= end:
+            start = cursor[1]
+        return start, end, (generation, end)
+
+    def has_voted(self, user_id):
+        self._catch_up()
+        return user_id in self._voted
+
+    def voted_users(self):
+        with self._lock:
+            self._catch_up()
+            end = self._voters_end
+        return _read_lines(self.voters_path, 0, end)[0]
+
+    def voters_since(self, cursor=None):
+        """See ``VoteStore.voters_since``; reads the voters file from the cursor's offset"""
+        with self._lock:
+            self._catch_up()
+            epoch = (self._generation, self._identity)
+            end = self._voters_end
+        if cursor is None or cursor[0] != epoch:
+            return (epoch, end), _read_lines(self.voters_path, 0, end)[0], True
+        if cursor[1] == end:
+            return cursor, [], False
+        return (epoch, end), _read_lines(self.voters_path, cursor[1], end)[0], False
+
+    def iter_votes(self):
+        return self.votes_after(0)
+
+    def votes_after(self, vote_id):
+        # Ballot n is record n - 1: no scan to find where to start
+        records = self.records(vote_id)
+        names = self.candidates()
+        for start in range(0, len(records), READ_CHUNK):
+            chunk = records[start:start + READ_CHUNK]
+            rankings = chunk["ranking"].tolist() if self.rank_slots else None
+            for i, (vote_id, timestamp_ms, candidate) in enumerate(zip(
+                    chunk["vote_id"].tolist(), chunk["timestamp_ms"].tolist(), chunk["candidate"].tolist())):
+                vote = {"candidate": names[candidate], "timestamp": _iso(timestamp_ms), "vote_id": vote_id}
+                if rankings is not None and rankings[i][0] != NO_CHOICE:
+                    vote["ranking"] = [names[index] for index in rankings[i] if index != NO_CHOICE]
+                yield vote
+
+    def ballots_after(self, vote_id):
+        # Ballot n is record n - 1: no scan to find where to start
+        records = self.records(vote_id)
+        names = self.candidates()
+        for start in range(0, len(records), READ_CHUNK):
+            chunk = records[start:start + READ_CHUNK]
+            for row in zip(chunk["vote_id"].tolist(), chunk["candidate"].tolist(), chunk["timestamp_ms"].tolist()):
+                yield row[0], names[row[1]], _iso(row[2])
+
+    def vote_count(self):
+        self._catch_up()
+        return self._vote_count
+
+    def data_files(self):
+        return [self.path, self.voters_path]
+
+    def tally(self):
+        with self._lock:
+            self._catch_up()
+            return {name: int(count) for name, count in zip(self._candidates, self._counts) if count}
+
+    def _recount_array(self):
+        return np.bincount(self.records()["candidate"], minlength=len(self._candidates)).astype(np.int64)
+
+    def recount(self):
+        with self._lock:
+            counts = self._recount_array()
+            return {name: int(count) for name, count in zip(self._candidates, counts) if count}
+
+    def _tally_and_recount(self):
+        with self._lock, self._file_lock:
+            return self.tally(), self.recount()
+
+
+def _read_lines(path, offset, end=None, repair=False):
+    """Parse whole JSON lines from ``offset`` in one call; returns ``(records, end_offset)``
+
+    JSON text never holds a raw newline, so the lines join into one array.
+    """
+    if not os.path.exists(path):
+        return [], offset
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(-1 if end is None else end - offset)
+    whole = data.rfind(b"\n") + 1
+    if repair and offset + whole < _file_size(path):
+        with open(path, 'r+b') as f:
+            f.truncate(offset + whole)
+    if not whole:
+        return [], offset
+    return json.loads(b"[" + data[:whole - 1].replace(b"\n", b",") + b"]"), offset + whole
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _identity(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino)
+
+
+def _encode(record):
+    return json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def _iso(timestamp_ms):
+    """Local time, as the other backends store it"""
+    return datetime.fromtimestamp(timestamp_ms / 1000).isoformat(timespec="milliseconds")
+
+
+def _epoch_ms(timestamp):
+    return round(datetime.fromisoformat(timestamp).timestamp() * 1000)
@@ -0,0 +1,6 @@
+class AlreadyVotedError(Exception):
+    """Raised when a ballot is committed for a voter who has already voted"""
+
+
+class StoreRetiredError(Exception):
+    """Raised when a ballot is committed to a store that was retired (its shard reset away)"""
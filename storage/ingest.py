@@ -0,0 +1,91 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+_STOP = object()
+
+
+class VoteIngestor:
+    """Single-writer ingestion queue with group commit
+
+    Sessions call ``submit()`` and wait on the returned future. One writer
+    thread drains the queue, commits up to ``max_batch`` ballots at a time
+    with ``store.record_votes`` (one lock and one sync per batch) and then
+    resolves each future with the stored ballot, or with
+    ``AlreadyVotedError``. The more voters arrive at once, the bigger the
+    batches, so throughput is bounded by batch size rather than by how
+    many syncs per second the disk can do.
+
+    ``max_wait`` optionally holds a batch open a little longer to let more
+    ballots join it; the default commits whatever is queued right away.
+    """
+
+    def __init__(self, store, max_batch=256, max_wait=0.0):
+        self.store = store
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.ballots = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._writer = threading.Thread(target=self._run, name="vote-ingestor", daemon=True)
+        self._writer.start()
+
+    def submit(self, user_id, candidate, ranking=None):
+        """Queue a ballot; the future resolves once it is durably committed"""
+        future = Future()
+        if self._closed:
+            future.set_exception(RuntimeError("the vote ingestor is closed"))
+            return future
+        self._queue.put((user_id, candidate, ranking, future))
+        return future
+
+    def record_vote(self, user_id, candidate, ranking=None, timeout=None):
+        """Submit a ballot and wait for its commit, like ``VoteStore.record_vote``"""
+        return self.submit(user_id, candidate, ranking).result(timeout)
+
+    def close(self):
+        """Commit everything already queued and stop the writer"""
+        self._closed = True
+        self._queue.put(_STOP)
+        self._writer.join()
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is _STOP:
+            return None, True
+        batch = [first]
+        stop = False
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get(timeout=self.max_wait) if self.max_wait else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop = True
+                break
+            batch.append(item)
+        return batch, stop
+
+    def _run(self):
+        while True:
+            batch, stop = self._next_batch()
+            if batch:
+                self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch):
+        try:
+            results = self.store.record_votes([item[:3] for item in batch])
+        except Exception as e:
+            for *_, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.ballots += len(batch)
+        for (*_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
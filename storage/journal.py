@@ -0,0 +1,236 @@
+"""Write-ahead journal making a store's appends to several files atomic.
+
+A commit appends to more than one file (voter marks, then ballots). Before
+touching them the store journals an intent record holding every append
+(file, offset and bytes), then makes the appends, then journals a commit
+marker. Only the journal needs to reach stable storage before the commit
+is acknowledged, so a commit costs one fsync however many files it
+appends to; the data files are fsynced when the journal is checkpointed.
+
+Recovery reads the journal, which only covers what was appended since the
+last checkpoint, so its cost follows the journal's tail and not the
+store's size:
+
+- an intent record is redone when its commit marker is missing (the
+  writer died mid-commit) or its bytes did not all reach the file (lost
+  with the page cache);
+- a torn intent record was never acknowledged and none of its appends had
+  started: it is dropped;
+- whatever a file holds past the end the journal accounts for (appends
+  whose intent never reached the disk) is rolled back.
+
+A checkpoint fsyncs the files and starts the journal over from their
+sizes. Before the store removes, replaces or moves its files (a clear, a
+reset, an import) it releases them: they are fsynced and the journal
+starts over without sizes, so recovery leaves them alone until the next
+checkpoint and stale entries are never replayed onto new files.
+
+Each entry is ``ENTRY`` (kind, body length, CRC-32 of the body) and a
+body: the base sizes (JSON) for ``BASE``, a JSON list of
+``[file, offset, length]`` and a newline followed by the appended bytes
+for ``INTENT``, nothing for ``COMMIT``.
+"""
+import json
+import os
+import struct
+import zlib
+
+from storage.locking import atomic_write
+
+ENTRY = struct.Struct("<BII")
+BASE, INTENT, COMMIT = 1, 2, 3
+# Checkpoint once the journal grows past this (the files are fsynced then)
+MAX_BYTES = 4 << 20
+
+
+def _entry(kind, body):
+    return ENTRY.pack(kind, len(body), zlib.crc32(body)) + body
+
+
+def _identity(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino)
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class Journal:
+    """Write-ahead journal at ``path`` for the appends to ``files`` (``{name: path}``)
+
+    The store calls every method with its interprocess lock held: ``begin``,
+    its appends and ``commit`` for each commit, ``sync`` before
+    acknowledging, ``recover`` and ``checkpoint`` when it (re)opens the
+    files, and ``prepare`` before each commit to pick up what other
+    processes did to the journal.
+    """
+
+    def __init__(self, path, files, max_bytes=MAX_BYTES):
+        self.path = path
+        self.files = files
+        self.max_bytes = max_bytes
+        self._fh = None
+        self._end = 0
+        # Where the intent of the commit in progress starts, None between commits
+        self._entry_start = None
+        self._identity = None
+
+    def _read(self, offset, bodies=True):
+        """Complete entries from ``offset`` as ``(kind, body)`` (body None unless
+        ``bodies``), and the offset past the last one"""
+        entries = []
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                header = f.read(ENTRY.size)
+                if len(header) < ENTRY.size:
+                    break
+                kind, length, crc = ENTRY.unpack(header)
+                if bodies or kind == BASE:
+                    body = f.read(length)
+                    if len(body) < length or zlib.crc32(body) != crc:
+                        break
+                else:
+                    body = None
+                    if f.seek(length, os.SEEK_CUR) > os.fstat(f.fileno()).st_size:
+                        break
+                entries.append((kind, body))
+                offset += ENTRY.size + length
+        return entries, offset
+
+    def recover(self):
+        """Bring the files in line with the journal (see the module docstring)
+
+        Returns ``{"entries", "redone", "rolled_back", "torn"}``: the intent
+        records read, those redone, the files cut back and the bytes of a
+        torn last entry; None when there is no journal yet.
+        """
+        self.close()
+        if not os.path.exists(self.path):
+            return None
+        entries, good_end = self._read(0)
+        if not entries or entries[0][0] != BASE:
+            return None
+        sizes = {name: size for name, size in json.loads(entries[0][1])["files"].items() if size is not None}
+        live = set(sizes)
+        intents = [(body, i + 1 < len(entries) and entries[i + 1][0] == COMMIT)
+                   for i, (kind, body) in enumerate(entries) if kind == INTENT]
+        redone = 0
+        for body, committed in intents:
+            cut = body.index(b"\n")
+            position = cut + 1
+            appends = []
+            for name, offset, length in json.loads(body[:cut]):
+                appends.append((name, offset, body[position:position + length]))
+                position += length
+                sizes[name] = offset + length
+            missing = [(name, offset, data) for name, offset, data in appends if name in live
+                       and (not committed or _file_size(self.files[name]) < offset + len(data))]
+            for name, offset, data in missing:
+                with open(self.files[name], 'r+b') as f:
+                    f.seek(offset)
+                    f.write(data)
+            redone += bool(missing)
+        rolled_back = 0
+        for name in live:
+            if _file_size(self.files[name]) > sizes[name]:
+                with open(self.files[name], 'r+b') as f:
+                    f.truncate(sizes[name])
+                rolled_back += 1
+        return {"entries": len(intents), "redone": redone, "rolled_back": rolled_back,
+                "torn": _file_size(self.path) - good_end}
+
+    def checkpoint(self, release=False):
+        """Fsync the files and start the journal over from their current sizes
+
+        With ``release`` no sizes are recorded: recovery leaves the files
+        alone until the next checkpoint.
+        """
+        files = {}
+        for name, path in self.files.items():
+            try:
+                fd = os.open(path, os.O_RDWR)
+            except FileNotFoundError:
+                files[name] = None
+                continue
+            try:
+                os.fsync(fd)
+                files[name] = None if release else os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+        self.close()
+        data = _entry(BASE, json.dumps({"files": files}).encode("utf-8"))
+        atomic_write(self.path, data)
+        self._end = len(data)
+        self._identity = _identity(self.path)
+
+    def prepare(self):
+        """Before a commit: follow a journal another process checkpointed, and
+        recover the entry of one that died mid-commit
+
+        Returns what ``recover`` did, or None when there was nothing to do.
+        """
+        identity = _identity(self.path)
+        if identity is None:
+            self.checkpoint()
+            return None
+        if identity != self._identity:
+            self.close()
+            self._identity = identity
+            self._end = 0
+        size = _file_size(self.path)
+        if size == self._end:
+            return None
+        entries, good_end = self._read(self._end, bodies=False)
+        if good_end < size or (entries and entries[-1][0] == INTENT):
+            recovered = self.recover()
+            self.checkpoint()
+            return recovered
+        self._end = size
+        return None
+
+    def _write(self, data):
+        if self._fh is None:
+            self._fh = open(self.path, 'ab')
+        self._fh.write(data)
+        self._fh.flush()
+        self._end += len(data)
+
+    def begin(self, appends):
+        """Journal the ``(name, offset, data)`` appends a commit is about to make"""
+        meta = json.dumps([[name, offset, len(data)] for name, offset, data in appends]).encode("utf-8")
+        self._entry_start = self._end
+        self._write(_entry(INTENT, meta + b"\n" + b"".join(data for _, _, data in appends)))
+
+    def commit(self):
+        """Journal the commit marker, checkpointing the journal when it has grown large"""
+        self._write(_entry(COMMIT, b""))
+        self._entry_start = None
+        if self._end >= self.max_bytes:
+            self.checkpoint()
+
+    def abort(self):
+        """Drop the intent of a commit that failed before its commit marker, if any"""
+        if self._entry_start is None:
+            return
+        self.close()
+        with open(self.path, 'r+b') as f:
+            f.truncate(self._entry_start)
+        self._end, self._entry_start = self._entry_start, None
+
+    def sync(self):
+        """Make what was journaled so far durable"""
+        if self._fh is not None:
+            os.fsync(self._fh.fileno())
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
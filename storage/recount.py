@@ -0,0 +1,302 @@
+"""Parallel recount of ballot archives straight from their files.
+
+An archive is a ballot store's files as a dict (see ``log_archive``,
+``compact_archive`` and ``sqlite_archive``): which backend wrote them,
+how much of each file is committed and, when one was kept, the tally the
+store recorded. ``recount`` cuts every archive into chunks of about
+``chunk`` ballots, counts the chunks in a process pool and merges the
+partial tallies per archive, so one large archive and many small ones
+both keep every core busy. No store is opened and nothing is written.
+
+Chunks are cut on record boundaries: whole lines in a ballot log (and at
+the offset its tally checkpoint covers, so that prefix can be checked
+against the checkpoint), whole records in a compact file, ranges of
+``vote_id`` in a SQLite database.
+"""
+import json
+import os
+import re
+import sqlite3
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from storage.chain import _at_line_start
+from storage.compact import HEADER, MAGIC, record_dtype
+
+CHUNK_BALLOTS = 500000
+MAX_PROBLEMS = 100
+# A ballot line as VoteLog writes it; other lines (ranked, legacy) are parsed as JSON
+BALLOT_LINE = re.compile(rb'^\{"candidate": ("(?:[^"\\\n]|\\.)*"), "timestamp": "[^"\n]*", '
+                         rb'"vote_id": (\d+)(?:, "chain": "[0-9a-f]{64}")?\}\n', re.MULTILINE)
+READ_BLOCK = 1 << 20
+
+
+def committed_end(path):
+    """Offset just past the last complete line"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.seek(max(size - 65536, 0))
+        tail = f.read()
+    cut = tail.rfind(b"\n")
+    return size - len(tail) + cut + 1 if cut >= 0 else 0
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def log_archive(label, votes_path, users_path, lengths=None, stored=None):
+    """A ``VoteLog`` archive; ``lengths`` bounds each file (a snapshot's), else
+    everything up to the last complete line counts"""
+    lengths = lengths or {}
+    votes_end = _bounded_end(votes_path, lengths)
+    try:
+        with open(votes_path + ".checkpoint", 'rb') as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        checkpoint = None
+    # As in VoteLog, a checkpoint past the end of the log is stale and ignored
+    if not checkpoint or "tally" not in checkpoint or checkpoint["votes_offset"] > votes_end:
+        checkpoint = None
+    problems = []
+    if checkpoint and not _at_line_start(votes_path, checkpoint["votes_offset"]):
+        problems.append({"problem": "el punto de control no cae al inicio de un voto: un voto anterior cambió de longitud"})
+        checkpoint = None
+    return {"label": label, "backend": "json", "votes": votes_path, "users": users_path,
+            "votes_end": votes_end, "users_end": _bounded_end(users_path, lengths),
+            "checkpoint": checkpoint, "stored": stored, "problems": problems}
+
+
+def compact_archive(label, path, lengths=None, stored=None):
+    """A ``CompactStore`` archive: ``path`` and its ``.voters`` and ``.candidates`` files"""
+    lengths = lengths or {}
+    with open(path, 'rb') as f:
+        magic, _, rank_slots, record_size, _ = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or record_size != record_dtype(rank_slots).itemsize:
+        raise ValueError(f"{path}: not a compact ballot file")
+    size = lengths.get(os.path.basename(path), _file_size(path))
+    candidates_path = path + ".candidates"
+    with open(candidates_path, 'rb') as f:
+        lines = f.read(_bounded_end(candidates_path, lengths)).splitlines()
+    return {"label": label, "backend": "compact", "path": path, "rank_slots": rank_slots,
+            "records": (size - HEADER.size) // record_size, "candidates": [json.loads(line) for line in lines],
+            "users": path + ".voters", "users_end": _bounded_end(path + ".voters", lengths), "stored": stored}
+
+
+def sqlite_archive(label, path, stored=None):
+    """A ``SqliteStore`` database; its ``tally`` table is the stored tally unless ``stored`` is given"""
+    with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as conn:
+        first, last = conn.execute("SELECT MIN(vote_id), MAX(vote_id) FROM ballots").fetchone()
+        marks = conn.execute("SELECT COUNT(*) FROM voters").fetchone()[0]
+        if stored is None:
+            stored = dict(conn.execute("SELECT candidate, votes FROM tally"))
+    return {"label": label, "backend": "sqlite", "path": path, "first": first or 1, "last": last or 0,
+            "marks": marks, "stored": stored}
+
+
+def _bounded_end(path, lengths):
+    if not os.path.exists(path):
+        return 0
+    length = lengths.get(os.path.basename(path))
+    return committed_end(path) if length is None else min(length, _file_size(path))
+
+
+# Planning
+
+def _line_cuts(path, start, end, step):
+    """Offsets in ``(start, end)`` about ``step`` bytes apart, each at the start of a line"""
+    cuts = []
+    with open(path, 'rb') as f:
+        offset = start + step
+        while offset < end:
+            f.seek(offset)
+            f.readline()
+            offset = f.tell()
+            if offset >= end:
+                break
+            cuts.append(offset)
+            offset += step
+    return cuts
+
+
+def _line_chunks(path, end, chunk, forced=()):
+    """``(start, end)`` ranges of whole lines with about ``chunk`` lines each"""
+    if not end:
+        return []
+    with open(path, 'rb') as f:
+        sample = f.read(min(end, 65536))
+    line_bytes = len(sample) / max(1, sample.count(b"\n"))
+    cuts = [0] + sorted(set(_line_cuts(path, 0, end, max(1, int(chunk * line_bytes)))) | {
+        cut for cut in forced if 0 < cut < end}) + [end]
+    return list(zip(cuts, cuts[1:]))
+
+
+def _plan(index, archive, chunk):
+    """Tasks counting the archive's ballots and its voter marks"""
+    tasks = []
+    if archive["backend"] == "json":
+        checkpoint = archive["checkpoint"]
+        forced = [checkpoint["votes_offset"]] if checkpoint else []
+        tasks += [(index, "log", archive["votes"], start, end)
+                  for start, end in _line_chunks(archive["votes"], archive["votes_end"], chunk, forced)]
+    elif archive["backend"] == "compact":
+        tasks += [(index, "records", archive["path"], start, min(start + chunk, archive["records"]),
+                   archive["rank_slots"], len(archive["candidates"]))
+                  for start in range(0, archive["records"], chunk)]
+    else:
+        tasks += [(index, "rows", archive["path"], start, min(start + chunk, archive["last"] + 1))
+                  for start in range(archive["first"], archive["last"] + 1, chunk)]
+    if "users" in archive:
+        # Marks are short lines: bigger chunks for the same work
+        tasks += [(index, "marks", archive["users"], start, end)
+                  for start, end in _line_chunks(archive["users"], archive["users_end"], chunk * 4)]
+    return tasks
+
+
+# Counting (in the workers)
+
+def _count_log(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    lines = data.count(b"\n")
+    matches = BALLOT_LINE.findall(data)
+    problems = []
+    if len(matches) == lines:
+        tally = Counter(candidate for candidate, _ in matches)
+        tally = {json.loads(candidate): votes for candidate, votes in tally.items()}
+        ids = [int(matches[0][1]), int(matches[-1][1])] if matches else []
+    else:
+        tally = Counter()
+        ids = []
+        offset = start
+        for line in data.splitlines(keepends=True):
+            try:
+                ballot = json.loads(line)
+                tally[ballot["candidate"]] += 1
+                ids.append(ballot["vote_id"])
+            except (ValueError, KeyError, TypeError):
+                problems.append({"offset": offset, "problem": "línea ilegible"})
+            offset += len(line)
+        ids = ids[:1] + ids[-1:]
+    return {"tally": dict(tally), "ballots": lines - len(problems), "ids": ids, "problems": problems}
+
+
+def _count_records(path, start, end, rank_slots, candidates):
+    dtype = record_dtype(rank_slots)
+    records = np.memmap(path, dtype, mode='r', offset=HEADER.size + start * dtype.itemsize, shape=(end - start,))
+    counts = np.bincount(records["candidate"], minlength=candidates)
+    problems = []
+    if len(counts) > candidates:
+        problems.append({"vote": int(records["vote_id"][0]), "problem": "candidato fuera de la tabla"})
+    ids = records["vote_id"]
+    gaps = np.flatnonzero(np.diff(ids.astype(np.int64)) != 1)
+    if len(gaps):
+        expected, found = int(ids[gaps[0]]) + 1, int(ids[gaps[0] + 1])
+        problems.append({"vote": expected, "problem": f"se esperaba el voto {expected} y sigue el {found}"})
+    return {"tally": {i: int(n) for i, n in enumerate(counts) if n}, "ballots": len(records),
+            "ids": [int(ids[0]), int(ids[-1])] if len(ids) else [], "problems": problems}
+
+
+def _count_rows(path, start, end):
+    with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as conn:
+        tally = dict(conn.execute("SELECT candidate, COUNT(*) FROM ballots WHERE vote_id >= ? AND vote_id < ? "
+                                  "GROUP BY candidate", (start, end)))
+        first, last = conn.execute("SELECT MIN(vote_id), MAX(vote_id) FROM ballots "
+                                   "WHERE vote_id >= ? AND vote_id < ?", (start, end)).fetchone()
+    ballots = sum(tally.values())
+    problems = []
+    if ballots and last - first + 1 != ballots:
+        problems.append({"vote": first, "problem": "números de voto no consecutivos"})
+    return {"tally": tally, "ballots": ballots, "ids": [first, last] if ballots else [], "problems": problems}
+
+
+def _count_marks(path, start, end):
+    lines = 0
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining:
+            block = f.read(min(remaining, READ_BLOCK))
+            if not block:
+                break
+            lines += block.count(b"\n")
+            remaining -= len(block)
+    return {"marks": lines}
+
+
+def _count(task):
+    index, kind, path, start, end, *rest = task
+    counter = {"log": _count_log, "records": _count_records, "rows": _count_rows, "marks": _count_marks}[kind]
+    return dict(counter(path, start, end, *rest), index=index, kind=kind, start=start)
+
+
+# Merging
+
+def _merge(archive, results):
+    """Sum an archive's chunk results and compare them with what the store recorded"""
+    tally = Counter()
+    prefix = Counter()
+    ballots = prefix_ballots = marks = 0
+    problems = list(archive.get("problems", []))
+    expected = None
+    checkpoint = archive.get("checkpoint")
+    for result in sorted(results, key=lambda r: (r["kind"], r["start"])):
+        if result["kind"] == "marks":
+            marks += result["marks"]
+            continue
+        tally.update(result["tally"])
+        ballots += result["ballots"]
+        problems += result["problems"]
+        if checkpoint and result["start"] < checkpoint["votes_offset"]:
+            prefix.update(result["tally"])
+            prefix_ballots += result["ballots"]
+        if result["ids"]:
+            first, last = result["ids"]
+            if expected is not None and first != expected:
+                problems.append({"vote": expected, "problem": f"se esperaba el voto {expected} y sigue el {first}"})
+            if result["kind"] == "log" and last - first + 1 != result["ballots"]:
+                problems.append({"vote": first, "problem": "números de voto no consecutivos"})
+            expected = last + 1
+    if archive["backend"] == "compact":
+        tally = Counter({archive["candidates"][i]: n for i, n in tally.items() if i < len(archive["candidates"])})
+    if archive["backend"] == "sqlite":
+        marks = archive["marks"]
+
+    if marks != ballots:
+        problems.append({"problem": f"{marks} marcas de votante para {ballots} votos"
+                         + (" (marcas sin voto: en curso o de una caída, se deshacen al reabrir)"
+                            if marks > ballots else "")})
+    if checkpoint and (dict(prefix) != checkpoint["tally"] or prefix_ballots != checkpoint["vote_count"]):
+        problems.append({"problem": "el recuento no coincide con el punto de control del registro",
+                         "checkpoint": checkpoint["tally"], "recount": dict(prefix)})
+    stored = archive.get("stored")
+    if stored is not None and {c: n for c, n in stored.items() if n} != dict(tally):
+        problems.append({"problem": "el recuento no coincide con el recuento guardado"})
+    return {"label": archive["label"], "backend": archive["backend"], "ok": not problems,
+            "tally": dict(tally.most_common()), "stored": stored, "ballots": ballots, "marks": marks,
+            "chunks": sum(result["kind"] != "marks" for result in results), "problems": problems[:MAX_PROBLEMS]}
+
+
+def recount(archives, processes=None, chunk=CHUNK_BALLOTS):
+    """Recount ``archives`` in parallel; one report per archive, in order
+
+    Each report is ``{"label", "backend", "ok", "tally", "stored",
+    "ballots", "marks", "chunks", "problems"}``. ``processes=1`` counts
+    in this process.
+    """
+    tasks = [task for index, archive in enumerate(archives) for task in _plan(index, archive, chunk)]
+    if processes == 1 or len(tasks) <= 1:
+        results = list(map(_count, tasks))
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(_count, tasks))
+    per_archive = [[] for _ in archives]
+    for result in results:
+        per_archive[result["index"]].append(result)
+    return [_merge(archive, results) for archive, results in zip(archives, per_archive)]
@@ -0,0 +1,179 @@
+import http.client
+import json
+import threading
+from urllib.parse import urlsplit
+
+from storage.base import VoteStore, ballot_fields, legacy_pending, read_legacy, retire_legacy
+from storage.errors import AlreadyVotedError
+
+
+class LedgerError(Exception):
+    """The vote ledger refused a request or could not be reached"""
+
+
+class RemoteStore(VoteStore):
+    """Ballot store held by a vote-ledger daemon (``ledger.py``) shared by many replicas
+
+    Every replica of the app opens the same named store on the ledger. The
+    ledger is its only writer: it enforces the one-vote rule for all of
+    them, group-commits the ballots they send and answers login checks
+    from its own index, so a voter who voted through one replica is turned
+    away by every other. Each thread keeps one keep-alive connection.
+
+    Writes are never retried: a ballot whose request failed may or may not
+    have been committed, and the caller must see the error. Reads are
+    retried once on a fresh connection, which covers a ledger restart.
+    """
+
+    def __init__(self, url, name, token=None, timeout=30):
+        parts = urlsplit(url)
+        if parts.scheme != "http" or not parts.hostname:
+            raise ValueError(f"ledger URL must look like http://host:port, not {url!r}")
+        self.url = url
+        self.name = name
+        self.token = token
+        self.timeout = timeout
+        self._host = parts.hostname
+        self._port = parts.port or 80
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self._host, self._port, timeout=self.timeout)
+        return conn
+
+    def _request(self, conn, op, args):
+        body = json.dumps(dict(args, store=self.name), ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["X-Ledger-Token"] = self.token
+        conn.request("POST", "/" + op, body, headers)
+        return conn.getresponse()
+
+    def _call(self, op, retry=True, **args):
+        conn = self._connection()
+        try:
+            response = self._request(conn, op, args)
+            data = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            self._local.conn = None
+            if not retry:
+                raise LedgerError(f"vote ledger at {self.url} unreachable: {e}") from e
+            return self._call(op, retry=False, **args)
+        payload = json.loads(data)
+        if response.status != 200:
+            raise LedgerError(f"vote ledger: {payload.get('error', response.status)}")
+        return payload
+
+    def _stream(self, op, **args):
+        """Yield the NDJSON records of a streamed reply, on a connection of their own"""
+        conn = http.client.HTTPConnection(self._host, self._port, timeout=self.timeout)
+        try:
+            response = self._request(conn, op, args)
+            if response.status != 200:
+                raise LedgerError(f"vote ledger: {json.loads(response.read()).get('error', response.status)}")
+            for line in response:
+                yield json.loads(line)
+        except (OSError, http.client.HTTPException) as e:
+            raise LedgerError(f"vote ledger at {self.url} unreachable: {e}") from e
+        finally:
+            conn.close()
+
+    # Writes
+
+    def record_vote(self, user_id, candidate, ranking=None):
+        (result,) = self.record_votes([(user_id, candidate, ranking)])
+        if isinstance(result, AlreadyVotedError):
+            raise result
+        return result
+
+    def record_votes(self, ballots):
+        """Send a batch in one request; returns once the ledger has committed it"""
+        ballots = [list(ballot_fields(ballot)) for ballot in ballots]
+        results = self._call("record_votes", retry=False, ballots=ballots)["results"]
+        return [AlreadyVotedError(user_id) if result is None else result
+                for (user_id, _, _), result in zip(ballots, results)]
+
+    def repair_tally(self):
+        self._call("repair_tally", retry=False)
+
+    def import_legacy(self, votes_file, users_file):
+        """Send the old whole-file JSON stores of this replica to the ledger, if present
+
+        The ledger only imports them into a store nobody voted in yet; when it
+        refuses, the files stay in place and False is returned.
+        """
+        if not legacy_pending(votes_file, users_file):
+            return False
+        ordered, legacy_users = read_legacy(votes_file, users_file)
+        if not ordered and not legacy_users:
+            return False
+        if not self._call("import_legacy", retry=False, votes=ordered, users=legacy_users)["imported"]:
+            return False
+        retire_legacy(votes_file, users_file)
+        return True
+
+    def clear(self):
+        return self.reset()["cleared"]
+
+    def reset(self):
+        """Have the ledger move every ballot to a snapshot of its own and start over empty
+
+        Returns ``{"cleared", "results", "snapshot"}``: whether there were
+        ballots, their tally and the snapshot's name on the ledger.
+        """
+        return self._call("clear", retry=False)
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # Reads
+
+    def has_voted(self, user_id):
+        return self._call("has_voted", user_id=user_id)["voted"]
+
+    def voted_users(self):
+        return self._call("voted_users")["users"]
+
+    def iter_votes(self):
+        return self._stream("votes", after=0)
+
+    def votes_after(self, vote_id):
+        return self._stream("votes", after=vote_id)
+
+    def ballots_after(self, vote_id):
+        for vote in self._stream("votes", after=vote_id):
+            yield vote["vote_id"], vote["candidate"], vote["timestamp"]
+
+    def state(self):
+        """``{"vote_count", "tally", "stamp"}`` in one round trip"""
+        return self._call("state")
+
+    def vote_count(self):
+        return self.state()["vote_count"]
+
+    def tally(self):
+        return self.state()["tally"]
+
+    def data_files(self):
+        return []
+
+    def stamp(self):
+        return tuple(self.state()["stamp"])
+
+    def recount(self):
+        return self._call("recount")["tally"]
+
+    def verify_tally(self):
+        return self._call("verify_tally")["mismatches"]
+
+    def chain_head(self):
+        return self._call("chain_head")["chain_head"]
+
+    def verify_chain(self, incremental=False, processes=None):
+        return self._call("verify_chain", incremental=incremental, processes=processes)["report"]
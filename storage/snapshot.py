@@ -0,0 +1,157 @@
+"""Point-in-time snapshots of a ballot store, made of hard links.
+
+The file stores only ever append to their data files: every rewrite goes
+through ``atomic_write`` (a new file renamed into place) and crash repair
+only truncates what was never committed. So the first N bytes of a data
+file never change, and a snapshot is a directory of hard links to the
+store's files plus the committed length of each (``snapshot.json``).
+Taking one costs a link per file, whatever the number of ballots, and
+whatever is appended to a linked file afterwards lies past the recorded
+length and is not part of the snapshot.
+
+Restoring links a file back when nothing was appended to it since (undoing
+a reset) and otherwise clones its snapshot prefix: a reflink on filesystems
+that share extents (Btrfs, XFS), an in-kernel copy elsewhere. Files
+rewritten in place (SQLite pages) have no recorded length and are always
+copied.
+
+``snapshot.json`` also keeps the tally and the counts taken with the
+files, so listing and comparing snapshots never reads a ballot.
+"""
+import json
+import os
+from datetime import datetime
+
+from storage.locking import atomic_write
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+SNAPSHOT_FILE = "snapshot.json"
+# ioctl(dest, FICLONE, src): share every extent of src (Linux, Btrfs/XFS)
+FICLONE = 0x40049409
+
+
+def clone_file(src, dst, length=None):
+    """Write the first ``length`` bytes of ``src`` (all of it when None) to a new file ``dst``"""
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        if length is None:
+            length = os.fstat(fin.fileno()).st_size
+        try:
+            fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+            os.ftruncate(fout.fileno(), length)
+        except (AttributeError, OSError):  # no reflinks on this platform or filesystem
+            _copy_range(fin, fout, length)
+        os.fsync(fout.fileno())
+
+
+def _copy_range(fin, fout, length):
+    copied = 0
+    try:
+        while copied < length:
+            step = os.copy_file_range(fin.fileno(), fout.fileno(), length - copied)
+            if not step:
+                break
+            copied += step
+    except (AttributeError, OSError):
+        fin.seek(copied)
+        fout.seek(copied)
+        remaining = length - copied
+        while remaining:
+            chunk = fin.read(min(remaining, 1 << 20))
+            if not chunk:
+                break
+            fout.write(chunk)
+            remaining -= len(chunk)
+        fout.truncate(length)
+
+
+def link_file(src, dst, length=None):
+    """Make ``dst`` hold the first ``length`` bytes of ``src``: a hard link when ``src``
+    is exactly that long, a clone of the prefix otherwise or when ``length`` is None"""
+    if length is not None and os.path.getsize(src) == length:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:  # another filesystem, or no hard links
+            pass
+    clone_file(src, dst, length)
+
+
+def freeze(paths, lengths, target_dir):
+    """Link ``paths`` into ``target_dir`` for a snapshot; returns ``{file name: length}``"""
+    files = {}
+    for path, length in zip(paths, lengths):
+        if not os.path.exists(path):
+            continue
+        dst = os.path.join(target_dir, os.path.basename(path))
+        try:
+            os.link(path, dst)
+        except OSError:
+            clone_file(path, dst, length)
+        files[os.path.basename(path)] = length
+    return files
+
+
+def detach(paths, lengths, target_dir):
+    """Move ``paths`` into ``target_dir`` (a rename each); returns ``{file name: length}``"""
+    files = {}
+    for path, length in zip(paths, lengths):
+        if os.path.exists(path):
+            os.rename(path, os.path.join(target_dir, os.path.basename(path)))
+            files[os.path.basename(path)] = length
+    return files
+
+
+def thaw(source_dir, files, paths):
+    """Make each of ``paths`` hold its file of the snapshot in ``source_dir``, or not exist"""
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+        name = os.path.basename(path)
+        if name in files:
+            link_file(os.path.join(source_dir, name), path, files[name])
+
+
+class Snapshot:
+    """A snapshot directory; ``snapshot.json`` is only read on first access"""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self._meta = None
+
+    @classmethod
+    def create(cls, root, reason, label=None):
+        """An empty snapshot directory under ``root``, named after the time and ``reason``"""
+        os.makedirs(root, exist_ok=True)
+        name = f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}-{reason}"
+        os.mkdir(os.path.join(root, name))
+        snapshot = cls(os.path.join(root, name))
+        snapshot._meta = {"reason": reason, "label": label or "", "taken_at": datetime.now().isoformat()}
+        return snapshot
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            with open(os.path.join(self.path, SNAPSHOT_FILE), 'rb') as f:
+                self._meta = json.load(f)
+        return self._meta
+
+    def seal(self, files, tally, **meta):
+        """Record the snapshot's files, tally and context; until then it is incomplete"""
+        self._meta.update(meta, files=files, results=tally, ballots=sum(tally.values()))
+        atomic_write(os.path.join(self.path, SNAPSHOT_FILE),
+                     json.dumps(self._meta, ensure_ascii=False, indent=2).encode("utf-8"))
+
+
+def list_snapshots(root):
+    """Complete snapshots under ``root``, newest first; their metadata is read lazily"""
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return []
+    return [Snapshot(os.path.join(root, name)) for name in sorted(names, reverse=True)
+            if os.path.exists(os.path.join(root, name, SNAPSHOT_FILE))]
@@ -0,0 +1,307 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from storage.base import (VoteStore, ballot_fields, check_live, legacy_pending, read_legacy, retire_legacy,
+                          write_tombstone)
+from storage.errors import AlreadyVotedError
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS voters (
+    user_id TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS ballots (
+    vote_id INTEGER PRIMARY KEY,
+    candidate TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    ranking TEXT
+);
+CREATE TABLE IF NOT EXISTS tally (
+    candidate TEXT PRIMARY KEY,
+    votes INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class SqliteStore(VoteStore):
+    """Ballot store in a SQLite database running in WAL mode
+
+    Voter IDs are the primary key of ``voters``, so eligibility checks and
+    the one-vote rule are index lookups. Each commit inserts the voter mark
+    and the ballot and bumps the candidate's row in ``tally`` in a single
+    transaction, so results never need a scan over the ballots. WAL mode lets
+    readers run while a vote is being written, from any number of threads or
+    processes.
+    """
+
+    def __init__(self, path, synchronous="NORMAL", busy_timeout_ms=5000):
+        self.path = path
+        self.synchronous = synchronous
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        # Databases created before ranked ballots lack the column
+        if "ranking" not in {row[1] for row in conn.execute("PRAGMA table_info(ballots)")}:
+            conn.execute("ALTER TABLE ballots ADD COLUMN ranking TEXT")
+
+    def _conn(self):
+        """Connection for the calling thread, opened on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None,
+                                   timeout=self.busy_timeout_ms / 1000,
+                                   check_same_thread=False)
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _write(self, fn):
+        """Run ``fn(conn)`` inside an immediate write transaction"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def _write_ballots(self, fn):
+        """``_write`` for commits: refused once the store is retired"""
+        def write(conn):
+            check_live(self.path)
+            return fn(conn)
+        return self._write(write)
+
+    def _insert_vote(self, conn, user_id, candidate, ranking=None):
+        if conn.execute("INSERT OR IGNORE INTO voters (user_id) VALUES (?)", (user_id,)).rowcount == 0:
+            return AlreadyVotedError(user_id)
+        timestamp = datetime.now().isoformat()
+        vote_id = conn.execute(
+            "INSERT INTO ballots (candidate, timestamp, ranking) VALUES (?, ?, ?)",
+            (candidate, timestamp, json.dumps(ranking, ensure_ascii=False) if ranking else None)
+        ).lastrowid
+        conn.execute(
+            "INSERT INTO tally (candidate, votes) VALUES (?, 1) "
+            "ON CONFLICT(candidate) DO UPDATE SET votes = votes + 1",
+            (candidate,)
+        )
+        return _ballot(vote_id, candidate, timestamp, ranking)
+
+    def record_vote(self, user_id, candidate, ranking=None):
+        result = self._write_ballots(lambda conn: self._insert_vote(conn, user_id, candidate, ranking))
+        if isinstance(result, AlreadyVotedError):
+            raise result
+        return result
+
+    def record_votes(self, ballots):
+        """Commit the whole batch in one transaction
+
+        How durable the commit is follows the ``synchronous`` setting: pass
+        ``"FULL"`` to fsync every commit instead of at WAL checkpoints.
+        """
+        return self._write_ballots(lambda conn: [
+            self._insert_vote(conn, *ballot_fields(ballot)) for ballot in ballots
+        ])
+
+    def has_voted(self, user_id):
+        row = self._conn().execute(
+            "SELECT 1 FROM voters WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row is not None
+
+    def voted_users(self):
+        rows = self._conn().execute("SELECT user_id FROM voters ORDER BY rowid")
+        return [user_id for (user_id,) in rows]
+
+    def voters_since(self, cursor=None):
+        """See ``VoteStore.voters_since``; reads the voters past the cursor's rowid
+
+        Every clear, import and restore bumps ``user_version``, so a cursor
+        from before one of them is told apart from a later one. The version
+        is read first: a reset landing between the two reads leaves the
+        cursor on the old version, and the next call starts over.
+        """
+        conn = self._conn()
+        epoch, last = conn.execute(
+            "SELECT user_version, (SELECT MAX(rowid) FROM voters) FROM pragma_user_version"
+        ).fetchone()
+        reset = cursor is None or cursor[0] != epoch
+        after = 0 if reset else cursor[1]
+        if not reset and (last or 0) <= after:
+            return cursor, [], False
+        rows = conn.execute("SELECT rowid, user_id FROM voters WHERE rowid > ? ORDER BY rowid", (after,)).fetchall()
+        return (epoch, rows[-1][0] if rows else after), [user_id for _, user_id in rows], reset
+
+    def iter_votes(self):
+        return self.votes_after(0)
+
+    def votes_after(self, vote_id):
+        cursor = self._conn().execute(
+            "SELECT vote_id, candidate, timestamp, ranking FROM ballots WHERE vote_id > ? ORDER BY vote_id",
+            (vote_id,)
+        )
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                return
+            for vote_id, candidate, timestamp, ranking in rows:
+                yield _ballot(vote_id, candidate, timestamp, json.loads(ranking) if ranking else None)
+
+    def ballots_after(self, vote_id):
+        return self._conn().execute(
+            "SELECT vote_id, candidate, timestamp FROM ballots WHERE vote_id > ? ORDER BY vote_id",
+            (vote_id,)
+        )
+
+    def vote_count(self):
+        (count,) = self._conn().execute(
+            "SELECT COALESCE(MAX(vote_id), 0) FROM ballots"
+        ).fetchone()
+        return count
+
+    def data_files(self):
+        # Commits land in the write-ahead log until it is checkpointed
+        return [self.path, self.path + "-wal"]
+
+    def tally(self):
+        return dict(self._conn().execute("SELECT candidate, votes FROM tally"))
+
+    def recount(self):
+        return dict(self._conn().execute(
+            "SELECT candidate, COUNT(*) FROM ballots GROUP BY candidate"
+        ))
+
+    def _tally_and_recount(self):
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            return self.tally(), self.recount()
+        finally:
+            conn.execute("COMMIT")
+
+    def repair_tally(self):
+        def rebuild(conn):
+            conn.execute("DELETE FROM tally")
+            conn.execute("INSERT INTO tally (candidate, votes) "
+                         "SELECT candidate, COUNT(*) FROM ballots GROUP BY candidate")
+        self._write(rebuild)
+
+    def import_legacy(self, votes_file, users_file):
+        if not legacy_pending(votes_file, users_file):
+            return False
+        ballots, voters = read_legacy(votes_file, users_file)
+
+        def replace_all(conn):
+            _next_epoch(conn)
+            conn.execute("DELETE FROM voters")
+            conn.execute("DELETE FROM ballots")
+            conn.execute("DELETE FROM tally")
+            conn.executemany("INSERT OR IGNORE INTO voters (user_id) VALUES (?)",
+                             ((user_id,) for user_id in voters))
+            conn.executemany("INSERT INTO ballots (vote_id, candidate, timestamp, ranking) VALUES (?, ?, ?, ?)",
+                             ((i, vote["candidate"], vote["timestamp"],
+                               json.dumps(vote["ranking"], ensure_ascii=False) if vote.get("ranking") else None)
+                              for i, vote in enumerate(ballots, 1)))
+            conn.execute("INSERT INTO tally (candidate, votes) "
+                         "SELECT candidate, COUNT(*) FROM ballots GROUP BY candidate")
+        self._write(replace_all)
+        retire_legacy(votes_file, users_file)
+        return True
+
+    def clear(self):
+        def delete_all(conn):
+            (stored,) = conn.execute("SELECT EXISTS (SELECT 1 FROM voters)").fetchone()
+            _next_epoch(conn)
+            conn.execute("DELETE FROM voters")
+            conn.execute("DELETE FROM ballots")
+            conn.execute("DELETE FROM tally")
+            return bool(stored)
+        return self._write(delete_all)
+
+    # Snapshots (see storage.snapshot)
+
+    def _transfer(self, target_dir=None, source_dir=None, clear=False):
+        """In one write transaction: copy everything into a new database in
+        ``target_dir``, then clear it or replace it with the database in
+        ``source_dir``; returns ``(files, tally)`` of the copy"""
+        conn = self._conn()
+        name = os.path.basename(self.path)
+        if target_dir is not None:
+            target = sqlite3.connect(os.path.join(target_dir, name))
+            target.executescript(SCHEMA)
+            target.close()
+            conn.execute("ATTACH ? AS target", (os.path.join(target_dir, name),))
+        if source_dir is not None:
+            conn.execute("ATTACH ? AS source", (os.path.join(source_dir, name),))
+
+        def transfer(conn):
+            tally = {}
+            if clear or source_dir is not None:
+                _next_epoch(conn)
+            for table in ("voters", "ballots", "tally"):
+                if target_dir is not None:
+                    conn.execute(f"INSERT INTO target.{table} SELECT * FROM main.{table}")
+                if clear or source_dir is not None:
+                    conn.execute(f"DELETE FROM main.{table}")
+                if source_dir is not None:
+                    conn.execute(f"INSERT INTO main.{table} SELECT * FROM source.{table}")
+            if target_dir is not None:
+                tally = dict(conn.execute("SELECT candidate, votes FROM target.tally"))
+            return tally
+        try:
+            return {name: None}, self._write(transfer)
+        finally:
+            for schema, used in (("target", target_dir), ("source", source_dir)):
+                if used is not None:
+                    conn.execute(f"DETACH {schema}")
+
+    def snapshot(self, target_dir):
+        """Copy the database into ``target_dir``; returns ``(files, tally)``
+
+        SQLite rewrites pages in place, so unlike the log stores this is a
+        full copy, under a write lock for its duration.
+        """
+        return self._transfer(target_dir)
+
+    def detach(self, target_dir):
+        """Move every ballot and voter mark into a database in ``target_dir``; returns ``(files, tally)``"""
+        return self._transfer(target_dir, clear=True)
+
+    def retire(self):
+        # Under the write lock, so no commit that checked before it is still running
+        self._write(lambda conn: write_tombstone(self.path))
+
+    def restore(self, source_dir, files, retire_dir):
+        """Replace the contents with the snapshot in ``source_dir``, copying the
+        current ones to ``retire_dir``; returns their ``(files, tally)``"""
+        return self._transfer(retire_dir, source_dir)
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+def _next_epoch(conn):
+    """Count a clear, import or restore in ``user_version`` (see ``voters_since``)"""
+    (epoch,) = conn.execute("PRAGMA main.user_version").fetchone()
+    conn.execute(f"PRAGMA main.user_version = {epoch + 1}")
+
+
+def _ballot(vote_id, candidate, timestamp, ranking):
+    vote = {"candidate": candidate, "timestamp": timestamp, "vote_id": vote_id}
+    if ranking:
+        vote["ranking"] = list(ranking)
+    return vote
@@ -0,0 +1,591 @@
+import bisect
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from storage.base import (VoteStore, ballot_fields, check_live, legacy_pending, read_legacy, retire_legacy,
+                          write_tombstone)
+from storage.chain import GENESIS, checkpoint, leaf_hash, read_checkpoints, seal, unseal, verify_log
+from storage.errors import AlreadyVotedError
+from storage.journal import Journal
+from storage.locking import FileLock, atomic_write
+from storage.snapshot import detach, freeze, thaw
+
+
+class VoteLog(VoteStore):
+    """Append-only ballot store backed by two newline-delimited JSON logs.
+
+    Ballots go to ``votes_path`` and voter marks to ``users_path``, one JSON
+    document per line, so casting a ballot costs one append no matter how
+    many ballots are already stored. Each commit is first written to a
+    journal (``votes_path + ".journal"``, see ``storage.journal``), so a
+    crash or power loss never leaves a voter mark without its ballot or a
+    ballot without its mark, and only the journal is fsynced, in batches.
+    On startup the journal's tail is recovered and the logs are replayed
+    to rebuild the voted-user set and the running tally; a periodic
+    checkpoint persists the tally with the ballot log offset it covers, so
+    startup only replays the ballots after it.
+
+    Several processes may share the same logs. Every commit holds an
+    interprocess lock on ``votes_path + ".lock"`` and first catches up with
+    whatever other processes appended, so ballot numbers stay unique and a
+    voter can only be marked once.
+
+    Ballots are hash-chained, with a Merkle checkpoint every
+    ``merkle_every`` ballots in ``votes_path + ".merkle"`` (see
+    ``storage.chain``).
+    """
+
+    def __init__(self, votes_path, users_path, fsync_every=32,
+                 fsync_interval=0.5, compact_every=10000, merkle_every=4096, journal=True):
+        self.votes_path = votes_path
+        self.users_path = users_path
+        self.checkpoint_path = votes_path + ".checkpoint"
+        self.merkle_path = votes_path + ".merkle"
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.merkle_every = merkle_every
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(votes_path + ".lock")
+        self._votes_fh = None
+        self._users_fh = None
+        # Without a journal the logs themselves are fsynced, and recovery relies on the marks going first
+        self._journal = Journal(votes_path + ".journal", {"users": users_path, "votes": votes_path}) if journal else None
+        # What the journal's recovery did on the last replay (see Journal.recover)
+        self.recovered = None
+        # Bumped on every replay, so cursors from before a clear are detected
+        self._generation = 0
+        with self._file_lock:
+            self._replay()
+
+    # Startup
+
+    def _replay(self):
+        """Rebuild in-memory state from the checkpoint and the logs, repairing
+        whatever a crash left behind
+
+        The journal first redoes the commits a crash interrupted and rolls
+        back appends it never recorded. Without one (a log written before
+        journaling, or ``journal=False``), a crash between the two appends of
+        a commit leaves trailing voter marks without a ballot, since marks go
+        first. Those voters never got a receipt; their marks are rolled back
+        so they can vote again.
+        """
+        self._generation += 1
+        if self._journal is not None:
+            self.recovered = self._journal.recover()
+        self._voted = set()
+        self._vote_count = 0
+        self._tally = {}
+        self._votes_end = 0
+        self._users_end = 0
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._since_compact = 0
+
+        checkpoint = self._read_checkpoint()
+        if checkpoint and "tally" in checkpoint and checkpoint["votes_offset"] <= _file_size(self.votes_path):
+            self._votes_end = checkpoint["votes_offset"]
+            self._vote_count = checkpoint["vote_count"]
+            self._tally = checkpoint["tally"]
+
+        for vote, end in self._scan(self.votes_path, self._votes_end, repair=True):
+            self._count(vote)
+            self._votes_end = end
+
+        marks = list(self._scan(self.users_path, 0, repair=True))
+        if len(marks) > self._vote_count:
+            keep_end = marks[self._vote_count - 1][1] if self._vote_count else 0
+            with open(self.users_path, 'r+b') as f:
+                f.truncate(keep_end)
+                os.fsync(f.fileno())
+            del marks[self._vote_count:]
+        for user_id, end in marks:
+            self._voted.add(user_id)
+            self._users_end = end
+
+        for path in (self.votes_path, self.users_path):
+            if not os.path.exists(path):
+                open(path, 'ab').close()
+        self._votes_identity = _identity(self.votes_path)
+        self._users_identity = _identity(self.users_path)
+        self._replay_chain()
+        if self._journal is not None:
+            self._journal.checkpoint()
+
+    def _replay_chain(self):
+        """Restore the chain head and the open Merkle segment from the last checkpoint
+
+        Only the ballots after the last checkpoint are read. Checkpoints
+        past the end of the log (left by a crash or a clear) are dropped,
+        and checkpoints the log has outgrown are written.
+        """
+        segments = read_checkpoints(self.merkle_path, repair=True)
+        kept = [segment for segment in segments if segment["end"] <= self._votes_end]
+        if len(kept) < len(segments):
+            atomic_write(self.merkle_path, b"".join(_encode(segment) for segment in kept))
+        self._segments = kept
+        self._merkle_written = len(kept)
+        # Merkle segments already checked by verify_chain(incremental=True)
+        self._verified_segments = 0
+        self._chain = bytes.fromhex(kept[-1]["chain"]) if kept else GENESIS
+        self._segment_start = kept[-1]["end"] if kept else 0
+        self._leaves = []
+        for line, end in self._scan_lines(self.votes_path, self._segment_start, self._votes_end):
+            self._link(unseal(line)[0], end)
+        self._write_checkpoints()
+
+    def _read_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return None
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _scan_lines(self, path, offset, end=None, repair=False):
+        """Yield ``(line, end_offset)`` for each line between ``offset`` and ``end``
+
+        A torn last line (a crash in the middle of an append) is skipped, and
+        truncated away when ``repair`` is set.
+        """
+        if not os.path.exists(path):
+            return
+        good_end = offset
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n") or (end is not None and good_end + len(line) > end):
+                    break
+                good_end += len(line)
+                yield line, good_end
+        if repair and good_end < _file_size(path):
+            with open(path, 'r+b') as f:
+                f.truncate(good_end)
+
+    def _scan(self, path, offset, end=None, repair=False):
+        """Yield ``(record, end_offset)`` for each line, see ``_scan_lines``"""
+        for line, good_end in self._scan_lines(path, offset, end, repair):
+            yield json.loads(line), good_end
+
+    def _read_records(self, path, offset, end=None):
+        for record, _ in self._scan(path, offset, end):
+            yield record
+
+    def _catch_up(self):
+        """Apply records appended by other processes since our last look"""
+        with self._lock:
+            votes_size = _file_size(self.votes_path)
+            users_size = _file_size(self.users_path)
+            if (votes_size < self._votes_end or users_size < self._users_end
+                    or _identity(self.votes_path) != self._votes_identity
+                    or _identity(self.users_path) != self._users_identity):
+                # Another process cleared or replaced the logs
+                with self._file_lock:
+                    self.close()
+                    self._replay()
+                return
+            if users_size > self._users_end:
+                for user_id, end in self._scan(self.users_path, self._users_end):
+                    self._voted.add(user_id)
+                    self._users_end = end
+            if votes_size > self._votes_end:
+                for line, end in self._scan_lines(self.votes_path, self._votes_end):
+                    self._count(json.loads(line))
+                    self._link(unseal(line)[0], end)
+                    self._votes_end = end
+
+    def _count(self, vote):
+        self._vote_count += 1
+        self._tally[vote["candidate"]] = self._tally.get(vote["candidate"], 0) + 1
+
+    def _link(self, payload, end, digest=None):
+        """Extend the chain with a ballot ending at byte ``end``, closing full Merkle segments"""
+        self._chain = digest or hashlib.sha256(self._chain + payload).digest()
+        self._leaves.append(leaf_hash(payload))
+        if len(self._leaves) >= self.merkle_every:
+            first_vote = self._segments[-1]["last_vote"] + 1 if self._segments else 1
+            self._segments.append(checkpoint(len(self._segments), first_vote, self._segment_start,
+                                             end, self._leaves, self._chain))
+            self._leaves = []
+            self._segment_start = end
+
+    def _write_checkpoints(self):
+        """Append closed segments missing from the Merkle file (call with the file lock held)
+
+        Other processes write the segments they close; the file is only
+        read when this process has closed segments it has not written.
+        """
+        if len(self._segments) <= self._merkle_written:
+            return
+        on_disk = len(read_checkpoints(self.merkle_path))
+        missing = self._segments[on_disk:]
+        if missing:
+            with open(self.merkle_path, 'ab') as f:
+                f.write(b"".join(_encode(segment) for segment in missing))
+        self._merkle_written = len(self._segments)
+
+    # Writes
+
+    def _append(self, fh_attr, path, data):
+        fh = getattr(self, fh_attr)
+        if fh is None:
+            fh = open(path, 'ab')
+            setattr(self, fh_attr, fh)
+        fh.write(data)
+        fh.flush()
+        return len(data)
+
+    def record_vote(self, user_id, candidate, ranking=None):
+        """Mark ``user_id`` as voted and append an anonymous ballot
+
+        Raises ``AlreadyVotedError`` if any process already recorded a ballot
+        for ``user_id``. The append is fsynced with the next batch.
+        """
+        (result,) = self._commit([(user_id, candidate, ranking)], durable=False)
+        if isinstance(result, AlreadyVotedError):
+            raise result
+        return result
+
+    def record_votes(self, ballots):
+        """Commit ballot tuples with one lock and one fsync
+
+        Returns once every ballot is on stable storage.
+        """
+        return self._commit(ballots, durable=True)
+
+    def _commit(self, ballots, durable):
+        results = []
+        # Also before the lock, whose file goes with a shard moved away
+        check_live(self.votes_path)
+        with self._lock, self._file_lock:
+            check_live(self.votes_path)
+            if self._journal is not None:
+                self._journal.prepare()
+            self._catch_up()
+            user_lines = []
+            vote_lines = []
+            votes_end = self._votes_end
+            for user_id, candidate, ranking in map(ballot_fields, ballots):
+                if user_id in self._voted:
+                    results.append(AlreadyVotedError(user_id))
+                    continue
+                vote_entry = {
+                    "candidate": candidate,
+                    "timestamp": _now_iso(),
+                    "vote_id": self._vote_count + 1
+                }
+                if ranking:
+                    vote_entry["ranking"] = list(ranking)
+                payload = _encode(vote_entry)[:-1]
+                line, digest = seal(payload, self._chain)
+                votes_end += len(line)
+                self._count(vote_entry)
+                self._link(payload, votes_end, digest)
+                self._voted.add(user_id)
+                user_lines.append(_encode(user_id))
+                vote_lines.append(line)
+                results.append(vote_entry)
+            if not user_lines:
+                return results
+
+            users_data = b"".join(user_lines)
+            votes_data = b"".join(vote_lines)
+            try:
+                if self._journal is not None:
+                    self._journal.begin([("users", self._users_end, users_data),
+                                         ("votes", self._votes_end, votes_data)])
+                # All voter marks go first; recovery without a journal relies on that order
+                self._users_end += self._append("_users_fh", self.users_path, users_data)
+                self._votes_end += self._append("_votes_fh", self.votes_path, votes_data)
+                if self._journal is not None:
+                    self._journal.commit()
+                self._write_checkpoints()
+            except BaseException:
+                # Resynchronize with whatever actually reached the logs
+                if self._journal is not None:
+                    self._journal.abort()
+                self.close()
+                self._replay()
+                raise
+
+            self._pending += len(user_lines)
+            if (durable or self._pending >= self.fsync_every
+                    or time.monotonic() - self._last_sync >= self.fsync_interval):
+                self.sync()
+
+            self._since_compact += len(user_lines)
+            if self.compact_every and self._since_compact >= self.compact_every:
+                self.compact()
+            return results
+
+    def sync(self):
+        """Flush pending appends to stable storage (the journal, when there is one)"""
+        with self._lock:
+            if self._journal is not None:
+                self._journal.sync()
+            else:
+                for fh in (self._users_fh, self._votes_fh):
+                    if fh is not None:
+                        os.fsync(fh.fileno())
+            self._pending = 0
+            self._last_sync = time.monotonic()
+
+    def compact(self):
+        """Checkpoint the ballot log so startup only replays what follows"""
+        with self._lock, self._file_lock:
+            self._catch_up()
+            self.sync()
+            checkpoint = {
+                "votes_offset": self._votes_end,
+                "vote_count": self._vote_count,
+                "tally": self._tally
+            }
+            atomic_write(self.checkpoint_path, json.dumps(checkpoint).encode("utf-8"))
+            self._since_compact = 0
+
+    def _tally_and_recount(self):
+        with self._lock, self._file_lock:
+            return self.tally(), self.recount()
+
+    def repair_tally(self):
+        with self._lock, self._file_lock:
+            self._catch_up()
+            self._tally = self.recount()
+            self.compact()
+
+    def import_legacy(self, votes_file, users_file):
+        """Replace the logs with the contents of the old whole-file JSON stores
+
+        The new logs are written to temp files and renamed into place, and the
+        legacy files are renamed to ``*.migrated`` only once both logs are in
+        place, so an import interrupted by a crash is simply redone on the
+        next start.
+        """
+        with self._lock, self._file_lock:
+            if not legacy_pending(votes_file, users_file):
+                return False
+            self.close()
+            ordered, legacy_users = read_legacy(votes_file, users_file)
+            vote_lines = []
+            chain = GENESIS
+            for i, vote in enumerate(ordered, 1):
+                line, chain = seal(_encode(dict(vote, vote_id=i))[:-1], chain)
+                vote_lines.append(line)
+            votes_data = b"".join(vote_lines)
+            users_data = b"".join(_encode(user_id) for user_id in legacy_users)
+            self._release()
+            for path in (self.checkpoint_path, self.merkle_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            atomic_write(self.votes_path, votes_data)
+            atomic_write(self.users_path, users_data)
+            retire_legacy(votes_file, users_file)
+            self._replay()
+            return True
+
+    def clear(self):
+        with self._lock, self._file_lock:
+            self._catch_up()
+            stored = bool(self._voted)
+            self.close()
+            self._release()
+            for path in (self.votes_path, self.users_path, self.checkpoint_path, self.merkle_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._replay()
+            return stored
+
+    # Snapshots (see storage.snapshot)
+
+    def _release(self):
+        """Make the files durable and out of the journal's reach, before they are removed,
+        replaced or moved (call with both locks held); the next replay covers the new ones"""
+        if self._journal is not None:
+            self._journal.checkpoint(release=True)
+
+    def _snapshot_paths(self):
+        return [self.votes_path, self.users_path, self.merkle_path, self.checkpoint_path]
+
+    def _committed_lengths(self):
+        """Committed length of each snapshot file (call with both locks held)"""
+        self._catch_up()
+        self._write_checkpoints()
+        return [self._votes_end, self._users_end, _file_size(self.merkle_path), _file_size(self.checkpoint_path)]
+
+    def snapshot(self, target_dir):
+        """Hard-link the committed logs into ``target_dir``; returns ``(files, tally)``"""
+        with self._lock, self._file_lock:
+            lengths = self._committed_lengths()
+            self.sync()
+            if self._journal is not None:
+                # The links must hold what the journal would otherwise redo
+                self._journal.checkpoint()
+            return freeze(self._snapshot_paths(), lengths, target_dir), dict(self._tally)
+
+    def detach(self, target_dir):
+        """Move the logs into ``target_dir`` and start over empty; returns ``(files, tally)``
+
+        Like ``clear``, but the ballots are kept, whatever their number, in
+        the time of a rename.
+        """
+        with self._lock, self._file_lock:
+            lengths = self._committed_lengths()
+            tally = dict(self._tally)
+            self.close()
+            self._release()
+            files = detach(self._snapshot_paths(), lengths, target_dir)
+            self._replay()
+            return files, tally
+
+    def retire(self):
+        with self._lock, self._file_lock:
+            write_tombstone(self.votes_path)
+
+    def restore(self, source_dir, files, retire_dir):
+        """Replace the logs with the snapshot ``files`` in ``source_dir``
+
+        The current logs are moved to ``retire_dir`` first; returns their
+        ``(files, tally)``.
+        """
+        with self._lock, self._file_lock:
+            retired = self.detach(retire_dir)
+            self._release()
+            thaw(source_dir, files, self._snapshot_paths())
+            self._replay()
+            return retired
+
+    def close(self):
+        with self._lock:
+            if self._users_fh is not None or self._votes_fh is not None:
+                self.sync()
+            for fh_attr in ("_users_fh", "_votes_fh"):
+                fh = getattr(self, fh_attr)
+                if fh is not None:
+                    fh.close()
+                    setattr(self, fh_attr, None)
+            if self._journal is not None:
+                self._journal.close()
+
+    # Reads
+
+    def has_voted(self, user_id):
+        self._catch_up()
+        return user_id in self._voted
+
+    def voted_users(self):
+        """List voters in the order they voted"""
+        with self._lock:
+            self._catch_up()
+            end = self._users_end
+        return list(self._read_records(self.users_path, 0, end))
+
+    def voters_since(self, cursor=None):
+        """See ``VoteStore.voters_since``; reads the users log from the cursor's offset"""
+        with self._lock:
+            self._catch_up()
+            epoch = (self._generation, self._users_identity)
+            end = self._users_end
+        if cursor is None or cursor[0] != epoch:
+            return (epoch, end), list(self._read_records(self.users_path, 0, end)), True
+        if cursor[1] == end:
+            return cursor, [], False
+        return (epoch, end), list(self._read_records(self.users_path, cursor[1], end)), False
+
+    def iter_votes(self):
+        """Stream every committed ballot from the log in commit order"""
+        with self._lock:
+            self._catch_up()
+            end = self._votes_end
+        return self._read_records(self.votes_path, 0, end)
+
+    def votes_after(self, vote_id):
+        """Stream the ballots numbered after ``vote_id``, reading from the Merkle
+        segment that holds it rather than from the start of the log"""
+        with self._lock:
+            self._catch_up()
+            end = self._votes_end
+            done = bisect.bisect_right([segment["last_vote"] for segment in self._segments], vote_id)
+            start = self._segments[done - 1]["end"] if done else 0
+        return (vote for vote in self._read_records(self.votes_path, start, end) if vote["vote_id"] > vote_id)
+
+    def vote_count(self):
+        self._catch_up()
+        return self._vote_count
+
+    def committed_span(self, cursor=None):
+        """Byte range of the ballot log committed since ``cursor``
+
+        Returns ``(start, end, cursor)``; pass the cursor back next time to
+        get only what was appended since. ``start`` is 0 when ``cursor`` is
+        None or the log was cleared or replaced in the meantime, so readers
+        can parse the new lines in bulk without replaying the whole log.
+        """
+        with self._lock:
+            self._catch_up()
+            end = self._votes_end
+            generation = (self._generation, self._votes_identity)
+        start = 0
+        if cursor is not None and cursor[0] == generation and cursor[1] <= end:
+            start = cursor[1]
+        return start, end, (generation, end)
+
+    def data_files(self):
+        return [self.votes_path, self.users_path]
+
+    def chain_head(self):
+        with self._lock:
+            self._catch_up()
+            return self._chain.hex()
+
+    def verify_chain(self, incremental=False, processes=None):
+        """Check the hash chain and the Merkle checkpoints, see ``storage.chain.verify_log``
+
+        With ``incremental``, segments already verified by this store are
+        trusted and only what was appended since is read. The log is only
+        locked while taking the snapshot to verify.
+        """
+        with self._lock, self._file_lock:
+            self._catch_up()
+            self._write_checkpoints()
+            end = self._votes_end
+        segments = read_checkpoints(self.merkle_path)
+        segments = [segment for segment in segments if segment["end"] <= end]
+        from_segment = min(self._verified_segments, len(segments)) if incremental else 0
+        report = verify_log(self.votes_path, segments, end, from_segment, processes)
+        if report["ok"]:
+            self._verified_segments = len(segments)
+        return report
+
+    def tally(self):
+        with self._lock:
+            self._catch_up()
+            return dict(self._tally)
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _identity(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino)
+
+
+def _encode(record):
+    return json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def _now_iso():
+    return datetime.now().isoformat()
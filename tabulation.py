@@ -0,0 +1,176 @@
+"""Ballot tabulation: plurality, instant-runoff (IRV) and Borda count.
+
+Ballots are encoded once into an ``int16`` matrix with one row per ballot
+and one column per rank, holding candidate indexes and ``-1`` for unused
+ranks. Every method then works on whole columns with NumPy, so an IRV
+round over a million ranked ballots is a handful of array operations
+rather than a Python loop per ballot.
+
+Each tabulation returns a dict::
+
+    {"method": "irv", "counts": {candidate: votes}, "winner": candidate or None,
+     "rounds": [{"counts": {...}, "eliminated": candidate or None}, ...]}
+
+``counts`` is the final round (for Borda, the points). ``winner`` is None
+on a tie.
+"""
+import numpy as np
+
+METHODS = ("plurality", "irv", "borda")
+
+
+def encode_ballots(rankings, candidates, max_ranks=None):
+    """Encode an iterable of rankings (lists of candidate names) as a ballot matrix
+
+    Unknown candidates and repeats within a ranking are dropped.
+    """
+    index = {candidate: i for i, candidate in enumerate(candidates)}
+    width = max_ranks or len(candidates)
+    flat = []
+    lengths = []
+    for ranking in rankings:
+        row = [index.get(candidate, -1) for candidate in ranking]
+        if -1 in row or len(set(row)) != len(row):
+            row = [i for i in dict.fromkeys(row) if i >= 0]
+        row = row[:width]
+        flat.extend(row)
+        lengths.append(len(row))
+    # Scatter the ranks into a -1 padded matrix in one assignment
+    lengths = np.asarray(lengths, dtype=np.int64)
+    ballots = np.full((len(lengths), width), -1, dtype=np.int16)
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    ballots[np.repeat(np.arange(len(lengths)), lengths), np.arange(len(flat)) - starts] = flat
+    return ballots
+
+
+def ballot_rankings(votes):
+    """Rankings from stored ballots; single-choice ballots rank one candidate"""
+    for vote in votes:
+        yield vote.get("ranking") or [vote["candidate"]]
+
+
+def first_choices(ballots, eliminated):
+    """Highest-ranked candidate still in the race per ballot, ``-1`` if exhausted"""
+    if ballots.shape[1] == 0:
+        return np.full(len(ballots), -1, dtype=np.int16)
+    alive = (ballots >= 0) & ~eliminated[np.maximum(ballots, 0)]
+    first = alive.argmax(axis=1)
+    choices = ballots[np.arange(len(ballots)), first]
+    return np.where(alive.any(axis=1), choices, -1)
+
+
+def _counts(choices, n_candidates):
+    return np.bincount(choices[choices >= 0], minlength=n_candidates)
+
+
+def _named(counts, candidates, keep=None):
+    return {candidate: int(counts[i]) for i, candidate in enumerate(candidates)
+            if keep is None or keep[i]}
+
+
+def _top(counts, candidates, keep=None):
+    counts = np.where(keep, counts, -1) if keep is not None else counts
+    leaders = np.flatnonzero(counts == counts.max())
+    if len(leaders) != 1 or counts.max() <= 0:
+        return None
+    return candidates[leaders[0]]
+
+
+def plurality(ballots, candidates):
+    counts = _counts(first_choices(ballots, np.zeros(len(candidates), dtype=bool)), len(candidates))
+    named = _named(counts, candidates)
+    return {"method": "plurality", "counts": named, "winner": _top(counts, candidates),
+            "rounds": [{"counts": named, "eliminated": None}]}
+
+
+def instant_runoff(ballots, candidates):
+    """Eliminate the last-placed candidate until one has a majority of live ballots
+
+    Only ballots whose current choice was just eliminated are looked at
+    again, so later rounds cost a fraction of the first. Ties for last
+    place go to the candidate with fewer first-round votes, then to the
+    one listed later.
+    """
+    n = len(candidates)
+    eliminated = np.zeros(n, dtype=bool)
+    choices = first_choices(ballots, eliminated)
+    counts = _counts(choices, n)
+    first_round = counts.copy()
+    rounds = []
+    while True:
+        remaining = np.flatnonzero(~eliminated)
+        leader = remaining[np.argmax(counts[remaining])]
+        if counts[leader] * 2 > counts.sum() or len(remaining) <= 2:
+            rounds.append({"counts": _named(counts, candidates, ~eliminated), "eliminated": None})
+            return {"method": "irv", "counts": rounds[-1]["counts"],
+                    "winner": _top(counts, candidates, ~eliminated), "rounds": rounds}
+        # Lowest count, then fewest first-round votes, then latest listed
+        order = np.lexsort((-remaining, first_round[remaining], counts[remaining]))
+        loser = remaining[order[0]]
+        rounds.append({"counts": _named(counts, candidates, ~eliminated), "eliminated": candidates[loser]})
+        eliminated[loser] = True
+        moved = np.flatnonzero(choices == loser)
+        transfers = first_choices(ballots[moved], eliminated)
+        choices[moved] = transfers
+        counts[loser] = 0
+        counts += _counts(transfers, n)
+
+
+def borda(ballots, candidates):
+    """Rank r (from 0) scores ``len(candidates) - 1 - r`` points"""
+    n = len(candidates)
+    ranked = ballots >= 0
+    points = np.broadcast_to(n - 1 - np.arange(ballots.shape[1]), ballots.shape)
+    scores = np.bincount(ballots[ranked], weights=points[ranked], minlength=n).astype(np.int64)
+    named = _named(scores, candidates)
+    return {"method": "borda", "counts": named, "winner": _top(scores, candidates),
+            "rounds": [{"counts": named, "eliminated": None}]}
+
+
+TABULATORS = {"plurality": plurality, "irv": instant_runoff, "borda": borda}
+
+
+def tabulate(ballots, candidates, method="plurality"):
+    return TABULATORS[method](ballots, candidates)
+
+
+class StreamingTally:
+    """Accumulate ballots in chunks and tabulate the partial result at any time
+
+    Plurality and Borda keep running totals, so each chunk costs O(chunk).
+    IRV needs every ballot for later rounds; chunks are kept and the
+    partial result is recomputed on request.
+    """
+
+    def __init__(self, candidates, method="plurality", max_ranks=None):
+        if method not in TABULATORS:
+            raise ValueError(f"unknown method {method!r}")
+        self.candidates = list(candidates)
+        self.method = method
+        self.max_ranks = max_ranks or len(self.candidates)
+        self.ballots = 0
+        self._totals = np.zeros(len(self.candidates), dtype=np.int64)
+        self._chunks = []
+
+    def add(self, ballots):
+        """Add a ballot matrix (see ``encode_ballots``)"""
+        self.ballots += len(ballots)
+        if self.method == "irv":
+            self._chunks.append(ballots)
+            return
+        result = TABULATORS[self.method](ballots, self.candidates)
+        self._totals += np.array([result["counts"][c] for c in self.candidates])
+
+    def add_rankings(self, rankings):
+        self.add(encode_ballots(rankings, self.candidates, self.max_ranks))
+
+    def result(self):
+        if self.method == "irv":
+            ballots = (np.concatenate(self._chunks) if self._chunks
+                       else np.empty((0, self.max_ranks), dtype=np.int16))
+            if len(self._chunks) > 1:
+                self._chunks = [ballots]
+            return instant_runoff(ballots, self.candidates)
+        named = _named(self._totals, self.candidates)
+        return {"method": self.method, "counts": named, "winner": _top(self._totals, self.candidates),
+                "rounds": [{"counts": named, "eliminated": None}]}